@@ -0,0 +1,227 @@
+"""Loan amortization schedules.
+
+Every approved loan gets a full repayment schedule in ``loan_schedule``: one
+row per monthly installment with its due date, payment, principal/interest
+split and the remaining balance. Schedules for any number of loans are
+computed at once with NumPy array arithmetic (closed-form annuity balances,
+no per-loan loop) and stored with ``executemany``.
+
+The schedule drives collection: the end-of-day batch (``eod.py``) collects
+the next unpaid installment once it is due, and a loan's outstanding
+principal is the balance after its last paid installment. Upcoming dues and
+projected interest are range scans on ``idx_loan_schedule_due``.
+
+    python amortization.py banking_v2.db                      # schedule newly approved loans
+    python amortization.py banking_v2.db --rate 6.5           # reprice every outstanding loan
+    python amortization.py banking_v2.db --rate 6.5 --loan 12 --loan 40
+
+Repricing re-amortizes the outstanding principal over the remaining term
+from the last paid installment; paid installments are left as they were.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from database import connect
+
+SCHEDULE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_loan_schedule_due ON loan_schedule (due_date, loan_id);",
+]
+
+# Schedule batches at least this large are loaded without the due-date index.
+BULK_ROWS = 200000
+
+_INSERT_SCHEDULE = """INSERT INTO loan_schedule (loan_id, installment_no, due_date, payment, principal, interest, balance)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+def installments(principal, annual_rate, term_months):
+    """Level monthly installment in cents for arrays of loans (annuity formula)."""
+    principal = np.asarray(principal, dtype=np.float64)
+    term = np.asarray(term_months, dtype=np.float64)
+    r = np.asarray(annual_rate, dtype=np.float64) / 1200.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        level = np.where(r > 0, principal * r / (1 - (1 + r) ** -term), principal / term)
+    return np.ceil(level).astype(np.int64)
+
+
+def _add_months(start, months):
+    """``start`` (datetime64[D]) plus whole ``months``, keeping the day of the
+    month where possible and clamping to the month's last day otherwise."""
+    month = start.astype("datetime64[M]")
+    day = (start - month.astype("datetime64[D]")).astype(np.int64)
+    target = month + months
+    length = ((target + 1).astype("datetime64[D]") - target.astype("datetime64[D]")).astype(np.int64)
+    return target.astype("datetime64[D]") + np.minimum(day, length - 1)
+
+
+def amortize(principal, annual_rate, term_months, start, paid=None):
+    """Computes schedules for arrays of loans.
+
+    ``principal`` is in cents, ``annual_rate`` in percent, ``start`` the
+    dates (datetime64[D]) the loans were drawn; installment ``k`` falls due
+    ``k`` months after ``start``. ``paid`` (default none) is the number of
+    installments already paid; the schedule then amortizes ``principal``
+    over the ``term_months`` installments that follow them.
+
+    Returns a dict of flat arrays, one element per installment: ``loan``
+    (index into the inputs), ``number``, ``due_date``, ``payment``,
+    ``principal``, ``interest`` and ``balance``. Payments are level except
+    the last, which clears the balance; principal parts always sum to the
+    principal exactly.
+    """
+    principal = np.asarray(principal, dtype=np.int64)
+    rate = np.asarray(annual_rate, dtype=np.float64) / 1200.0
+    term = np.asarray(term_months, dtype=np.int64)
+    start = np.asarray(start, dtype="datetime64[D]")
+    level = installments(principal, annual_rate, term)
+
+    loan = np.repeat(np.arange(len(principal)), term)
+    number = np.arange(len(loan)) - np.repeat(np.cumsum(term) - term, term) + 1
+    r, p, pmt = rate[loan], principal[loan].astype(np.float64), level[loan].astype(np.float64)
+    growth = (1 + r) ** number
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exact = np.where(r > 0, p * growth - pmt * (growth - 1) / np.where(r > 0, r, 1), p - pmt * number)
+    balance = np.maximum(np.round(exact), 0).astype(np.int64)
+    last = number == term[loan]
+    balance[last] = 0
+
+    opening = np.empty_like(balance)
+    opening[1:] = balance[:-1]
+    first = number == 1
+    opening[first] = principal[loan[first]]
+    principal_part = opening - balance
+    interest = np.where(last, np.round(opening * r).astype(np.int64), level[loan] - principal_part)
+    interest = np.maximum(interest, 0)
+    if paid is not None:
+        number = number + np.asarray(paid, dtype=np.int64)[loan]
+    return {
+        "loan": loan,
+        "number": number,
+        "due_date": _add_months(start[loan], number),
+        "payment": principal_part + interest,
+        "principal": principal_part,
+        "interest": interest,
+        "balance": balance,
+    }
+
+
+def _write_schedules(conn, loan_ids, schedule, delete_sql, delete_params=()):
+    """Deletes the rows being replaced, then bulk-inserts computed schedules.
+    Large batches run without the due-date index, which is rebuilt once
+    afterwards (much cheaper than maintaining it row by row)."""
+    bulk = len(schedule["loan"]) >= BULK_ROWS
+    if bulk:
+        conn.execute("DROP INDEX IF EXISTS idx_loan_schedule_due")
+    if delete_params:
+        conn.executemany(delete_sql, delete_params)
+    else:
+        conn.execute(delete_sql)
+    conn.executemany(_INSERT_SCHEDULE, zip(
+        np.asarray(loan_ids)[schedule["loan"]].tolist(), schedule["number"].tolist(),
+        np.datetime_as_string(schedule["due_date"]).tolist(), schedule["payment"].tolist(),
+        schedule["principal"].tolist(), schedule["interest"].tolist(), schedule["balance"].tolist()))
+    if bulk:
+        for statement in SCHEDULE_INDEXES:
+            conn.execute(statement)
+
+
+def _dates(values):
+    """ISO dates or timestamps (as SQLite stores them) as datetime64[D]."""
+    return np.array([str(value)[:10] for value in values], dtype="datetime64[D]")
+
+
+def open_loans(conn, loan_ids=None):
+    """Schedules approved loans that have no schedule yet and opens their
+    ``loan_positions`` row (repayments are taken from the customer's first
+    account). The schedule runs from the approval date. Returns how many
+    loans were opened."""
+    sql = """
+        SELECT l.loan_id, (SELECT MIN(account_id) FROM accounts a WHERE a.customer_id = l.customer_id),
+               l.loan_amount, l.interest_rate, l.term_months, COALESCE(l.approval_date, l.application_date)
+        FROM loans l
+        WHERE l.status = 'Approved' AND NOT EXISTS (SELECT 1 FROM loan_positions p WHERE p.loan_id = l.loan_id)"""
+    params = ()
+    if loan_ids is not None:
+        sql += f" AND l.loan_id IN ({', '.join('?' * len(loan_ids))})"
+        params = tuple(loan_ids)
+    rows = [row for row in conn.execute(sql, params).fetchall() if row[1] is not None]
+    if not rows:
+        return 0
+    ids, account_ids, principal, rate, term, start = (np.array(column) for column in zip(*rows))
+    schedule = amortize(principal, rate, term, _dates(start))
+    _write_schedules(conn, ids, schedule, "DELETE FROM loan_schedule WHERE loan_id = ?", [(i,) for i in ids.tolist()])
+    first = schedule["number"] == 1
+    conn.executemany(
+        "INSERT INTO loan_positions (loan_id, account_id, principal, installment, next_due) VALUES (?, ?, ?, ?, ?)",
+        zip(ids.tolist(), account_ids.tolist(), principal.tolist(),
+            schedule["payment"][first].tolist(), np.datetime_as_string(schedule["due_date"][first]).tolist()))
+    return len(rows)
+
+
+def reprice(conn, annual_rate, loan_ids=None):
+    """Sets the rate of outstanding loans (all, or ``loan_ids``) and
+    re-amortizes their outstanding principal over the remaining term. Due
+    dates stay as they were. Returns how many loans were repriced."""
+    sql = """
+        SELECT p.loan_id, p.principal, l.term_months - p.paid_installments, p.paid_installments,
+               COALESCE(l.approval_date, l.application_date)
+        FROM loan_positions p JOIN loans l ON l.loan_id = p.loan_id
+        WHERE p.principal > 0 AND l.term_months > p.paid_installments"""
+    params = ()
+    if loan_ids is not None:
+        sql += f" AND p.loan_id IN ({', '.join('?' * len(loan_ids))})"
+        params = tuple(loan_ids)
+    rows = conn.execute(sql, params).fetchall()
+    if not rows:
+        return 0
+    ids, principal, remaining, paid, start = (np.array(column) for column in zip(*rows))
+    schedule = amortize(principal, np.full(len(rows), float(annual_rate)), remaining, _dates(start), paid=paid)
+
+    conn.executemany("UPDATE loans SET interest_rate = ? WHERE loan_id = ?", ((float(annual_rate), i) for i in ids.tolist()))
+    if loan_ids is None:
+        _write_schedules(conn, ids, schedule, """DELETE FROM loan_schedule WHERE installment_no >
+            (SELECT paid_installments FROM loan_positions p WHERE p.loan_id = loan_schedule.loan_id AND p.principal > 0)""")
+    else:
+        _write_schedules(conn, ids, schedule, "DELETE FROM loan_schedule WHERE loan_id = ? AND installment_no > ?",
+                         list(zip(ids.tolist(), paid.tolist())))
+    first = np.r_[True, schedule["loan"][1:] != schedule["loan"][:-1]]
+    conn.executemany("UPDATE loan_positions SET installment = ? WHERE loan_id = ?",
+                     zip(schedule["payment"][first].tolist(), ids.tolist()))
+    return len(rows)
+
+
+def schedule_for(db, loan_id):
+    """Returns the schedule rows of one loan as
+    ``(installment_no, due_date, payment, principal, interest, balance, paid)``."""
+    return db.fetch_all("""
+        SELECT s.installment_no, s.due_date, s.payment, s.principal, s.interest, s.balance,
+               s.installment_no <= COALESCE(p.paid_installments, 0)
+        FROM loan_schedule s LEFT JOIN loan_positions p ON p.loan_id = s.loan_id
+        WHERE s.loan_id = ? ORDER BY s.installment_no""", (loan_id,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or reprice loan amortization schedules.")
+    parser.add_argument("db", help="SQLite file to process")
+    parser.add_argument("--rate", type=float, help="new annual rate in percent; reprices outstanding loans")
+    parser.add_argument("--loan", type=int, action="append", dest="loans", help="limit repricing to this loan (repeatable)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    conn = connect(args.db)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        opened = open_loans(conn)
+        repriced = reprice(conn, args.rate, args.loans) if args.rate is not None else 0
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    conn.close()
+    print(f"Done in {time.perf_counter() - started:.2f}s: {opened:,} loans scheduled, {repriced:,} repriced.")
+
+
+if __name__ == "__main__":
+    main()
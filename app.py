@@ -1,11 +1,27 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
-import hashlib
+import io
+import json
 import time
-from faker import Faker
 from datetime import datetime, timedelta
-import base64
+import assets
+import cashflow
+from amortization import schedule_for
+from approvals import SORTS, approve_customers, approve_loans, pending_page, reject_customers, reject_loans
+from audit import AuditWriter
+from audit_search import audit_actions, search_audit
+from database import Database, connect
+from ledger import LedgerEngine, PostingError
+from metrics import Metrics
+from money import Money, format_money, to_dollars
+from history import TRANSACTION_TYPES, customer_accounts, fetch_history_page
+from reports import balance_sheet, balance_trend, cash_flow, dashboard_metrics, income_statement, loan_dues, upcoming_dues
+from schema import migrate
+from snapshots import SnapshotManager
+from security import hash_password, verify_password
+from summary import read_summary, total
+from velocity import VelocityScreen
+# pandas, seed (faker), eod, export (pyarrow) and ingest are imported by the pages that use them,
+# so the login page and a new server process do not wait for them.
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -16,19 +32,9 @@ st.set_page_config(
 )
 
 # --- STYLING & ASSETS ---
-def get_image_as_base64(file):
-    """Reads a local image file and returns it as a base64 encoded string."""
-    try:
-        with open(file, "rb") as f:
-            data = f.read()
-        return base64.b64encode(data).decode()
-    except FileNotFoundError:
-        return None
-
-def load_login_css():
-    """Injects custom CSS exclusively for the login page."""
-    img_base64 = get_image_as_base64("background.png")
-    st.markdown(f"""
+def build_login_css(background):
+    """Builds the login page CSS around the given background-image declarations."""
+    return f"""
     <style>
         @import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600;700;900&display=swap');
         
@@ -39,7 +45,7 @@ def load_login_css():
         /* --- LOGIN PAGE STYLES (REFINED V4 - LOGIN ONLY) --- */
         .stApp {{
             background-color: #111827; /* Dark Gray/Blue Fallback */
-            background-image: url("data:image/png;base64,{img_base64}");
+            {background}
             background-size: cover;
         }}
 
@@ -115,11 +121,14 @@ def load_login_css():
         }}
 
     </style>
-    """, unsafe_allow_html=True)
+    """
 
-def load_dashboard_css():
-    """Injects simpler CSS for the main application dashboard."""
-    st.markdown("""
+def load_login_css():
+    """Injects custom CSS exclusively for the login page."""
+    background = assets.css_background(assets.prepare_image("background.png"), st.get_option("server.enableStaticServing"))
+    st.markdown(assets.cached_text("login_css", build_login_css, background), unsafe_allow_html=True)
+
+DASHBOARD_CSS = """
     <style>
         @import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600;700;900&display=swap');
         
@@ -147,148 +156,93 @@ def load_dashboard_css():
         .stButton>button:hover { transform: translateY(-2px); box-shadow: 0 6px 20px rgba(0, 0, 0, 0.3); }
         .stButton[kind="secondary"]>button { background: linear-gradient(90deg, #6b7280, #4b5563); }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def load_dashboard_css():
+    """Injects simpler CSS for the main application dashboard."""
+    st.markdown(DASHBOARD_CSS, unsafe_allow_html=True)
 
 # --- DATABASE SETUP ---
 DB_NAME = "banking_v2.db"
-
-class Database:
-    def __init__(self, db_name):
-        self.db_name = db_name
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-
-    def execute_query(self, query, params=()):
-        try:
-            self.cursor.execute(query, params)
-            self.conn.commit()
-            return self.cursor
-        except sqlite3.Error as e:
-            st.error(f"Database error: {e}")
-            return None
-
-    def fetch_one(self, query, params=()):
-        cursor = self.execute_query(query, params)
-        return cursor.fetchone() if cursor else None
-
-    def fetch_all(self, query, params=()):
-        cursor = self.execute_query(query, params)
-        return cursor.fetchall() if cursor else []
-
-    def close(self):
-        self.conn.close()
-
-db = Database(DB_NAME)
-
+AUDIT_POLICY = "relaxed" # "strict" writes each audit row before returning / in the posting's transaction
+SNAPSHOT_INTERVAL = 300 # seconds between reporting snapshots (see snapshots.py)
+
+@st.cache_resource
+def get_metrics():
+    """One metrics registry per process, shared by every session."""
+    return Metrics()
+
+@st.cache_resource
+def get_database():
+    """One connection pool per process; Streamlit re-runs this script on every interaction."""
+    return Database(DB_NAME, on_error=lambda e: st.error(f"Database error: {e}"), metrics=get_metrics())
+
+db = get_database()
+
+@st.cache_resource
+def get_audit_writer():
+    """One audit writer per process; Streamlit re-runs this script on every interaction."""
+    return AuditWriter(DB_NAME, policy=AUDIT_POLICY)
+
+@st.cache_resource
+def get_ledger():
+    """One ledger writer per process; Streamlit re-runs this script on every interaction."""
+    screen = VelocityScreen(audit=get_audit_writer())
+    screen.warm(DB_NAME)  # the last day of debits, so limits hold across restarts
+    return LedgerEngine(DB_NAME, audit=get_audit_writer(), metrics=get_metrics(), screen=screen)
+
+@st.cache_resource
+def get_snapshots():
+    """One snapshot refresher per process; staff reports read its copies instead of the live file."""
+    return SnapshotManager(DB_NAME, interval=SNAPSHOT_INTERVAL, metrics=get_metrics()).start()
+
+@st.cache_resource(show_spinner="Setting up the bank for the first time...")
 def setup_database():
-    # Customer Table: Added 'status' for approval workflow
-    db.execute_query("""
-    CREATE TABLE IF NOT EXISTS customers (
-        customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        first_name TEXT NOT NULL,
-        last_name TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        status TEXT NOT NULL DEFAULT 'Pending', -- Pending, Active, Rejected
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-
-    # Accounts, Transactions, Loans, Staff, and Audit Log tables remain the same
-    db.execute_query("""
-    CREATE TABLE IF NOT EXISTS accounts (
-        account_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER,
-        account_number TEXT UNIQUE NOT NULL,
-        account_type TEXT NOT NULL,
-        balance REAL NOT NULL DEFAULT 0.0,
-        is_active BOOLEAN DEFAULT 1,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
-    );""")
-    db.execute_query("""
-    CREATE TABLE IF NOT EXISTS transactions (
-        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        from_account_id INTEGER,
-        to_account_id INTEGER,
-        transaction_type TEXT NOT NULL,
-        amount REAL NOT NULL,
-        description TEXT,
-        transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (from_account_id) REFERENCES accounts(account_id),
-        FOREIGN KEY (to_account_id) REFERENCES accounts(account_id)
-    );""")
-    db.execute_query("""
-    CREATE TABLE IF NOT EXISTS loans (
-        loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER,
-        loan_amount REAL NOT NULL,
-        interest_rate REAL NOT NULL,
-        term_months INTEGER NOT NULL,
-        status TEXT NOT NULL DEFAULT 'Pending',
-        application_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        approval_date TIMESTAMP,
-        FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
-    );""")
-    db.execute_query("""
-    CREATE TABLE IF NOT EXISTS bank_staff (
-        staff_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        role TEXT NOT NULL
-    );""")
-    db.execute_query("""
-    CREATE TABLE IF NOT EXISTS audit_log (
-        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT,
-        action TEXT NOT NULL,
-        details TEXT,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );""")
+    """Migrates and, if empty, seeds the database once per process (see ``schema.migrate``).
+    Returns a dict whose ``seeded`` flag the first session to see it pops for its toast."""
+    conn = connect(DB_NAME)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+    return {"seeded": generate_synthetic_data()}
 
 # --- SYNTHETIC DATA GENERATION ---
-def generate_synthetic_data(num_customers=20):
+def generate_synthetic_data(num_customers=20, num_transactions=200):
     if db.fetch_one("SELECT COUNT(*) FROM customers")[0] > 0:
-        return
-    fake = Faker()
-    hashed_password = hash_password("adminpass")
-    db.execute_query("INSERT OR IGNORE INTO bank_staff (username, password_hash, role) VALUES (?, ?, ?)",
-                     ('admin', hashed_password, 'Manager'))
-
-    for i in range(num_customers):
-        first_name, last_name = fake.first_name(), fake.last_name()
-        email = f"{first_name.lower()}.{last_name.lower()}{i}@email.com"
-        password = f"custpass{i}"
-        
-        # Pre-approve some customers for demo purposes
-        status = 'Active' if i % 2 == 0 else 'Pending'
-        
-        customer_id = db.execute_query(
-            "INSERT INTO customers (first_name, last_name, email, password_hash, status) VALUES (?, ?, ?, ?, ?)",
-            (first_name, last_name, email, hash_password(password), status)
-        ).lastrowid
-        
-        if status == 'Active':
-            db.execute_query(
-                "INSERT INTO accounts (customer_id, account_number, account_type, balance) VALUES (?, ?, ?, ?)",
-                (customer_id, f"SAV{str(customer_id).zfill(8)}", 'Savings', fake.random_int(min=500, max=50000))
-            )
-            db.execute_query(
-                "INSERT INTO accounts (customer_id, account_number, account_type, balance) VALUES (?, ?, ?, ?)",
-                (customer_id, f"CHK{str(customer_id).zfill(8)}", 'Checking', fake.random_int(min=100, max=10000))
-            )
-    st.toast("Synthetic data generated!", icon="🎉")
+        return False
+    import seed
+    # Small demo bank; use `python seed.py` for scale-testing databases.
+    seed.generate(DB_NAME, seed.SeedConfig(customers=num_customers, transactions=num_transactions), bulk=False)
+    return True
 
 # --- SECURITY & HELPERS ---
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(stored_hash, provided_password):
-    return stored_hash == hash_password(provided_password)
-
 def log_audit(user_id, action, details=""):
-    db.execute_query("INSERT INTO audit_log (user_id, action, details) VALUES (?, ?, ?)",
-                     (str(user_id), action, details))
+    get_audit_writer().log(user_id, action, details)
+
+def report_db():
+    """The database staff reports read: the newest snapshot, or the live file until the first snapshot is ready."""
+    snapshot, database = get_snapshots().current()
+    return (snapshot, database) if snapshot else (None, db)
+
+def snapshot_caption(snapshot):
+    """Shows how current a report is, with a button to take a fresh snapshot now."""
+    col1, col2 = st.columns([4, 1])
+    if snapshot: col1.caption(f"As of {snapshot.taken_at:%Y-%m-%d %H:%M:%S} (reporting snapshot, refreshed every {SNAPSHOT_INTERVAL // 60} min).")
+    else: col1.caption("Live data (the first reporting snapshot is still being taken).")
+    if col2.button("Refresh Snapshot", use_container_width=True, key="snapshot_refresh"):
+        with st.spinner("Taking a snapshot..."):
+            get_snapshots().refresh()
+        st.rerun()
+
+def export_data(kind, db_name=DB_NAME, **options):
+    """Deferred download data: the export runs only when the button is clicked (on Streamlit's download thread)."""
+    def build():
+        import export
+        buffer = io.BytesIO()
+        export.export(db_name, kind, buffer, **options)
+        return buffer
+    return build
 
 # --- UI COMPONENTS & PAGES ---
 
@@ -402,7 +356,7 @@ def customer_dashboard():
         return
     total_balance = sum(acc[3] for acc in accounts)
     col1, col2 = st.columns(2)
-    col1.metric(label="Total Balance", value=f"${total_balance:,.2f}")
+    col1.metric(label="Total Balance", value=format_money(total_balance))
     col2.metric(label="Number of Accounts", value=len(accounts))
     st.subheader("Your Accounts")
     for acc in accounts:
@@ -410,13 +364,13 @@ def customer_dashboard():
             c1, c2, c3 = st.columns(3)
             c1.markdown(f"**{acc[2]} Account**")
             c2.markdown(f"*{acc[1]}*")
-            c3.markdown(f"**Balance: ${acc[3]:,.2f}**")
+            c3.markdown(f"**Balance: {format_money(acc[3])}**")
 
 def customer_transactions():
     customer_id = st.session_state['user_info'][0]
     accounts = db.fetch_all("SELECT account_id, account_number, account_type, balance FROM accounts WHERE customer_id = ?", (customer_id,))
     if not accounts: st.warning("You need an account to perform transactions."); return
-    account_options = {f"{acc[2]} ({acc[1]}) - Bal: ${acc[3]:,.2f}": acc[0] for acc in accounts}
+    account_options = {f"{acc[2]} ({acc[1]}) - Bal: {format_money(acc[3])}": acc[0] for acc in accounts}
     st.header("Perform a Transaction")
     tab1, tab2, tab3 = st.tabs(["💸 Transfer", "📥 Deposit", "📤 Withdraw"])
     with tab1: # Transfer
@@ -424,202 +378,416 @@ def customer_transactions():
         from_account_choice = st.selectbox("From Account", options=account_options.keys(), key="transfer_from")
         from_account_id = account_options[from_account_choice]
         to_account_number = st.text_input("Recipient Account Number")
-        amount = st.number_input("Amount", min_value=0.01, step=0.01, format="%.2f", key="transfer_amount")
+        amount = Money.of(st.number_input("Amount", min_value=0.01, step=0.01, format="%.2f", key="transfer_amount"))
         description = st.text_area("Description (Optional)", key="transfer_desc")
         if st.button("Execute Transfer"):
+            to_account = db.fetch_one("SELECT account_id FROM accounts WHERE account_number = ?", (to_account_number,))
+            if not to_account: st.error("Recipient account number does not exist."); return
+            to_account_id = to_account[0]
+            if from_account_id == to_account_id: st.error("Cannot transfer to the same account."); return
             try:
-                to_account = db.fetch_one("SELECT account_id FROM accounts WHERE account_number = ?", (to_account_number,))
-                if not to_account: st.error("Recipient account number does not exist."); return
-                to_account_id = to_account[0]
-                if from_account_id == to_account_id: st.error("Cannot transfer to the same account."); return
-                sender_balance = db.fetch_one("SELECT balance FROM accounts WHERE account_id = ?", (from_account_id,))[0]
-                if sender_balance < amount: st.error("Insufficient funds for this transfer."); return
-                db.execute_query("BEGIN TRANSACTION;")
-                db.execute_query("UPDATE accounts SET balance = balance - ? WHERE account_id = ?", (amount, from_account_id))
-                db.execute_query("UPDATE accounts SET balance = balance + ? WHERE account_id = ?", (amount, to_account_id))
-                db.execute_query("INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description) VALUES (?, ?, 'Transfer', ?, ?)", (from_account_id, to_account_id, amount, f"To {to_account_number}: {description}"))
-                #db.execute_query("COMMIT;")
-                st.success(f"Successfully transferred ${amount:,.2f} to account {to_account_number}.")
-                log_audit(customer_id, "Transfer Success", f"Amount: {amount}, From: {from_account_id}, To: {to_account_id}")
+                get_ledger().post_transfer(from_account_id, to_account_id, amount, f"To {to_account_number}: {description}",
+                                           audit=(customer_id, "Transfer Success", f"Amount: {amount}, From: {from_account_id}, To: {to_account_id}")).result()
+                st.success(f"Successfully transferred {amount} to account {to_account_number}.")
+            except PostingError as e:
+                st.error(f"Transfer rejected: {e}")
             except Exception as e:
-                db.execute_query("ROLLBACK;")
                 st.error(f"An error occurred. Transaction rolled back. Details: {e}")
     with tab2: # Deposit
         st.subheader("Deposit Funds")
         deposit_account_choice = st.selectbox("To Account", options=account_options.keys(), key="deposit_to")
         deposit_account_id = account_options[deposit_account_choice]
-        deposit_amount = st.number_input("Amount", min_value=0.01, step=0.01, format="%.2f", key="deposit_amount")
+        deposit_amount = Money.of(st.number_input("Amount", min_value=0.01, step=0.01, format="%.2f", key="deposit_amount"))
         if st.button("Make Deposit"):
             try:
-                db.execute_query("BEGIN TRANSACTION;")
-                db.execute_query("UPDATE accounts SET balance = balance + ? WHERE account_id = ?", (deposit_amount, deposit_account_id))
-                db.execute_query("INSERT INTO transactions (to_account_id, transaction_type, amount, description) VALUES (?, 'Deposit', ?, 'Cash/Check Deposit')", (deposit_account_id, deposit_amount))
-                #db.execute_query("COMMIT;")
-                st.success(f"Successfully deposited ${deposit_amount:,.2f}.")
-                log_audit(customer_id, "Deposit Success", f"Amount: {deposit_amount}, To: {deposit_account_id}")
+                get_ledger().post_deposit(deposit_account_id, deposit_amount,
+                                          audit=(customer_id, "Deposit Success", f"Amount: {deposit_amount}, To: {deposit_account_id}")).result()
+                st.success(f"Successfully deposited {deposit_amount}.")
             except Exception as e:
-                db.execute_query("ROLLBACK;"); st.error(f"Deposit failed. Error: {e}")
+                st.error(f"Deposit failed. Error: {e}")
     with tab3: # Withdraw
         st.subheader("Withdraw Funds")
         withdraw_account_choice = st.selectbox("From Account", options=account_options.keys(), key="withdraw_from")
         withdraw_account_id = account_options[withdraw_account_choice]
-        withdraw_amount = st.number_input("Amount", min_value=0.01, step=0.01, format="%.2f", key="withdraw_amount")
+        withdraw_amount = Money.of(st.number_input("Amount", min_value=0.01, step=0.01, format="%.2f", key="withdraw_amount"))
         if st.button("Make Withdrawal"):
-            current_balance = db.fetch_one("SELECT balance FROM accounts WHERE account_id = ?", (withdraw_account_id,))[0]
-            if current_balance < withdraw_amount: st.error("Insufficient funds.")
-            else:
-                try:
-                    db.execute_query("BEGIN TRANSACTION;")
-                    db.execute_query("UPDATE accounts SET balance = balance - ? WHERE account_id = ?", (withdraw_amount, withdraw_account_id))
-                    db.execute_query("INSERT INTO transactions (from_account_id, transaction_type, amount, description) VALUES (?, 'Withdrawal', ?, 'Cash Withdrawal')", (withdraw_account_id, withdraw_amount))
-                    #db.execute_query("COMMIT;")
-                    st.success(f"Successfully withdrew ${withdraw_amount:,.2f}.")
-                    log_audit(customer_id, "Withdrawal Success")
-                except Exception as e:
-                    db.execute_query("ROLLBACK;"); st.error(f"Withdrawal failed. Error: {e}")
+            try:
+                get_ledger().post_withdrawal(withdraw_account_id, withdraw_amount,
+                                             audit=(customer_id, "Withdrawal Success", f"Amount: {withdraw_amount}, From: {withdraw_account_id}")).result()
+                st.success(f"Successfully withdrew {withdraw_amount}.")
+            except PostingError as e:
+                st.error(f"Withdrawal rejected: {e}")
+            except Exception as e:
+                st.error(f"Withdrawal failed. Error: {e}")
 
 
 def customer_history():
+    import pandas as pd
     st.header("Transaction History")
     customer_id = st.session_state['user_info'][0]
-    query = """
-        SELECT t.transaction_date, t.description, t.transaction_type,
-            CASE WHEN t.from_account_id IN (SELECT account_id FROM accounts WHERE customer_id = ?) THEN -t.amount ELSE t.amount END as amount,
-            a.account_type || ' (' || a.account_number || ')' as account
-        FROM transactions t
-        JOIN accounts a ON a.account_id = CASE WHEN t.from_account_id IN (SELECT account_id FROM accounts WHERE customer_id = ?) THEN t.from_account_id ELSE t.to_account_id END
-        WHERE t.from_account_id IN (SELECT account_id FROM accounts WHERE customer_id = ?) OR t.to_account_id IN (SELECT account_id FROM accounts WHERE customer_id = ?)
-        ORDER BY t.transaction_date DESC;
-    """
-    transactions = db.fetch_all(query, (customer_id, customer_id, customer_id, customer_id))
-    if transactions:
-        df = pd.DataFrame(transactions, columns=["Date", "Description", "Type", "Amount ($)", "Account"])
-        df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d %H:%M:%S')
-        st.dataframe(df.style.apply(lambda x: ['color: red' if x.name == 'Amount ($)' and v < 0 else 'color: green' for v in x], axis=0), use_container_width=True, hide_index=True)
+    accounts = customer_accounts(db, customer_id)
+
+    with st.expander("Filters"):
+        c1, c2 = st.columns(2)
+        date_range = c1.date_input("Date Range", value=(), key="history_dates")
+        types = c2.multiselect("Type", TRANSACTION_TYPES, key="history_types")
+        c3, c4, c5 = st.columns(3)
+        min_amount = Money.of(c3.number_input("Min Amount ($)", min_value=0.0, value=0.0, step=10.0, key="history_min"))
+        max_amount = Money.of(c4.number_input("Max Amount ($) (0 = no limit)", min_value=0.0, value=0.0, step=10.0, key="history_max"))
+        page_size = c5.selectbox("Rows per page", [25, 50, 100, 250], index=1, key="history_page_size")
+    date_from = date_range[0] if len(date_range) > 0 else None
+    date_to = date_range[1] if len(date_range) > 1 else date_from
+
+    # Keyset pagination: keep a stack of page cursors, reset whenever the filters change.
+    filter_key = (customer_id, date_from, date_to, tuple(types), min_amount, max_amount, page_size)
+    if st.session_state.get('history_filter_key') != filter_key:
+        st.session_state['history_filter_key'] = filter_key
+        st.session_state['history_cursors'] = [None]
+    cursors = st.session_state['history_cursors']
+
+    page = fetch_history_page(
+        db, customer_id, page_size=page_size, cursor=cursors[-1], date_from=date_from, date_to=date_to,
+        transaction_types=types or None, min_amount=min_amount or None, max_amount=max_amount or None, accounts=accounts
+    )
+    if page.rows:
+        df = pd.DataFrame([row[1:] for row in page.rows], columns=["Date", "Description", "Type", "Amount ($)", "Account"])
+        df["Amount ($)"] = to_dollars(df["Amount ($)"])
+        styled = df.style.set_properties(color='green').apply(lambda col: (col < 0).map({True: 'color: red', False: 'color: green'}), subset=["Amount ($)"])
+        st.dataframe(styled, use_container_width=True, hide_index=True)
     else: st.info("No transaction history found.")
 
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    if prev_col.button("← Newer", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop(); st.rerun()
+    page_col.markdown(f"<div style='text-align: center;'>Page {len(cursors)}</div>", unsafe_allow_html=True)
+    if next_col.button("Older →", disabled=page.next_cursor is None, use_container_width=True):
+        cursors.append(page.next_cursor); st.rerun()
+    st.download_button("Download Statement (CSV)", export_data("statement", customer_id=customer_id, date_from=date_from, date_to=date_to),
+                       file_name=f"statement-{customer_id}.csv", mime="text/csv", on_click="ignore")
+
 def customer_loans():
+    import pandas as pd
     st.header("Loans"); customer_id = st.session_state['user_info'][0]
     tab1, tab2 = st.tabs(["Apply for a New Loan", "View My Loans"])
     with tab1:
         st.subheader("Loan Application Form")
         with st.form("loan_application"):
-            loan_amount = st.number_input("Loan Amount ($)", min_value=1000.0, step=100.0, format="%.2f")
+            loan_amount = Money.of(st.number_input("Loan Amount ($)", min_value=1000.0, step=100.0, format="%.2f"))
             term_months = st.selectbox("Loan Term (Months)", [12, 24, 36, 48, 60])
             if st.form_submit_button("Submit Application"):
                 db.execute_query("INSERT INTO loans (customer_id, loan_amount, interest_rate, term_months, status) VALUES (?, ?, ?, ?, 'Pending')", (customer_id, loan_amount, 5.0, term_months))
                 st.success("Your loan application has been submitted successfully!")
     with tab2:
         st.subheader("Your Loan Status")
-        loans = db.fetch_all("SELECT loan_amount, interest_rate, term_months, status, application_date FROM loans WHERE customer_id = ?", (customer_id,))
-        if loans: st.dataframe(pd.DataFrame(loans, columns=["Amount ($)", "Rate (%)", "Term (Months)", "Status", "Application Date"]), use_container_width=True, hide_index=True)
+        loans = db.fetch_all("SELECT loan_amount, interest_rate, term_months, status, application_date, loan_id FROM loans WHERE customer_id = ?", (customer_id,))
+        if loans:
+            df = pd.DataFrame([loan[:5] for loan in loans], columns=["Amount ($)", "Rate (%)", "Term (Months)", "Status", "Application Date"])
+            df["Amount ($)"] = to_dollars(df["Amount ($)"])
+            st.dataframe(df, use_container_width=True, hide_index=True)
+            for loan in loans:
+                schedule = schedule_for(db, loan[5]) if loan[3] == 'Approved' else []
+                if schedule:
+                    with st.expander(f"Repayment schedule - {format_money(loan[0])} over {loan[2]} months"):
+                        sdf = pd.DataFrame(schedule, columns=["#", "Due Date", "Payment ($)", "Principal ($)", "Interest ($)", "Balance ($)", "Paid"])
+                        for col in ["Payment ($)", "Principal ($)", "Interest ($)", "Balance ($)"]: sdf[col] = to_dollars(sdf[col])
+                        sdf["Paid"] = sdf["Paid"].astype(bool)
+                        st.dataframe(sdf, use_container_width=True, hide_index=True)
         else: st.info("You have not applied for any loans.")
 
 # --- Bank Staff Pages ---
 def bank_dashboard():
     st.title("Bank Administration Dashboard")
-    total_customers = db.fetch_one("SELECT COUNT(*) FROM customers WHERE status = 'Active'")[0]
-    pending_accounts = db.fetch_one("SELECT COUNT(*) FROM customers WHERE status = 'Pending'")[0]
-    total_deposits = db.fetch_one("SELECT SUM(balance) FROM accounts")[0]
-    pending_loans = db.fetch_one("SELECT COUNT(*) FROM loans WHERE status = 'Pending'")[0]
+    snapshot, reports_db = report_db()
+    snapshot_caption(snapshot)
+    metrics = dashboard_metrics(reports_db)
+    total_customers, pending_accounts = metrics["active_customers"], metrics["pending_customers"]
+    total_deposits, pending_loans = metrics["total_deposits"], metrics["pending_loans"]
 
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("Active Customers", total_customers)
     col2.metric("Pending Account Apps", pending_accounts, delta=pending_accounts, delta_color="inverse")
-    col3.metric("Total Deposits", f"${total_deposits:,.2f}")
+    col3.metric("Total Deposits", format_money(total_deposits))
     col4.metric("Pending Loan Apps", pending_loans, delta=pending_loans, delta_color="inverse")
     
+def approval_queue(kind, columns, approve, reject):
+    """Paginated queue of pending applications with batch approve/reject for the selected rows."""
+    import pandas as pd
+    notice = st.session_state.pop(f"{kind}_notice", None)
+    if notice: st.success(notice)
+    pending = total(read_summary(db), kind, "Pending")
+    if not pending:
+        st.info(f"No pending {'account' if kind == 'customers' else 'loan'} applications."); return
+    c1, c2, c3 = st.columns([2, 2, 1])
+    sort = c1.selectbox("Sort by", SORTS[kind], key=f"{kind}_sort")
+    page_size = c2.selectbox("Rows per page", [25, 50, 100, 250], index=1, key=f"{kind}_page_size")
+    c3.metric("Pending", f"{pending:,}")
+
+    # Keyset pagination, as in the transaction history; the version bump after a decision clears the selection.
+    filter_key = (sort, page_size)
+    if st.session_state.get(f"{kind}_filter_key") != filter_key:
+        st.session_state[f"{kind}_filter_key"] = filter_key
+        st.session_state[f"{kind}_cursors"] = [None]
+    cursors = st.session_state[f"{kind}_cursors"]
+    page = pending_page(db, kind, sort, page_size=page_size, cursor=cursors[-1])
+    if not page.rows and len(cursors) > 1:
+        cursors.pop(); st.rerun()
+    df = pd.DataFrame(page.rows, columns=columns)
+    if "Amount ($)" in df: df["Amount ($)"] = to_dollars(df["Amount ($)"])
+    version = st.session_state.get(f"{kind}_version", 0)
+    event = st.dataframe(df, use_container_width=True, hide_index=True, on_select="rerun", selection_mode="multi-row",
+                         key=f"{kind}_queue_{version}")
+    selected = df.iloc[event.selection.rows, 0].tolist()
+
+    col1, col2, col3, col4 = st.columns(4)
+    decision = None
+    if col1.button(f"Approve Selected ({len(selected)})", disabled=not selected, type="primary", use_container_width=True): decision = ("approved", approve)
+    if col2.button(f"Reject Selected ({len(selected)})", disabled=not selected, use_container_width=True): decision = ("rejected", reject)
+    if col3.button("← Previous", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop(); st.rerun()
+    if col4.button("Next →", disabled=page.next_cursor is None, use_container_width=True):
+        cursors.append(page.next_cursor); st.rerun()
+    if decision:
+        label, action = decision
+        try:
+            with db.transaction() as conn:
+                done = action(conn, selected, st.session_state['user_info'][0])
+        except Exception as e:
+            st.error(f"An error occurred; nothing was changed. Details: {e}"); return
+        skipped = len(selected) - len(done)
+        st.session_state[f"{kind}_notice"] = f"{len(done)} application(s) {label}." + (f" {skipped} skipped (already decided or no account to disburse to)." if skipped else "")
+        st.session_state[f"{kind}_version"] = version + 1
+        st.rerun()
+
 def bank_account_requests():
     """Page for admins to approve or reject new account applications."""
     st.header("New Account Applications")
-    pending_customers = db.fetch_all("SELECT customer_id, first_name, last_name, email, created_at FROM customers WHERE status = 'Pending'")
-
-    if not pending_customers:
-        st.info("No pending account applications.")
-        return
-
-    for cust in pending_customers:
-        cust_id, fname, lname, email, date = cust
-        with st.expander(f"Application from {fname} {lname} ({email}) - Submitted: {date.split()[0]}"):
-            col1, col2, _ = st.columns([1,1,4])
-            if col1.button("Approve", key=f"approve_cust_{cust_id}"):
-                try:
-                    # 1. Update customer status
-                    db.execute_query("UPDATE customers SET status = 'Active' WHERE customer_id = ?", (cust_id,))
-                    
-                    # 2. Create default accounts for the new customer
-                    db.execute_query("INSERT INTO accounts (customer_id, account_number, account_type, balance) VALUES (?, ?, 'Savings', 10.0)", (cust_id, f"SAV{str(cust_id).zfill(8)}"))
-                    db.execute_query("INSERT INTO accounts (customer_id, account_number, account_type, balance) VALUES (?, ?, 'Checking', 0.0)", (cust_id, f"CHK{str(cust_id).zfill(8)}"))
-                    
-                    st.success(f"Account for {fname} {lname} has been approved and created.")
-                    log_audit(st.session_state['user_info'][0], "Account Approved", f"Customer ID: {cust_id}")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
-
-            if col2.button("Reject", key=f"reject_cust_{cust_id}", type="secondary"):
-                db.execute_query("UPDATE customers SET status = 'Rejected' WHERE customer_id = ?", (cust_id,))
-                st.warning(f"Account for {fname} {lname} has been rejected.")
-                log_audit(st.session_state['user_info'][0], "Account Rejected", f"Customer ID: {cust_id}")
-                st.rerun()
+    approval_queue("customers", ["Customer ID", "Name", "Email", "Submitted"], approve_customers, reject_customers)
 
 def bank_loan_management():
     st.header("Loan Application Management")
-    pending_loans = db.fetch_all("SELECT l.loan_id, c.first_name || ' ' || c.last_name, l.loan_amount, l.term_months, l.application_date FROM loans l JOIN customers c ON l.customer_id = c.customer_id WHERE l.status = 'Pending'")
-    if not pending_loans: st.info("No pending loan applications."); return
-    for loan in pending_loans:
-        loan_id, name, amount, term, date = loan
-        with st.expander(f"Application from {name} for ${amount:,.2f}"):
-            st.write(f"**Applicant:** {name}"); st.write(f"**Amount:** ${amount:,.2f}"); st.write(f"**Term:** {term} months")
-            col1, col2 = st.columns(2)
-            if col1.button("Approve", key=f"approve_{loan_id}"):
-                db.execute_query("UPDATE loans SET status='Approved', approval_date=CURRENT_TIMESTAMP WHERE loan_id=?", (loan_id,))
-                customer_id = db.fetch_one("SELECT customer_id FROM loans WHERE loan_id = ?", (loan_id,))[0]
-                account_to_credit = db.fetch_one("SELECT account_id FROM accounts WHERE customer_id = ? LIMIT 1", (customer_id,))
-                if account_to_credit:
-                    try:
-                        db.execute_query("BEGIN TRANSACTION;")
-                        db.execute_query("UPDATE accounts SET balance = balance + ? WHERE account_id = ?", (amount, account_to_credit[0]))
-                        db.execute_query("INSERT INTO transactions (to_account_id, transaction_type, amount, description) VALUES (?, 'Loan Disbursement', ?, ?)", (account_to_credit[0], amount, f"Loan ID {loan_id}"))
-                        db.execute_query("COMMIT;")
-                        st.success(f"Loan {loan_id} approved and funds disbursed."); st.rerun()
-                    except Exception as e:
-                        db.execute_query("ROLLBACK;"); st.error(f"Failed to disburse funds: {e}")
-            if col2.button("Reject", key=f"reject_{loan_id}", type="secondary"):
-                db.execute_query("UPDATE loans SET status='Rejected' WHERE loan_id=?", (loan_id,))
-                st.warning(f"Loan {loan_id} rejected."); st.rerun()
+    approval_queue("loans", ["Loan ID", "Applicant", "Amount ($)", "Term (Months)", "Applied"], approve_loans, reject_loans)
 
 def bank_financial_reports():
+    import pandas as pd
+    import export
     st.header("Financial Reports")
-    report_type = st.selectbox("Select Report", ["Balance Sheet", "Income Statement", "Cash Flow Statement"])
+    report_type = st.selectbox("Select Report", ["Balance Sheet", "Income Statement", "Cash Flow Statement", "Loan Portfolio", "Ledger Export"])
+    snapshot, reports_db = report_db()
+    snapshot_caption(snapshot)
     if report_type == "Balance Sheet":
-        total_cash = db.fetch_one("SELECT SUM(balance) FROM accounts")[0] or 0
-        outstanding_loans = db.fetch_one("SELECT SUM(loan_amount) FROM loans WHERE status = 'Approved'")[0] or 0
-        assets = {'Category': ['Cash (Customer Deposits)', 'Loans Receivable'], 'Amount': [total_cash, outstanding_loans]}
-        liabilities = {'Category': ["Customer Deposits (Liability)", "Bank Equity"], 'Amount': [total_cash, outstanding_loans]} # Simplified equity
+        as_of = st.date_input("As of", value=None, max_value=datetime.now().date(), key="sheet_as_of")
+        sheet = balance_sheet(reports_db, as_of)
+        if as_of: st.caption(f"Balances at the end of {as_of:%Y-%m-%d}, from the nearest end-of-day balance checkpoint.")
+        total_cash, outstanding_loans = sheet["total_cash"], sheet["outstanding_loans"]
+        assets = {'Category': ['Cash (Customer Deposits)', 'Loans Receivable'], 'Amount': to_dollars(pd.Series([total_cash, outstanding_loans]))}
+        deposits_by_type = sheet["deposits_by_type"]
+        liabilities = {'Category': [f"Customer Deposits - {t} (Liability)" for t in deposits_by_type] + ["Bank Equity"],
+                       'Amount': to_dollars(pd.Series(list(deposits_by_type.values()) + [outstanding_loans]))} # Simplified equity
         col1, col2 = st.columns(2)
-        with col1: st.write("**Assets**"); st.dataframe(pd.DataFrame(assets), hide_index=True); st.metric("Total Assets", f"${(total_cash + outstanding_loans):,.2f}")
-        with col2: st.write("**Liabilities & Equity**"); st.dataframe(pd.DataFrame(liabilities), hide_index=True); st.metric("Total Liab. & Equity", f"${(total_cash + outstanding_loans):,.2f}")
-    
+        with col1: st.write("**Assets**"); st.dataframe(pd.DataFrame(assets), hide_index=True); st.metric("Total Assets", format_money(total_cash + outstanding_loans))
+        with col2: st.write("**Liabilities & Equity**"); st.dataframe(pd.DataFrame(liabilities), hide_index=True); st.metric("Total Liab. & Equity", format_money(total_cash + outstanding_loans))
+    elif report_type == "Income Statement":
+        date_range = st.date_input("Period", value=(), key="income_dates")
+        date_from = date_range[0] if len(date_range) > 0 else None
+        date_to = date_range[1] if len(date_range) > 1 else date_from
+        statement = income_statement(reports_db, date_from, date_to)
+        if not statement["business_days"]:
+            st.info("No end-of-day runs in this period yet. Run the end-of-day batch to accrue interest."); return
+        income = {'Item': ['Interest Income - Loans', 'Interest Expense - Deposits', 'Net Interest Income'],
+                  'Amount': to_dollars(pd.Series([statement["loan_interest_income"], -statement["deposit_interest_expense"], statement["net_interest_income"]]))}
+        cash = {'Item': ['Loan Interest Collected', 'Loan Principal Collected', 'Deposit Interest Credited'],
+                'Amount': to_dollars(pd.Series([statement["loan_interest_collected"], statement["loan_principal_collected"], statement["deposit_interest_paid"]]))}
+        col1, col2 = st.columns(2)
+        with col1: st.write("**Income Statement (accrual basis)**"); st.dataframe(pd.DataFrame(income), hide_index=True); st.metric("Net Interest Income", format_money(statement["net_interest_income"]))
+        with col2: st.write("**Cash Basis**"); st.dataframe(pd.DataFrame(cash), hide_index=True); st.metric("Missed Installments", statement["installments_missed"])
+        st.caption(f"{statement['business_days']} business day(s) processed in this period.")
+    elif report_type == "Cash Flow Statement":
+        if not snapshot: cashflow.refresh(DB_NAME)  # adds only the postings since the last refresh; snapshots are caught up when taken
+        date_range = st.date_input("Period", value=(), key="cashflow_dates")
+        date_from = date_range[0] if len(date_range) > 0 else None
+        date_to = date_range[1] if len(date_range) > 1 else date_from
+        flows = cash_flow(reports_db, date_from, date_to)
+        if not flows:
+            st.info("No transactions in this period."); return
+        # Compare with the period of the same length just before it.
+        prior = cash_flow(reports_db, date_from - (date_to - date_from) - timedelta(days=1), date_from - timedelta(days=1)) if date_from else {}
+        rows = [(kind, f["count"], f["inflow"], f["outflow"], f["inflow"] - f["outflow"],
+                 prior.get(kind, {}).get("inflow", 0) - prior.get(kind, {}).get("outflow", 0), f["amount"]) for kind, f in flows.items()]
+        df = pd.DataFrame(rows, columns=["Type", "Count", "Inflow ($)", "Outflow ($)", "Net ($)", "Prior Period Net ($)", "Volume ($)"])
+        for column in ["Inflow ($)", "Outflow ($)", "Net ($)", "Prior Period Net ($)", "Volume ($)"]: df[column] = to_dollars(df[column])
+        if not date_from: df = df.drop(columns=["Prior Period Net ($)"])
+        inflow, outflow = sum(f["inflow"] for f in flows.values()), sum(f["outflow"] for f in flows.values())
+        prior_net = sum(f["inflow"] - f["outflow"] for f in prior.values())
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Cash In", format_money(inflow)); col2.metric("Cash Out", format_money(outflow))
+        col3.metric("Net Cash Flow", format_money(inflow - outflow), format_money(inflow - outflow - prior_net) if date_from else None)
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        st.caption("Transfers move money between customer accounts and do not change the bank's cash position.")
+        trend = balance_trend(reports_db, date_to)
+        if trend:
+            st.write("**Month-End Balances**")
+            trend_df = pd.DataFrame(trend, columns=["Month", "Deposits", "Disbursed", "Repaid"]).set_index("Month")
+            st.line_chart(pd.DataFrame({"Customer Deposits ($)": to_dollars(trend_df["Deposits"]),
+                                        "Loans Receivable ($)": to_dollars(trend_df["Disbursed"] - trend_df["Repaid"])}))
+    elif report_type == "Loan Portfolio":
+        today = datetime.now().date()
+        horizon = st.selectbox("Due within", [7, 30, 90, 365], index=1, format_func=lambda d: f"{d} days", key="dues_horizon")
+        dues = loan_dues(reports_db, today, today + timedelta(days=horizon))
+        overdue = loan_dues(reports_db, "0000-01-01", today - timedelta(days=1))
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Outstanding Principal", format_money(balance_sheet(reports_db)["outstanding_loans"]))
+        col2.metric(f"Due in {horizon} Days", format_money(dues["payment"]), f"{dues['installments']} installments", delta_color="off")
+        col3.metric("Scheduled Interest", format_money(dues["interest"]))
+        col4.metric("Overdue", format_money(overdue["payment"]), f"{overdue['installments']} installments", delta_color="inverse")
+        rows = upcoming_dues(reports_db, "0000-01-01", today + timedelta(days=horizon))
+        if rows:
+            df = pd.DataFrame(rows, columns=["Due Date", "Loan ID", "Customer", "Installment", "Payment ($)", "Earlier Unpaid"])
+            df["Payment ($)"] = to_dollars(df["Payment ($)"])
+            st.dataframe(df, use_container_width=True, hide_index=True)
+        else: st.info("No installments due in this period.")
+    elif report_type == "Ledger Export":
+        col1, col2 = st.columns(2)
+        date_range = col1.date_input("Period", value=(), key="export_dates")
+        fmt = col2.selectbox("Format", ["CSV (gzip)", "Parquet"] if export.pa is not None else ["CSV (gzip)"], key="export_format")
+        date_from = date_range[0] if len(date_range) > 0 else None
+        date_to = date_range[1] if len(date_range) > 1 else date_from
+        file_name = f"ledger-{date_from or 'all'}-{date_to or 'all'}"
+        if fmt == "Parquet":
+            data, file_name, mime = export_data("ledger", snapshot.name if snapshot else DB_NAME, fmt="parquet", date_from=date_from, date_to=date_to), f"{file_name}.parquet", "application/vnd.apache.parquet"
+        else:
+            data, file_name, mime = export_data("ledger", snapshot.name if snapshot else DB_NAME, compress=True, date_from=date_from, date_to=date_to), f"{file_name}.csv.gz", "application/gzip"
+        st.download_button("Export Ledger", data, file_name=file_name, mime=mime, type="primary", on_click="ignore")
+        st.caption("The file is built when you click. For multi-gigabyte extracts use `python export.py` on the server instead.")
+
+def bank_end_of_day():
+    import pandas as pd
+    import eod
+    st.header("End of Day")
+    business_date = st.date_input("Business Date", value=datetime.now().date(), key="eod_date")
+    if st.button("Run End of Day", type="primary"):
+        status = st.empty()
+        try:
+            with st.spinner("Accruing interest and collecting loan installments..."):
+                counts = eod.run(DB_NAME, business_date, progress=status.write)
+        except eod.EodError as e:
+            st.error(str(e)); return
+        if counts["already_done"]:
+            st.info(f"End of day for {counts['business_date']} has already run.")
+        else:
+            st.success(f"End of day for {counts['business_date']} finished in {counts['seconds']}s: "
+                       f"{counts['accounts']:,} accounts, {counts['loans']:,} loans, {counts['balances']:,} balances checkpointed.")
+            log_audit(st.session_state['user_info'][0], "End of Day Run", f"Business date: {counts['business_date']}")
+    runs = db.fetch_all("SELECT business_date, phase, started_at, finished_at FROM eod_runs ORDER BY business_date DESC LIMIT 30")
+    if runs: st.dataframe(pd.DataFrame(runs, columns=["Business Date", "Phase", "Started", "Finished"]), use_container_width=True, hide_index=True)
+    else: st.info("End of day has not run yet.")
+
+def bank_bulk_postings():
+    import ingest
+    st.header("Bulk Postings")
+    st.caption("Post a payroll or settlement batch: CSV or JSON Lines with `type`, `from_account`, `to_account`, `amount` and `description`.")
+    batch = st.file_uploader("Batch File", type=["csv", "jsonl", "ndjson", "json"], key="ingest_file")
+    atomic = st.radio("If some lines are rejected", ["chunk", "batch"], horizontal=True, key="ingest_atomic",
+                      format_func=lambda a: {"chunk": "Post the valid lines", "batch": "Post nothing (all-or-nothing)"}[a])
+    if st.button("Post Batch", type="primary", disabled=batch is None):
+        rejects = io.StringIO()
+        status = st.empty()
+        try:
+            with st.spinner("Posting..."):
+                counts = ingest.ingest(DB_NAME, io.TextIOWrapper(batch, encoding="utf-8-sig", newline=""), fmt=ingest.format_for(batch.name),
+                                       atomic=atomic, rejects=rejects, user_id=st.session_state['user_info'][0], source=batch.name,
+                                       progress=status.write)
+        except (ingest.IngestError, UnicodeDecodeError) as e:
+            st.error(f"Could not read the batch: {e}"); return
+        status.empty()
+        if counts["committed"]:
+            st.success(f"Posted {counts['posted']:,} of {counts['lines']:,} lines ({format_money(counts['amount'])}) in {counts['seconds']}s.")
+        else:
+            st.error(f"Nothing was posted: {counts['rejected']:,} of {counts['lines']:,} lines were rejected.")
+        if counts["rejected"]:
+            st.warning(f"{counts['rejected']:,} line(s) rejected.")
+            st.download_button("Download Rejects", rejects.getvalue(), file_name=f"{batch.name}.rejects.csv", mime="text/csv", on_click="ignore")
+
 def bank_audit_log():
+    import pandas as pd
     st.header("System Audit Log")
-    logs = db.fetch_all("SELECT timestamp, user_id, action, details FROM audit_log ORDER BY timestamp DESC LIMIT 1000")
-    if logs: st.dataframe(pd.DataFrame(logs, columns=["Timestamp", "User ID", "Action", "Details"]), use_container_width=True, hide_index=True)
+    snapshot, reports_db = report_db()
+    snapshot_caption(snapshot)
+    with st.expander("Search", expanded=True):
+        c1, c2, c3 = st.columns(3)
+        text = c1.text_input("Details contain", key="audit_text", help='All words must appear; use "quotes" for a phrase.')
+        user_id = c2.text_input("User ID", key="audit_user").strip()
+        account_id = c3.number_input("Account ID (From/To)", min_value=0, value=0, step=1, key="audit_account")
+        c4, c5, c6 = st.columns(3)
+        actions = c4.multiselect("Action", audit_actions(reports_db), key="audit_actions")
+        date_range = c5.date_input("Date Range", value=(), key="audit_dates")
+        page_size = c6.selectbox("Rows per page", [50, 100, 250, 500], index=1, key="audit_page_size")
+    date_from = date_range[0] if len(date_range) > 0 else None
+    date_to = date_range[1] if len(date_range) > 1 else date_from
+
+    # Keyset pagination, as in the transaction history.
+    filter_key = (text, user_id, account_id, tuple(actions), date_from, date_to, page_size)
+    if st.session_state.get('audit_filter_key') != filter_key:
+        st.session_state['audit_filter_key'] = filter_key
+        st.session_state['audit_cursors'] = [None]
+    cursors = st.session_state['audit_cursors']
+    page = search_audit(reports_db, page_size=page_size, cursor=cursors[-1], user_id=user_id or None, actions=actions or None,
+                        date_from=date_from, date_to=date_to, text=text, account_id=account_id or None)
+    if page.rows: st.dataframe(pd.DataFrame([row[1:] for row in page.rows], columns=["Timestamp", "User ID", "Action", "Details"]), use_container_width=True, hide_index=True)
     else: st.info("No audit logs found.")
 
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    if prev_col.button("← Newer", disabled=len(cursors) == 1, use_container_width=True, key="audit_newer"):
+        cursors.pop(); st.rerun()
+    page_col.markdown(f"<div style='text-align: center;'>Page {len(cursors)}</div>", unsafe_allow_html=True)
+    if next_col.button("Older →", disabled=page.next_cursor is None, use_container_width=True, key="audit_older"):
+        cursors.append(page.next_cursor); st.rerun()
+
+def bank_performance():
+    import pandas as pd
+    st.header("Performance")
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    st.caption(f"Collected since {snapshot['since']} by this server process.")
+    lock_waits = snapshot["lock_waits"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Statements", f"{sum(q['count'] for q in snapshot['queries']):,}")
+    col2.metric("Page Renders", f"{sum(p['count'] for p in snapshot['pages']):,}")
+    col3.metric("Write Lock Waits (p95)", f"{lock_waits['p95_ms']:,.1f} ms", f"{lock_waits['count']:,} acquired", delta_color="off")
+    col4.metric("Lock Errors", f"{lock_waits['lock_errors']:,}")
+
+    timing_columns = ["count", "total_ms", "mean_ms", "p50_ms", "p95_ms", "max_ms"]
+    st.subheader("Pages")
+    if snapshot["pages"]: st.dataframe(pd.DataFrame(snapshot["pages"], columns=["page"] + timing_columns), use_container_width=True, hide_index=True)
+    else: st.info("No page renders recorded yet.")
+    st.subheader("Statements")
+    if snapshot["queries"]: st.dataframe(pd.DataFrame(snapshot["queries"], columns=["sql"] + timing_columns + ["rows", "errors"]), use_container_width=True, hide_index=True)
+    else: st.info("No statements recorded yet.")
+
+    st.subheader("Slow Queries")
+    threshold = st.number_input("Threshold (ms)", min_value=1, value=int(metrics.slow_threshold * 1000), step=10, key="perf_threshold")
+    metrics.slow_threshold = threshold / 1000
+    if not snapshot["slow_queries"]: st.info("No statement has exceeded the threshold.")
+    for slow in snapshot["slow_queries"]:
+        with st.expander(f"{slow['at']} · {slow['ms']:,.1f} ms · {slow['rows']:,} rows · {slow['sql'][:80]}"):
+            st.code(slow["sql"], language="sql")
+            st.code("\n".join(slow["plan"]) or "(no plan captured)", language="text")
+
+    col1, col2, col3 = st.columns(3)
+    col1.download_button("Download JSON", lambda: json.dumps(get_metrics().snapshot(), indent=2), file_name="metrics.json",
+                         mime="application/json", on_click="ignore", use_container_width=True)
+    col2.download_button("Download Prometheus", lambda: get_metrics().prometheus(), file_name="metrics.prom",
+                         mime="text/plain", on_click="ignore", use_container_width=True)
+    if col3.button("Reset", use_container_width=True):
+        metrics.reset(); st.rerun()
+
 # --- MAIN APP LOGIC ---
 def main():
-    setup_database()
+    if setup_database().pop("seeded", False):
+        st.toast("Synthetic data generated!", icon="🎉")
 
     if 'logged_in' not in st.session_state:
         st.session_state.update({'logged_in': False, 'user_type': None, 'user_info': None})
 
-    if 'data_generated' not in st.session_state:
-        with st.spinner('Setting up the bank for the first time...'):
-            generate_synthetic_data()
-            st.session_state['data_generated'] = True
-            time.sleep(1)
-
     if not st.session_state['logged_in']:
         load_login_css()
         login_page()
@@ -635,7 +803,7 @@ def main():
             elif st.session_state['user_type'] == 'staff':
                 st.subheader(f"Welcome {user_info[1]}")
                 st.write(f"Role: {user_info[3]}")
-                page_options = ["Dashboard", "Account Requests", "Loan Management", "Financial Reports", "Audit Log"]
+                page_options = ["Dashboard", "Account Requests", "Loan Management", "Financial Reports", "Bulk Postings", "End of Day", "Audit Log", "Performance"]
 
             page = st.radio("Navigation", page_options, label_visibility="collapsed")
 
@@ -646,18 +814,22 @@ def main():
                 st.rerun()
 
         # Page Display Logic
-        if st.session_state['user_type'] == 'customer':
-            if page == "Dashboard": customer_dashboard()
-            elif page == "Transactions": customer_transactions()
-            elif page == "History": customer_history()
-            elif page == "Loans": customer_loans()
-        
-        elif st.session_state['user_type'] == 'staff':
-            if page == "Dashboard": bank_dashboard()
-            elif page == "Account Requests": bank_account_requests()
-            elif page == "Loan Management": bank_loan_management()
-            elif page == "Financial Reports": bank_financial_reports()
-            elif page == "Audit Log": bank_audit_log()
+        with get_metrics().page_timer(f"{st.session_state['user_type']}: {page}"):
+            if st.session_state['user_type'] == 'customer':
+                if page == "Dashboard": customer_dashboard()
+                elif page == "Transactions": customer_transactions()
+                elif page == "History": customer_history()
+                elif page == "Loans": customer_loans()
+
+            elif st.session_state['user_type'] == 'staff':
+                if page == "Dashboard": bank_dashboard()
+                elif page == "Account Requests": bank_account_requests()
+                elif page == "Loan Management": bank_loan_management()
+                elif page == "Financial Reports": bank_financial_reports()
+                elif page == "Bulk Postings": bank_bulk_postings()
+                elif page == "End of Day": bank_end_of_day()
+                elif page == "Audit Log": bank_audit_log()
+                elif page == "Performance": bank_performance()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,156 @@
+"""Approval queues for account and loan applications.
+
+Pending applications are read a page at a time by keyset (the sort value
+and id of the last row shown), from ``idx_customers_status`` /
+``idx_loans_status``, so page N of a queue with thousands of applications
+costs the same as page one.
+
+Decisions are taken for a whole selection at once: each ``approve_*`` /
+``reject_*`` function runs a fixed handful of set-based statements over the
+selected ids, whatever their number, inside the caller's transaction.
+Applications that are no longer pending (decided by someone else in the
+meantime) are skipped.
+"""
+import json
+from collections import namedtuple
+
+from amortization import open_loans
+from money import Money
+
+QueuePage = namedtuple("QueuePage", "rows next_cursor")
+
+APPROVAL_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_customers_status ON customers (status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_loans_status ON loans (status, application_date)",
+]
+
+# Opening deposit credited to the savings account of every approved customer.
+OPENING_DEPOSIT = Money.of(10)
+
+_QUEUES = {
+    "customers": {
+        "id": "c.customer_id",
+        "select": "c.customer_id, c.first_name || ' ' || c.last_name, c.email, c.created_at",
+        "from": "customers c",
+        "where": "c.status = 'Pending'",
+        "sorts": {
+            "Oldest first": ("c.created_at", "ASC"),
+            "Newest first": ("c.created_at", "DESC"),
+            "Name": ("c.last_name || ' ' || c.first_name", "ASC"),
+        },
+    },
+    "loans": {
+        "id": "l.loan_id",
+        "select": "l.loan_id, c.first_name || ' ' || c.last_name, l.loan_amount, l.term_months, l.application_date",
+        "from": "loans l JOIN customers c ON c.customer_id = l.customer_id",
+        "where": "l.status = 'Pending'",
+        "sorts": {
+            "Oldest first": ("l.application_date", "ASC"),
+            "Newest first": ("l.application_date", "DESC"),
+            "Largest amount": ("l.loan_amount", "DESC"),
+            "Smallest amount": ("l.loan_amount", "ASC"),
+        },
+    },
+}
+
+SORTS = {kind: list(queue["sorts"]) for kind, queue in _QUEUES.items()}
+
+
+def pending_page(db, kind, sort, page_size=50, cursor=None):
+    """Returns one ``QueuePage`` of pending ``"customers"`` or ``"loans"`` in
+    ``sort`` order (one of ``SORTS[kind]``). ``cursor`` is the previous page's
+    ``next_cursor``; rows are the queue's select columns, id first."""
+    queue = _QUEUES[kind]
+    key, direction = queue["sorts"][sort]
+    clauses, params = [queue["where"]], []
+    if cursor is not None:
+        op = ">" if direction == "ASC" else "<"
+        clauses.append(f"({key} {op} ? OR ({key} = ? AND {queue['id']} {op} ?))")
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    rows = db.fetch_all(f"""
+        SELECT {queue['select']}, {key}
+        FROM {queue['from']}
+        WHERE {' AND '.join(clauses)}
+        ORDER BY {key} {direction}, {queue['id']} {direction}
+        LIMIT ?""", (*params, page_size + 1))
+    next_cursor = (rows[page_size - 1][-1], rows[page_size - 1][0]) if len(rows) > page_size else None
+    return QueuePage([row[:-1] for row in rows[:page_size]], next_cursor)
+
+
+def _decide(conn, table, id_column, ids, status, extra=""):
+    """Moves the still-pending rows among ``ids`` to ``status``; returns their ids."""
+    return [row[0] for row in conn.execute(f"""
+        UPDATE {table} SET status = ?{extra}
+        WHERE {id_column} IN (SELECT value FROM json_each(?)) AND status = 'Pending'
+        RETURNING {id_column}""", (status, json.dumps([int(i) for i in ids])))]
+
+
+def _audit(conn, user_id, action, label, ids):
+    conn.execute("INSERT INTO audit_log (user_id, action, details) SELECT ?, ?, ? || value FROM json_each(?)",
+                 (str(user_id), action, f"{label}: ", json.dumps(ids)))
+
+
+def approve_customers(conn, customer_ids, user_id):
+    """Activates pending customers and opens their savings (with the opening
+    deposit) and checking accounts. Returns the approved ids."""
+    approved = _decide(conn, "customers", "customer_id", customer_ids, "Active")
+    if not approved:
+        return []
+    selection = json.dumps(approved)
+    conn.execute("""
+        INSERT INTO accounts (customer_id, account_number, account_type, balance)
+        SELECT value, 'SAV' || printf('%08d', value), 'Savings', ? FROM json_each(?)
+        UNION ALL
+        SELECT value, 'CHK' || printf('%08d', value), 'Checking', 0 FROM json_each(?)""",
+                 (OPENING_DEPOSIT, selection, selection))
+    conn.execute("""
+        INSERT INTO transactions (to_account_id, transaction_type, amount, description)
+        SELECT account_id, 'Deposit', balance, 'Opening Balance' FROM accounts
+        WHERE account_number IN (SELECT 'SAV' || printf('%08d', value) FROM json_each(?)) AND balance > 0""", (selection,))
+    _audit(conn, user_id, "Account Approved", "Customer ID", approved)
+    return approved
+
+
+def reject_customers(conn, customer_ids, user_id):
+    """Rejects pending customers. Returns the rejected ids."""
+    rejected = _decide(conn, "customers", "customer_id", customer_ids, "Rejected")
+    if rejected:
+        _audit(conn, user_id, "Account Rejected", "Customer ID", rejected)
+    return rejected
+
+
+def approve_loans(conn, loan_ids, user_id):
+    """Approves pending loans, disburses each into the borrower's first account
+    and schedules it. Loans whose customer has no account yet stay pending.
+    Returns the approved ids."""
+    conn.execute("DROP TABLE IF EXISTS temp.approved_loans")
+    conn.execute("""
+        CREATE TEMP TABLE approved_loans AS
+        SELECT l.loan_id, l.loan_amount,
+               (SELECT MIN(a.account_id) FROM accounts a WHERE a.customer_id = l.customer_id) AS account_id
+        FROM loans l
+        WHERE l.loan_id IN (SELECT value FROM json_each(?)) AND l.status = 'Pending'""",
+                 (json.dumps([int(i) for i in loan_ids]),))
+    conn.execute("DELETE FROM temp.approved_loans WHERE account_id IS NULL")
+    approved = _decide(conn, "loans", "loan_id", [row[0] for row in conn.execute("SELECT loan_id FROM temp.approved_loans")],
+                       "Approved", ", approval_date = CURRENT_TIMESTAMP")
+    if approved:
+        conn.execute("""
+            UPDATE accounts SET balance = balance + d.total
+            FROM (SELECT account_id, SUM(loan_amount) AS total FROM temp.approved_loans GROUP BY account_id) d
+            WHERE accounts.account_id = d.account_id""")
+        conn.execute("""
+            INSERT INTO transactions (to_account_id, transaction_type, amount, description)
+            SELECT account_id, 'Loan Disbursement', loan_amount, 'Loan ID ' || loan_id FROM temp.approved_loans ORDER BY loan_id""")
+        open_loans(conn, approved)
+        _audit(conn, user_id, "Loan Approved", "Loan ID", approved)
+    conn.execute("DROP TABLE temp.approved_loans")
+    return approved
+
+
+def reject_loans(conn, loan_ids, user_id):
+    """Rejects pending loans. Returns the rejected ids."""
+    rejected = _decide(conn, "loans", "loan_id", loan_ids, "Rejected")
+    if rejected:
+        _audit(conn, user_id, "Loan Rejected", "Loan ID", rejected)
+    return rejected
@@ -0,0 +1,224 @@
+"""Hot/cold archival of transactions and audit entries.
+
+Whole months older than the horizon are moved out of the live database into
+one archive file per month (``archive/banking_v2-2024-01.db``), which holds
+that month's ``transactions`` and ``audit_log`` rows with the same indexes
+and its own full-text index. The live file keeps only recent rows, so its
+indexes, page cache, snapshots and backups stay small however many years of
+history are kept.
+
+    python archive.py banking_v2.db                    # months ending more than 90 days ago
+    python archive.py banking_v2.db --keep-days 365 --dir /mnt/cold --vacuum
+    python archive.py banking_v2.db --list
+
+A month is moved in two steps. Its rows are first copied into the archive
+file (``INSERT OR IGNORE``, so a rerun after a crash is harmless). Then one
+transaction on the live file does the rest:
+
+* catches the cash-flow rollup up, so the rollup keeps covering the month;
+* adds the per-account totals of the copied rows to ``account_carry``
+  (reconcile.py adds them to the hot figures);
+* deletes the copied rows;
+* records the month in ``archive_partitions``.
+
+Readers consult ``archive_partitions``, so a month is read from exactly one
+place at any time. Customer history, audit search and exports attach an
+archived month only when the requested dates reach into it (see
+``history.read_partitions`` and ``export.py``). Balances are untouched:
+``accounts.balance`` is the running balance and never depends on old rows.
+
+Rows back-dated into a month that is already archived (an end-of-day run
+for an old business date) are moved into the same file by the next run.
+Each month is deleted in a single transaction that holds the write lock, so
+run this at a quiet time, like the end-of-day batch.
+"""
+import argparse
+import os
+import time
+from datetime import date
+from pathlib import Path
+
+import cashflow
+from audit_search import AUDIT_INDEXES, create_audit_search
+from database import connect
+from history import HISTORY_INDEXES
+from schema import TABLES
+
+ARCHIVE_DIR = "archive"
+KEEP_DAYS = 90
+
+TRANSACTION_COLUMNS = "transaction_id, from_account_id, to_account_id, transaction_type, amount, description, transaction_date"
+AUDIT_COLUMNS = "log_id, user_id, action, details, timestamp"
+
+_CARRY = """
+    INSERT INTO account_carry (account_id, credits, debits, external_in, external_out, opening)
+    SELECT {side}_account_id, {credits}, {debits}, {external_in}, {external_out}, {opening}
+    FROM transactions t
+    WHERE t.transaction_date >= ? AND t.transaction_date < ? AND t.{side}_account_id IS NOT NULL
+      AND EXISTS (SELECT 1 FROM archive.transactions a WHERE a.transaction_id = t.transaction_id)
+    GROUP BY t.{side}_account_id
+    ON CONFLICT (account_id) DO UPDATE SET
+        credits = credits + excluded.credits, debits = debits + excluded.debits,
+        external_in = external_in + excluded.external_in, external_out = external_out + excluded.external_out,
+        opening = opening + excluded.opening"""
+
+_CARRY_CREDITS = _CARRY.format(
+    side="to", credits="SUM(amount)", debits="0",
+    external_in="SUM(CASE WHEN from_account_id IS NULL THEN amount ELSE 0 END)", external_out="0",
+    opening="SUM(CASE WHEN from_account_id IS NULL AND description = 'Opening Balance' THEN amount ELSE 0 END)")
+_CARRY_DEBITS = _CARRY.format(
+    side="from", credits="0", debits="SUM(amount)",
+    external_in="0", external_out="SUM(CASE WHEN to_account_id IS NULL THEN amount ELSE 0 END)", opening="0")
+
+
+def archive_path(db_name, period, directory=ARCHIVE_DIR):
+    return os.path.join(directory, f"{Path(db_name).stem}-{period}.db")
+
+
+def horizon(keep_days=KEEP_DAYS, today=None):
+    """The first day of the month that contains ``today - keep_days``; every
+    month before it is archived."""
+    today = today or date.today()
+    cutoff = date.fromordinal(today.toordinal() - keep_days)
+    return cutoff.replace(day=1)
+
+
+def _month_bounds(period):
+    year, month = map(int, period.split("-"))
+    following = date(year + month // 12, month % 12 + 1, 1)
+    return f"{period}-01 00:00:00", f"{following:%Y-%m-%d} 00:00:00"
+
+
+def _periods(conn, before):
+    """Months (``YYYY-MM``) before ``before`` that still have rows in the live file, oldest first."""
+    first = min(filter(None, (
+        conn.execute("SELECT MIN(transaction_date) FROM transactions").fetchone()[0],
+        conn.execute("SELECT MIN(timestamp) FROM audit_log").fetchone()[0],
+    )), default=None)
+    if first is None or first >= f"{before:%Y-%m-%d}":
+        return []
+    periods, year, month = [], int(first[:4]), int(first[5:7])
+    while (year, month) < (before.year, before.month):
+        periods.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
+
+
+def create_archive(conn):
+    """Creates the tables, indexes and full-text index of an archive file."""
+    conn.execute(TABLES["transactions"])
+    conn.execute(TABLES["audit_log"])
+    for statement in HISTORY_INDEXES + AUDIT_INDEXES:
+        if " ON transactions " in statement or " ON audit_log " in statement:
+            conn.execute(statement)
+    create_audit_search(conn)
+
+
+def archive_month(db_name, period, directory=ARCHIVE_DIR):
+    """Moves one month out of the live file. Returns ``(transactions, audit_entries)`` moved."""
+    # Stored absolute, so readers in any working directory attach the same file.
+    path = os.path.abspath(archive_path(db_name, period, directory))
+    os.makedirs(directory, exist_ok=True)
+    starts, ends = _month_bounds(period)
+
+    # 1. Copy the month into its archive file.
+    cold = connect(path, pragmas={"journal_mode": "DELETE"})
+    try:
+        cold.execute("BEGIN IMMEDIATE")
+        create_archive(cold)
+        cold.execute("COMMIT")
+        cold.execute("ATTACH DATABASE ? AS live", (str(db_name),))
+        cold.execute("BEGIN IMMEDIATE")
+        cold.execute(f"""INSERT OR IGNORE INTO transactions ({TRANSACTION_COLUMNS})
+            SELECT {TRANSACTION_COLUMNS} FROM live.transactions WHERE transaction_date >= ? AND transaction_date < ?""",
+                     (starts, ends))
+        cold.execute(f"""INSERT OR IGNORE INTO audit_log ({AUDIT_COLUMNS})
+            SELECT {AUDIT_COLUMNS} FROM live.audit_log WHERE timestamp >= ? AND timestamp < ?""", (starts, ends))
+        cold.execute("COMMIT")
+        cold.execute("DETACH DATABASE live")
+    finally:
+        cold.close()
+
+    # 2. Carry the copied rows forward, delete them and publish the month, atomically.
+    hot = connect(db_name)
+    try:
+        hot.execute("ATTACH DATABASE ? AS archive", (path,))
+        hot.execute("BEGIN IMMEDIATE")
+        try:
+            while cashflow.catch_up(hot):
+                pass
+            hot.execute(_CARRY_CREDITS, (starts, ends))
+            hot.execute(_CARRY_DEBITS, (starts, ends))
+            moved = hot.execute("""DELETE FROM transactions WHERE transaction_date >= ? AND transaction_date < ?
+                AND EXISTS (SELECT 1 FROM archive.transactions a WHERE a.transaction_id = transactions.transaction_id)""",
+                                (starts, ends)).rowcount
+            logged = hot.execute("""DELETE FROM audit_log WHERE timestamp >= ? AND timestamp < ?
+                AND EXISTS (SELECT 1 FROM archive.audit_log a WHERE a.log_id = audit_log.log_id)""", (starts, ends)).rowcount
+            hot.execute("""
+                INSERT INTO archive_partitions (period, path, starts, ends, transactions, audit_entries)
+                VALUES (?, ?, ?, ?, (SELECT COUNT(*) FROM archive.transactions), (SELECT COUNT(*) FROM archive.audit_log))
+                ON CONFLICT (period) DO UPDATE SET path = excluded.path, transactions = excluded.transactions,
+                    audit_entries = excluded.audit_entries, archived_at = CURRENT_TIMESTAMP""",
+                        (period, path, starts, ends))
+        except BaseException:
+            hot.execute("ROLLBACK")
+            raise
+        hot.execute("COMMIT")
+        hot.execute("DETACH DATABASE archive")
+    finally:
+        hot.close()
+    return moved, logged
+
+
+def archive(db_name, keep_days=KEEP_DAYS, directory=ARCHIVE_DIR, today=None, vacuum=False, progress=None):
+    """Archives every month before ``horizon(keep_days, today)``. Returns the
+    months, rows moved and elapsed time. ``vacuum`` shrinks the live file afterwards."""
+    progress = progress or (lambda message: None)
+    started = time.perf_counter()
+    before = horizon(keep_days, today)
+    conn = connect(db_name, read_only=True)
+    try:
+        periods = _periods(conn, before)
+    finally:
+        conn.close()
+    counts = {"horizon": f"{before}", "months": 0, "transactions": 0, "audit_entries": 0}
+    for period in periods:
+        moved, logged = archive_month(db_name, period, directory)
+        if moved or logged:
+            counts["months"] += 1
+            counts["transactions"] += moved
+            counts["audit_entries"] += logged
+            progress(f"{period}: {moved:,} transactions and {logged:,} audit entries archived")
+    if vacuum and counts["months"]:
+        conn = connect(db_name)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old transactions and audit entries into monthly archive files.")
+    parser.add_argument("db", help="live SQLite file")
+    parser.add_argument("--keep-days", type=int, default=KEEP_DAYS, help=f"keep at least this many days live (default {KEEP_DAYS})")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help=f"directory for the archive files (default {ARCHIVE_DIR}/)")
+    parser.add_argument("--vacuum", action="store_true", help="shrink the live file afterwards (takes the write lock throughout)")
+    parser.add_argument("--list", action="store_true", help="list the archived months and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        conn = connect(args.db, read_only=True)
+        for period, path, transactions, audit_entries, archived_at in conn.execute(
+                "SELECT period, path, transactions, audit_entries, archived_at FROM archive_partitions ORDER BY period"):
+            print(f"{period}  {transactions:>12,} transactions  {audit_entries:>10,} audit entries  {path}  (archived {archived_at})")
+        conn.close()
+        return
+    counts = archive(args.db, keep_days=args.keep_days, directory=args.dir, vacuum=args.vacuum, progress=print)
+    print(f"Archived {counts['transactions']:,} transactions and {counts['audit_entries']:,} audit entries from "
+          f"{counts['months']} month(s) before {counts['horizon']} in {counts['seconds']}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Static assets and CSS, prepared once per process.
+
+The login background used to be read and base64-encoded into a ~2.8 MB data
+URI on every rerun. Now:
+
+* the image lives in ``static/`` and is served by Streamlit's static file
+  serving (``server.enableStaticServing``), so pages reference it by URL;
+* if Pillow is installed, downscaled WebP and JPEG derivatives are written
+  next to it on first use (and again only when the source changes);
+* everything derived from a file (data URIs, CSS blocks) is kept in a
+  process-wide cache keyed on the file's mtime and size, so it is rebuilt
+  only when the file actually changes.
+"""
+import base64
+import mimetypes
+import os
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it the original image is served.
+    Image = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL = "app/static"
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def cached_file(key, path, build):
+    """Returns ``build(path)``, recomputed only when the file's mtime or size changes.
+
+    ``build`` is not called (and ``None`` is returned) if the file is missing.
+    """
+    stamp = _stamp(path)
+    with _lock:
+        entry = _cache.get((key, path))
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+    value = build(path) if stamp is not None else None
+    with _lock:
+        _cache[(key, path)] = (stamp, value)
+    return value
+
+
+def cached_text(key, build, *deps):
+    """Returns ``build(*deps)``, recomputed only when ``deps`` change."""
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == deps:
+            return entry[1]
+    value = build(*deps)
+    with _lock:
+        _cache[key] = (deps, value)
+    return value
+
+
+def data_uri(path):
+    """Returns the file as a base64 ``data:`` URI (cached until the file changes)."""
+    def build(p):
+        mime = mimetypes.guess_type(p)[0] or "application/octet-stream"
+        with open(p, "rb") as f:
+            return f"data:{mime};base64,{base64.b64encode(f.read()).decode()}"
+    return cached_file("data_uri", path, build)
+
+
+def _derive(source, target, fmt, max_width, quality):
+    """Writes a resized copy of ``source`` unless ``target`` is already newer."""
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+        return
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        if image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        image.save(target + ".tmp", fmt, quality=quality, optimize=True)
+    os.replace(target + ".tmp", target)
+
+
+def _prepare(source, max_width, quality):
+    name = os.path.basename(source)
+    variants = []
+    if Image is not None:
+        stem = os.path.splitext(name)[0]
+        for ext, fmt, mime in (("webp", "WEBP", "image/webp"), ("jpg", "JPEG", "image/jpeg")):
+            filename = f"{stem}-{max_width}.{ext}"
+            try:
+                _derive(source, os.path.join(STATIC_DIR, filename), fmt, max_width, quality)
+            except (OSError, KeyError):  # e.g. a Pillow build without WebP support
+                continue
+            variants.append((filename, mime))
+    variants.append((name, mimetypes.guess_type(name)[0] or "application/octet-stream"))
+    return variants
+
+
+def prepare_image(name, max_width=1920, quality=80):
+    """Makes sure the derivatives of ``static/<name>`` exist and returns the
+    available variants as ``[(filename, mime), ...]``, preferred first.
+
+    Derivatives are generated on first use and again only when the source
+    image changes.
+    """
+    source = os.path.join(STATIC_DIR, name)
+    return cached_file(("variants", max_width, quality), source, lambda p: _prepare(p, max_width, quality)) or []
+
+
+def css_background(variants, static_serving=True):
+    """Returns CSS ``background-image`` declarations for the prepared variants.
+
+    With static serving the browser fetches (and caches) the image by URL;
+    without it the original file is inlined once as a cached data URI.
+    """
+    if not variants:
+        return ""
+    if not static_serving:
+        return cached_file("css_data_uri", os.path.join(STATIC_DIR, variants[-1][0]),
+                           lambda p: f'background-image: url("{data_uri(p)}");')
+    fallback = variants[-1] if len(variants) == 1 else variants[-2]
+    declarations = [f'background-image: url("{STATIC_URL}/{fallback[0]}");']
+    if len(variants) > 1:
+        options = ", ".join(f'url("{STATIC_URL}/{filename}") type("{mime}")' for filename, mime in variants)
+        declarations.append(f"background-image: image-set({options});")
+    return " ".join(declarations)
@@ -0,0 +1,194 @@
+"""Audit log writer.
+
+``AuditWriter`` has two durability policies:
+
+* ``relaxed`` (default): ``log()`` puts the entry on a bounded in-memory
+  queue and returns. A background thread writes queued entries with
+  ``executemany``, one transaction per batch, whenever ``batch_size``
+  entries are waiting or ``flush_interval`` seconds have passed since the
+  first one arrived. Audit writes no longer add a commit to every login
+  and posting.
+* ``strict``: every entry is on disk before ``log()`` returns. Entries
+  attached to ledger postings (``post_*(..., audit=...)``) are written by
+  the ledger engine inside the same transaction as the posting itself.
+
+When the queue is full, ``log()`` either blocks until there is room
+(``on_full="block"``, the default) or drops the entry
+(``on_full="drop"``). Both are counted in ``stats()``. Queued entries are
+flushed by ``close()``, which also runs at interpreter exit.
+"""
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from database import connect
+
+AuditEntry = namedtuple("AuditEntry", "user_id action details")
+
+logger = logging.getLogger(__name__)
+
+INSERT_AUDIT = "INSERT INTO audit_log (user_id, action, details) VALUES (?, ?, ?)"
+
+POLICIES = ("relaxed", "strict")
+
+_STOP = object()
+
+
+class AuditWriter:
+    def __init__(self, db_name, policy="relaxed", max_queue=10000, batch_size=500, flush_interval=0.5,
+                 on_full="block"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown audit policy {policy!r}; expected one of {POLICIES}.")
+        self.db_name = db_name
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_full = on_full
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "blocked": 0,
+                       "blocked_seconds": 0.0, "max_depth": 0, "failed_batches": 0, "last_batch_ms": None}
+        self._sync_conn = None
+        self._thread = None
+        if policy == "relaxed":
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def strict(self):
+        return self.policy == "strict"
+
+    # --- Public API ---
+    def log(self, user_id, action, details=""):
+        if self._closed:
+            raise RuntimeError("Audit writer is closed.")
+        entry = AuditEntry(str(user_id), action, details)
+        if self.strict:
+            self._write_now([entry])
+            return
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            if self.on_full == "drop":
+                self._bump("dropped")
+                return
+            started = time.perf_counter()
+            self._queue.put(entry)
+            with self._lock:
+                self._stats["blocked"] += 1
+                self._stats["blocked_seconds"] += time.perf_counter() - started
+        with self._lock:
+            self._stats["enqueued"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], self._queue.qsize())
+
+    def flush(self):
+        """Blocks until every entry queued so far has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Flushes the queue and stops the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+        with self._lock:
+            if self._sync_conn is not None:
+                self._sync_conn.close()
+                self._sync_conn = None
+
+    def stats(self):
+        """Returns queue depth and backpressure counters."""
+        with self._lock:
+            return {"policy": self.policy, "depth": self._queue.qsize(), **self._stats}
+
+    # --- Internals ---
+    def _bump(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _write_now(self, entries):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Audit writer is closed.")
+            if self._sync_conn is None:
+                self._sync_conn = connect(self.db_name, check_same_thread=False)
+            conn = self._sync_conn
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(INSERT_AUDIT, entries)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self._stats["written"] += len(entries)
+            self._stats["batches"] += 1
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        conn = connect(self.db_name)
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._write_batch(conn, batch)
+                if stopping:
+                    self._queue.task_done()  # the stop marker
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn, batch):
+        started = time.perf_counter()
+        written, error = False, None
+        for attempt in range(3):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(INSERT_AUDIT, batch)
+                conn.execute("COMMIT")
+                written = True
+                break
+            except sqlite3.Error as e:
+                error = e
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                time.sleep(0.1 * (attempt + 1))
+        with self._lock:
+            if written:
+                self._stats["written"] += len(batch)
+                self._stats["batches"] += 1
+            else:
+                self._stats["failed_batches"] += 1
+                self._stats["dropped"] += len(batch)
+            self._stats["last_batch_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        if not written:
+            logger.warning("Dropped %d audit entries after 3 failed attempts to write them: %s", len(batch), error)
+        for _ in batch:
+            self._queue.task_done()
@@ -0,0 +1,127 @@
+"""Audit log queries.
+
+The audit log is read newest first, a page at a time, by keyset: the cursor
+is the ``(timestamp, log_id)`` of the last row shown, so page N costs the
+same as page one. Filters on user, action and time range are served by
+``(user_id, timestamp)``, ``(action, timestamp)`` and ``(timestamp)``
+indexes.
+
+``details`` is full-text indexed in ``audit_fts``, an FTS5 table over
+``audit_log`` that triggers keep in sync with every insert, update and
+delete, whichever code path makes it. A text search looks matching rows up
+in the FTS index and then pages through them by timestamp, without scanning
+the log. Months moved out by archive.py keep their own FTS index and are
+searched only when a page reaches back into them (see
+``history.read_partitions``). For example, every transfer touching account
+1234 last quarter:
+
+    search_audit(db, actions=["Transfer Success"], account_id=1234,
+                 date_from=date(2025, 1, 1), date_to=date(2025, 3, 31))
+"""
+import re
+from collections import namedtuple
+
+from history import date_filter, read_partitions
+
+AuditRow = namedtuple("AuditRow", "log_id timestamp user_id action details")
+AuditPage = namedtuple("AuditPage", "rows next_cursor")
+
+AUDIT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_log (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_log (user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_log (action, timestamp)",
+]
+
+AUDIT_FTS = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS audit_fts USING fts5(
+        details, content='audit_log', content_rowid='log_id'
+    );"""
+
+AUDIT_FTS_TRIGGERS = {
+    "trg_audit_fts_insert": """
+    CREATE TRIGGER IF NOT EXISTS trg_audit_fts_insert AFTER INSERT ON audit_log BEGIN
+        INSERT INTO audit_fts (rowid, details) VALUES (new.log_id, new.details);
+    END;""",
+    "trg_audit_fts_delete": """
+    CREATE TRIGGER IF NOT EXISTS trg_audit_fts_delete AFTER DELETE ON audit_log BEGIN
+        INSERT INTO audit_fts (audit_fts, rowid, details) VALUES ('delete', old.log_id, old.details);
+    END;""",
+    "trg_audit_fts_update": """
+    CREATE TRIGGER IF NOT EXISTS trg_audit_fts_update AFTER UPDATE OF details ON audit_log BEGIN
+        INSERT INTO audit_fts (audit_fts, rowid, details) VALUES ('delete', old.log_id, old.details);
+        INSERT INTO audit_fts (rowid, details) VALUES (new.log_id, new.details);
+    END;""",
+}
+
+_TERMS = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def create_audit_search(conn):
+    """Creates the full-text index and its triggers, indexing existing rows if it is new."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'audit_fts'").fetchone()
+    conn.execute(AUDIT_FTS)
+    for statement in AUDIT_FTS_TRIGGERS.values():
+        conn.execute(statement)
+    if not exists:
+        conn.execute("INSERT INTO audit_fts (audit_fts) VALUES ('rebuild')")
+
+
+def match_query(text):
+    """Turns search box text into an FTS5 query: every word (or "quoted
+    phrase") must appear. Words are quoted, so FTS syntax characters in the
+    input are searched for literally instead of raising errors."""
+    terms = [m.group(1) if m.group(1) is not None else m.group(2) for m in _TERMS.finditer(text or "")]
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms if term and term.strip())
+
+
+def audit_actions(db):
+    """Returns the distinct actions in the log, read by skipping through the action index."""
+    rows = db.fetch_all("""
+        WITH RECURSIVE actions (action) AS (
+            SELECT MIN(action) FROM audit_log
+            UNION ALL
+            SELECT (SELECT MIN(action) FROM audit_log WHERE action > actions.action) FROM actions WHERE action IS NOT NULL
+        )
+        SELECT action FROM actions WHERE action IS NOT NULL""")
+    return [row[0] for row in rows]
+
+
+def search_audit(db, page_size=100, cursor=None, user_id=None, actions=None, date_from=None, date_to=None,
+                 text=None, account_id=None):
+    """Returns one ``AuditPage`` of audit rows, newest first.
+
+    ``cursor`` is the ``next_cursor`` of the previous page (``None`` for the
+    first page). ``text`` is matched against ``details`` with ``match_query``.
+    ``account_id`` finds entries naming the account as the source or
+    destination of a posting ("From: 12", "To: 12").
+    """
+    clauses, params = [], []
+    if cursor is not None:
+        clauses.append("(timestamp < ? OR (timestamp = ? AND log_id < ?))")
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    date_clauses, date_params = date_filter(date_from, date_to, column="timestamp")
+    clauses.extend(date_clauses)
+    params.extend(date_params)
+    if user_id:
+        clauses.append("user_id = ?")
+        params.append(str(user_id))
+    if actions:
+        clauses.append(f"action IN ({', '.join('?' * len(actions))})")
+        params.extend(actions)
+    for query in (match_query(text), f'"from {int(account_id)}" OR "to {int(account_id)}"' if account_id is not None else ""):
+        if query:
+            clauses.append("log_id IN (SELECT rowid FROM {schema}audit_fts WHERE audit_fts MATCH ?)")
+            params.append(query)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"""
+        SELECT log_id, timestamp, user_id, action, details FROM {{schema}}audit_log
+        {where}
+        ORDER BY timestamp DESC, log_id DESC
+        LIMIT ?"""
+    params.append(page_size + 1)
+    rows = db.fetch_all(sql.format(schema=""), params)
+    rows = read_partitions(db, rows, page_size + 1, lambda row: (row[1], row[0]), sql, params,
+                           date_from, cursor[0] if cursor is not None else date_to)
+    rows = [AuditRow(*row) for row in rows]
+    next_cursor = (rows[page_size - 1].timestamp, rows[page_size - 1].log_id) if len(rows) > page_size else None
+    return AuditPage(rows[:page_size], next_cursor)
@@ -0,0 +1,277 @@
+"""Concurrent load test for the banking workload.
+
+Drives the same data-access paths as the Streamlit pages, without a browser,
+from N simulated users (threads)::
+
+    python seed.py bench.db --customers 20000 --transactions 500000
+    python bench.py bench.db --users 16 --duration 30 --out before.json
+    # ... change something ...
+    python bench.py bench.db --users 16 --duration 30 --out after.json --compare before.json
+
+The database is modified (postings and audit rows are written), so run it
+against a generated copy, never the live file.
+
+The report has throughput, p50/p95/p99 latency per operation, failed
+logins, how long the ledger writer waited for the write lock (count,
+total, p50/p95/max), counts of ``database is locked`` errors and the
+result of invariant checks: money is
+conserved (the change in total balances equals deposits minus withdrawals,
+to the cent),
+no account is overdrawn, and every accepted posting left a transaction row.
+"""
+import argparse
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from audit import AuditWriter
+from database import Database
+from history import fetch_history_page
+from ledger import LedgerEngine, PostingError
+from metrics import Metrics
+from money import Money
+from reports import balance_sheet, dashboard_metrics
+from security import verify_password
+
+DEFAULT_MIX = "login=15,transfer=30,deposit=10,withdrawal=10,history=25,dashboard=5,reports=5"
+READ_OPS = {"login", "history", "dashboard", "reports"}
+
+# seed.py gives the customer with e-mail ``<name><n>@email.com`` the password ``custpass<n>``.
+_SEEDED_EMAIL = re.compile(r"(\d+)@email\.com$")
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _is_lock_error(error):
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+
+class Workload:
+    """The operations a simulated user can perform, mirroring the app's pages."""
+
+    def __init__(self, db, ledger, audit):
+        self.db = db
+        self.ledger = ledger
+        self.audit = audit
+        self.customers = db.fetch_all("SELECT customer_id, email FROM customers WHERE status = 'Active'")
+        self.accounts = db.fetch_all("SELECT account_id, customer_id FROM accounts")
+        if not self.customers or len(self.accounts) < 2:
+            raise SystemExit("The database needs active customers and accounts; generate one with seed.py.")
+        self._lock = threading.Lock()
+        self.deposited = 0
+        self.withdrawn = 0
+        self.postings = 0
+
+    def _settled(self, future, deposited=0, withdrawn=0):
+        receipt = future.result()
+        with self._lock:
+            self.deposited += deposited
+            self.withdrawn += withdrawn
+            self.postings += 1
+        return receipt
+
+    def login(self, rng):
+        """Logs in with the password seed.py gave the customer. Returns False if it was refused."""
+        _, email = rng.choice(self.customers)
+        customer = self.db.fetch_one("SELECT * FROM customers WHERE email = ?", (email,))
+        seeded = _SEEDED_EMAIL.search(email)
+        if customer and seeded and verify_password(customer[4], f"custpass{seeded.group(1)}"):
+            self.audit.log(customer[0], "Customer Login Success")
+            return True
+        self.audit.log(email, "Customer Login Failed: Invalid credentials")
+        return False
+
+    def transfer(self, rng):
+        (from_id, customer_id), (to_id, _) = rng.sample(self.accounts, 2)
+        amount = Money(rng.randint(100, 20000))
+        self._settled(self.ledger.post_transfer(from_id, to_id, amount, "bench",
+                                                audit=(customer_id, "Transfer Success", f"Amount: {amount}, From: {from_id}, To: {to_id}")))
+
+    def deposit(self, rng):
+        account_id, customer_id = rng.choice(self.accounts)
+        amount = Money(rng.randint(100, 50000))
+        self._settled(self.ledger.post_deposit(account_id, amount,
+                                               audit=(customer_id, "Deposit Success", f"Amount: {amount}, To: {account_id}")),
+                      deposited=amount.cents)
+
+    def withdrawal(self, rng):
+        account_id, customer_id = rng.choice(self.accounts)
+        amount = Money(rng.randint(100, 20000))
+        self._settled(self.ledger.post_withdrawal(account_id, amount, audit=(customer_id, "Withdrawal Success", "")),
+                      withdrawn=amount.cents)
+
+    def history(self, rng):
+        customer_id, _ = rng.choice(self.customers)
+        fetch_history_page(self.db, customer_id)
+
+    def dashboard(self, rng):
+        dashboard_metrics(self.db)
+
+    def reports(self, rng):
+        balance_sheet(self.db)
+
+
+def _snapshot(db):
+    total, overdrawn = db.fetch_one("SELECT COALESCE(SUM(balance), 0), COUNT(CASE WHEN balance < 0 THEN 1 END) FROM accounts")
+    transactions = db.fetch_one("SELECT COALESCE(MAX(transaction_id), 0) FROM transactions")[0]
+    return {"total_balance": total, "overdrawn_accounts": overdrawn, "max_transaction_id": transactions}
+
+
+def run(db_name, users=8, duration=10.0, mix=DEFAULT_MIX, seed=0, audit_policy="relaxed"):
+    """Runs the workload and returns the report as a dict."""
+    weights = {name: float(weight) for name, weight in (item.split("=") for item in mix.split(","))}
+    db = Database(db_name, max_idle=users + 2)
+    audit = AuditWriter(db_name, policy=audit_policy)
+    metrics = Metrics()
+    ledger = LedgerEngine(db_name, audit=audit, metrics=metrics)
+    workload = Workload(db, ledger, audit)
+    ops = list(weights)
+    op_weights = [weights[name] for name in ops]
+
+    latencies = defaultdict(list)
+    counters = defaultdict(lambda: defaultdict(int))
+    merge_lock = threading.Lock()
+    before = _snapshot(db)
+    deadline = time.perf_counter() + duration
+
+    def user(index):
+        rng = random.Random(f"{seed}:{index}")
+        local_latencies = defaultdict(list)
+        local_counters = defaultdict(lambda: defaultdict(int))
+        while time.perf_counter() < deadline:
+            name = rng.choices(ops, weights=op_weights)[0]
+            started = time.perf_counter()
+            try:
+                outcome = "failed" if getattr(workload, name)(rng) is False else "ok"
+            except PostingError:
+                outcome = "rejected"
+            except Exception as e:
+                outcome = "locked" if _is_lock_error(e) else "error"
+            local_latencies[name].append(time.perf_counter() - started)
+            local_counters[name][outcome] += 1
+        with merge_lock:
+            for name, values in local_latencies.items():
+                latencies[name].extend(values)
+            for name, outcomes in local_counters.items():
+                for outcome, count in outcomes.items():
+                    counters[name][outcome] += count
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    ledger.close()
+    audit.close()
+    after = _snapshot(db)
+    db.close()
+
+    report_ops = {}
+    for name in ops:
+        values = sorted(latencies[name])
+        report_ops[name] = {
+            "count": len(values),
+            "ok": counters[name]["ok"],
+            "rejected": counters[name]["rejected"],
+            "failed": counters[name]["failed"],
+            "locked": counters[name]["locked"],
+            "errors": counters[name]["error"],
+            "throughput_per_s": round(len(values) / elapsed, 2),
+            "p50_ms": round(_percentile(values, 50) * 1000, 3) if values else None,
+            "p95_ms": round(_percentile(values, 95) * 1000, 3) if values else None,
+            "p99_ms": round(_percentile(values, 99) * 1000, 3) if values else None,
+            "max_ms": round(values[-1] * 1000, 3) if values else None,
+        }
+
+    expected_total = before["total_balance"] + workload.deposited - workload.withdrawn
+    new_transactions = after["max_transaction_id"] - before["max_transaction_id"]
+    invariants = {
+        "money_conserved": after["total_balance"] == expected_total,
+        "balance_drift_cents": after["total_balance"] - expected_total,
+        "no_overdrawn_accounts": after["overdrawn_accounts"] <= before["overdrawn_accounts"],
+        "postings_recorded": new_transactions >= workload.postings,
+    }
+    total_ops = sum(op["count"] for op in report_ops.values())
+    lock_waits = metrics.snapshot()["lock_waits"]
+    return {
+        "config": {"db": db_name, "users": users, "duration_s": duration, "mix": weights, "seed": seed,
+                   "audit_policy": audit_policy},
+        "elapsed_s": round(elapsed, 3),
+        "total_ops": total_ops,
+        "throughput_per_s": round(total_ops / elapsed, 2),
+        "read_throughput_per_s": round(sum(report_ops[n]["count"] for n in ops if n in READ_OPS) / elapsed, 2),
+        "write_throughput_per_s": round(sum(report_ops[n]["count"] for n in ops if n not in READ_OPS) / elapsed, 2),
+        "login_failures": sum(op["failed"] for op in report_ops.values()),
+        "lock_wait": {key: value for key, value in lock_waits.items() if key != "buckets"},
+        "lock_errors": sum(op["locked"] for op in report_ops.values()),
+        "errors": sum(op["errors"] for op in report_ops.values()),
+        "operations": report_ops,
+        "audit": audit.stats(),
+        "invariants": invariants,
+        "invariant_violations": [name for name, ok in invariants.items() if ok is False],
+    }
+
+
+def summary(report):
+    """One printable line: throughput next to the time spent waiting for the write lock."""
+    wait = report["lock_wait"]
+    return (f"{report['throughput_per_s']} ops/s ({report['write_throughput_per_s']} writes/s); "
+            f"write-lock wait {wait['total_ms']} ms over {wait['count']} batches "
+            f"(p50 {wait['p50_ms']} ms, p95 {wait['p95_ms']} ms, max {wait['max_ms']} ms); "
+            f"{report['lock_errors']} lock errors, {report['login_failures']} failed logins")
+
+
+def compare(baseline, report):
+    """Returns printable lines comparing throughput, write-lock wait and p95 against a baseline report."""
+    lines = [f"throughput: {baseline['throughput_per_s']} -> {report['throughput_per_s']} ops/s"]
+    if "lock_wait" in baseline:
+        lines.append(f"write-lock wait p95: {baseline['lock_wait']['p95_ms']} -> {report['lock_wait']['p95_ms']} ms")
+    for name, op in report["operations"].items():
+        old = baseline["operations"].get(name)
+        if old and old["p95_ms"] and op["p95_ms"]:
+            change = (op["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            lines.append(f"{name:>10}: p95 {old['p95_ms']} -> {op['p95_ms']} ms ({change:+.1f}%)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the banking workload.")
+    parser.add_argument("db", help="SQLite file to run against (it will be written to)")
+    parser.add_argument("--users", type=int, default=8, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="relative weights of operations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--audit-policy", choices=["relaxed", "strict"], default="relaxed")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="print changes against an earlier JSON report")
+    args = parser.parse_args(argv)
+
+    report = run(args.db, users=args.users, duration=args.duration, mix=args.mix, seed=args.seed,
+                 audit_policy=args.audit_policy)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(summary(report))
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(json.load(f), report)))
+    if report["invariant_violations"]:
+        raise SystemExit(f"Invariant violations: {', '.join(report['invariant_violations'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Daily cash-flow rollup.
+
+``cashflow_daily`` holds one row per (day, transaction_type): the number of
+transactions, their total amount, and the money that entered the bank
+(``inflow``: no ``from_account_id``, e.g. deposits, loan disbursements,
+interest credits) or left it (``outflow``: no ``to_account_id``, e.g.
+withdrawals, loan repayments). Transfers move money between customer
+accounts and count in neither.
+
+The rollup is built incrementally. ``rollup_watermarks`` records the
+highest ``transaction_id`` already added, and each catch-up aggregates only
+the rows above it: a rowid range scan with a GROUP BY, merged in with an
+UPSERT. SQLite has a single writer, so transaction ids become visible in
+increasing order and no row is skipped. Reports over any period then read
+a few rows per day from the rollup and never touch ``transactions``.
+archive.py catches the rollup up before it moves any rows out, so archived
+months stay in it. A rebuild would lose them and is refused once any month
+has been archived.
+
+    python cashflow.py banking_v2.db              # catch up
+    python cashflow.py banking_v2.db --rebuild    # recompute from scratch
+"""
+import argparse
+import time
+
+from database import connect
+
+ROLLUP = "cashflow_daily"
+BATCH_SIZE = 500000
+
+
+def watermark(conn):
+    row = conn.execute("SELECT last_id FROM rollup_watermarks WHERE rollup = ?", (ROLLUP,)).fetchone()
+    return row[0] if row else 0
+
+
+def catch_up(conn, batch_size=BATCH_SIZE):
+    """Adds the next ``batch_size`` transaction ids above the watermark to the
+    rollup, inside the caller's write transaction. Returns how far the
+    watermark moved (0 when the rollup is current)."""
+    last_id = watermark(conn)
+    top = conn.execute("SELECT MAX(transaction_id) FROM transactions").fetchone()[0] or 0
+    if top <= last_id:
+        return 0
+    upto = min(top, last_id + batch_size)
+    conn.execute("""
+        INSERT INTO cashflow_daily (day, transaction_type, count, amount, inflow, outflow)
+        SELECT substr(transaction_date, 1, 10), transaction_type, COUNT(*), SUM(amount),
+               SUM(CASE WHEN from_account_id IS NULL THEN amount ELSE 0 END),
+               SUM(CASE WHEN to_account_id IS NULL THEN amount ELSE 0 END)
+        FROM transactions WHERE transaction_id > ? AND transaction_id <= ?
+        GROUP BY 1, 2
+        ON CONFLICT (day, transaction_type) DO UPDATE SET
+            count = count + excluded.count, amount = amount + excluded.amount,
+            inflow = inflow + excluded.inflow, outflow = outflow + excluded.outflow""", (last_id, upto))
+    conn.execute("""INSERT INTO rollup_watermarks (rollup, last_id) VALUES (?, ?)
+        ON CONFLICT (rollup) DO UPDATE SET last_id = excluded.last_id""", (ROLLUP, upto))
+    return upto - last_id
+
+
+def refresh(db_name, batch_size=BATCH_SIZE, rebuild=False, progress=None):
+    """Brings the rollup up to date, committing after every batch. Returns
+    the number of transaction ids covered and the elapsed time."""
+    progress = progress or (lambda message: None)
+    started = time.perf_counter()
+    conn = connect(db_name)
+    added = 0
+    try:
+        if rebuild:
+            if conn.execute("SELECT 1 FROM archive_partitions LIMIT 1").fetchone():
+                raise ValueError("The cash-flow rollup cannot be rebuilt once transactions have been archived.")
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM cashflow_daily")
+            conn.execute("DELETE FROM rollup_watermarks WHERE rollup = ?", (ROLLUP,))
+            conn.execute("COMMIT")
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                moved = catch_up(conn, batch_size)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            if not moved:
+                break
+            added += moved
+            progress(f"Rolled up through transaction id {watermark(conn):,}")
+    finally:
+        conn.close()
+    return {"transaction_ids": added, "seconds": round(time.perf_counter() - started, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bring the daily cash-flow rollup up to date.")
+    parser.add_argument("db", help="SQLite file to process")
+    parser.add_argument("--rebuild", action="store_true", help="discard the rollup and rebuild it from every transaction")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="transaction ids per commit")
+    args = parser.parse_args(argv)
+
+    counts = refresh(args.db, batch_size=args.batch_size, rebuild=args.rebuild, progress=print)
+    print(f"Done in {counts['seconds']}s: {counts['transaction_ids']:,} transaction ids rolled up.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Balance checkpoints and point-in-time balances.
+
+``accounts.balance`` is only the current balance. To answer "what was this
+account's balance at the end of day X" without replaying its whole history,
+``take()`` records end-of-day balances in ``balance_checkpoints``. It runs as
+the last phase of the end-of-day batch (``eod.py``), or from the command line:
+
+    python checkpoints.py banking_v2.db --date 2025-01-31
+    python checkpoints.py banking_v2.db --date 2024-01-31 --through 2025-01-31
+
+A run for day D writes one row per account whose balance changed since the
+previous run (the first run writes every account). Each balance is the
+account's current balance less everything dated after D, computed with one
+set-based ``INSERT ... SELECT`` in the caller's write transaction.
+``checkpoint_runs`` records each run's day and the highest
+``transaction_id`` at the time. Runs must be taken in date order, and not
+for a day whose later months have been archived.
+
+``as_of(db, day)`` then finds, per account, the newest checkpoint row on or
+before the newest run on or before ``day`` (one primary-key seek) and adds:
+
+* the postings dated after that run, up to the end of ``day``. This is an
+  index range scan no longer than the gap between runs, and it reaches into
+  an archived month only when the gap does;
+* the postings back-dated into days that were already checkpointed
+  (transaction ids above the last run's watermark). This is a rowid range
+  scan over the postings since the last run.
+
+The cost is therefore bounded by the checkpoint interval, not by the age of
+the account. The next run folds back-dated postings into the stored rows.
+Run ``archive.py`` after the day's checkpoint so that it never moves a
+posting the checkpoints have not seen yet.
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from database import connect
+from history import archive_partitions
+
+CHECKPOINT_TABLES = {
+    "checkpoint_runs": """
+    CREATE TABLE IF NOT EXISTS checkpoint_runs (
+        day TEXT PRIMARY KEY, -- YYYY-MM-DD; balances are as of the end of the day
+        last_id INTEGER NOT NULL, -- highest transaction_id when the run was taken
+        accounts INTEGER NOT NULL, -- rows written
+        taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );""",
+    "balance_checkpoints": """
+    CREATE TABLE IF NOT EXISTS balance_checkpoints (
+        account_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        balance INTEGER NOT NULL, -- cents, at the end of day
+        PRIMARY KEY (account_id, day)
+    ) WITHOUT ROWID;""",
+}
+
+# Net effect on each account of the postings in a range: credits add, debits subtract.
+_NET = """
+    SELECT account_id, SUM(net) AS net FROM (
+        SELECT to_account_id AS account_id, amount AS net FROM {source}
+        WHERE to_account_id IS NOT NULL AND {where}{to_filter}
+        UNION ALL
+        SELECT from_account_id, -amount FROM {source}
+        WHERE from_account_id IS NOT NULL AND {where}{from_filter}
+    ) GROUP BY account_id"""
+
+
+class ArchivedError(ValueError):
+    """Raised by ``take`` for a day whose later postings have been archived."""
+
+
+def create_checkpoints(conn):
+    for statement in CHECKPOINT_TABLES.values():
+        conn.execute(statement)
+
+
+def _end_of(day):
+    """The stored TIMESTAMP at which ``day`` ends (the start of the next day)."""
+    return f"{day + timedelta(days=1):%Y-%m-%d} 00:00:00"
+
+
+def _net_sql(source="transactions", where="transaction_date >= ? AND transaction_date < ?", account_ids=None):
+    """``_NET`` over ``source``; with ``account_ids`` each side is read through its account index."""
+    if account_ids is None:
+        return _NET.format(source=source, where=where, to_filter="", from_filter="")
+    ids = ", ".join(str(int(account_id)) for account_id in account_ids)
+    return _NET.format(source=source, where=where, to_filter=f" AND to_account_id IN ({ids})",
+                       from_filter=f" AND from_account_id IN ({ids})")
+
+
+def _repair(conn, since_id, before):
+    """Adds postings back-dated into checkpointed days (ids above ``since_id``,
+    dated before ``before``) to the checkpoint rows from the first run on or
+    after their date. An account without a row on that run gets one first,
+    copied from its previous row. Returns the accounts repaired."""
+    rows = conn.execute("""
+        SELECT account_id, day, SUM(net) FROM (
+            SELECT to_account_id AS account_id, substr(transaction_date, 1, 10) AS day, amount AS net
+            FROM transactions NOT INDEXED WHERE transaction_id > ? AND transaction_date < ? AND to_account_id IS NOT NULL
+            UNION ALL
+            SELECT from_account_id, substr(transaction_date, 1, 10), -amount
+            FROM transactions NOT INDEXED WHERE transaction_id > ? AND transaction_date < ? AND from_account_id IS NOT NULL
+        ) GROUP BY account_id, day""", (since_id, before, since_id, before)).fetchall()
+    for account_id, day, net in rows:
+        target = conn.execute("SELECT MIN(day) FROM checkpoint_runs WHERE day >= ?", (day,)).fetchone()[0]
+        conn.execute("""
+            INSERT OR IGNORE INTO balance_checkpoints (account_id, day, balance)
+            VALUES (?, ?, COALESCE((SELECT balance FROM balance_checkpoints WHERE account_id = ? AND day < ?
+                                    ORDER BY day DESC LIMIT 1), 0))""", (account_id, target, account_id, target))
+        conn.execute("UPDATE balance_checkpoints SET balance = balance + ? WHERE account_id = ? AND day >= ?",
+                     (net, account_id, target))
+    return len({account_id for account_id, _, _ in rows})
+
+
+def take(conn, day):
+    """Checkpoints the balances at the end of ``day`` (a ``date``) inside the
+    caller's write transaction. Returns the number of accounts written, or
+    None if a run for this day or a later one already exists."""
+    key = day.isoformat()
+    latest = conn.execute("SELECT day, last_id FROM checkpoint_runs ORDER BY day DESC LIMIT 1").fetchone()
+    if latest is not None and latest[0] >= key:
+        return None
+    ends = _end_of(day)
+    archived = conn.execute("SELECT MAX(ends) FROM archive_partitions").fetchone()[0]
+    if archived is not None and archived > ends:
+        raise ArchivedError(f"Cannot checkpoint {key}: later postings have been archived (up to {archived[:10]}).")
+    last_id = conn.execute("SELECT COALESCE(MAX(transaction_id), 0) FROM transactions").fetchone()[0]
+
+    since = latest and _end_of(date.fromisoformat(latest[0]))
+    if latest is not None:
+        _repair(conn, latest[1], since)
+    if latest is None or (archived is not None and archived > since):
+        # First run, or postings since the last run were archived: every account.
+        changed, params = "", ()
+    else:
+        changed = """ WHERE a.account_id IN (
+            SELECT to_account_id FROM transactions WHERE transaction_date >= ? AND transaction_date < ?
+            UNION SELECT from_account_id FROM transactions WHERE transaction_date >= ? AND transaction_date < ?)"""
+        params = (since, ends, since, ends)
+    # Each account's postings after the day are read through its account indexes.
+    written = conn.execute(f"""
+        INSERT INTO balance_checkpoints (account_id, day, balance)
+        SELECT a.account_id, ?, a.balance
+            - COALESCE((SELECT SUM(amount) FROM transactions WHERE to_account_id = a.account_id AND transaction_date >= ?), 0)
+            + COALESCE((SELECT SUM(amount) FROM transactions WHERE from_account_id = a.account_id AND transaction_date >= ?), 0)
+        FROM accounts a{changed}""",
+                           (key, ends, ends, *params)).rowcount
+    conn.execute("INSERT INTO checkpoint_runs (day, last_id, accounts) VALUES (?, ?, ?)", (key, last_id, written))
+    return written
+
+
+def as_of(db, day, account_ids=None):
+    """Returns ``{account_id: balance}`` in cents at the end of ``day`` (a
+    ``date``) for every account, or for ``account_ids``. Accounts opened
+    later have a balance of 0."""
+    run = db.fetch_one("""SELECT day, (SELECT MAX(last_id) FROM checkpoint_runs) FROM checkpoint_runs
+        WHERE day <= ? ORDER BY day DESC LIMIT 1""", (day.isoformat(),))
+    ids = "" if account_ids is None else f" WHERE a.account_id IN ({', '.join(str(int(i)) for i in account_ids)})"
+    balances = dict(db.fetch_all(f"""
+        SELECT a.account_id, COALESCE((SELECT balance FROM balance_checkpoints c
+                                       WHERE c.account_id = a.account_id AND c.day <= ? ORDER BY c.day DESC LIMIT 1), 0)
+        FROM accounts a{ids}""", (run[0] if run else "",)))
+
+    def add(rows):
+        for account_id, net in rows:
+            if account_id in balances:
+                balances[account_id] += net
+
+    # Postings dated after the run (from the start of history without one), through the end of ``day``.
+    starts, ends = (_end_of(date.fromisoformat(run[0])) if run else ""), _end_of(day)
+    if starts < ends:
+        add(db.fetch_all(_net_sql(account_ids=account_ids), (starts, ends) * 2))
+        for partition in archive_partitions(db, starts or None, ends):
+            with db.attached(partition.path):
+                add(db.fetch_all(_net_sql("archive.transactions", account_ids=account_ids), (starts, ends) * 2))
+    # Postings back-dated into checkpointed days since the last run.
+    if run:
+        where = "transaction_id > ? AND transaction_date < ?"
+        add(db.fetch_all(_net_sql("transactions NOT INDEXED", where, account_ids), (run[1], starts) * 2))
+    return balances
+
+
+def balance_as_of(db, account_id, day):
+    """The balance of one account at the end of ``day``, in cents."""
+    return as_of(db, day, [account_id]).get(account_id, 0)
+
+
+def checkpoint(db_name, day, through=None, progress=None):
+    """Takes the runs for ``day`` through ``through`` (default: just ``day``),
+    each in its own transaction. Returns counts and elapsed time."""
+    progress = progress or (lambda message: None)
+    started = time.perf_counter()
+    counts = {"runs": 0, "accounts": 0}
+    conn = connect(db_name)
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                written = take(conn, day)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            if written is not None:
+                counts["runs"] += 1
+                counts["accounts"] += written
+                progress(f"{day}: {written:,} account balances")
+            if through is None or day >= through:
+                break
+            day += timedelta(days=1)
+    finally:
+        conn.close()
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record end-of-day account balances for point-in-time queries.")
+    parser.add_argument("db", help="SQLite file to process")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today(), help="business date (default: today)")
+    parser.add_argument("--through", type=date.fromisoformat, help="checkpoint every day from --date up to this one")
+    args = parser.parse_args(argv)
+
+    counts = checkpoint(args.db, args.date, args.through, progress=print)
+    print(f"Done in {counts['seconds']}s: {counts['runs']} run(s), {counts['accounts']:,} account balances written.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""SQLite connection pool and the ``Database`` facade used by the app.
+
+Every connection is opened in WAL journal mode, so readers (dashboards,
+history) never block on the writer and the writer never blocks on readers.
+``synchronous`` and ``busy_timeout`` are set per connection, and each
+connection keeps its own prepared-statement cache.
+
+A thread checks a connection out of the pool for the duration of one
+statement, or for a whole ``Database.transaction()`` block, and returns it
+afterwards. No cursor is ever shared between threads.
+
+Given a ``metrics.Metrics``, the facade times every statement it runs and
+the wait for the write lock at the start of each ``transaction()``.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import is_lock_error
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+}
+
+
+def connect(db_name, timeout=30.0, cached_statements=256, pragmas=None, check_same_thread=True, read_only=False):
+    """Opens an autocommit connection with the standard pragmas applied.
+
+    ``read_only`` connections open the file with ``mode=ro`` and skip the
+    default pragmas (the journal mode cannot be changed without writing);
+    they can only ever read. ``db_name`` may also be a ``file:`` URI, e.g.
+    a shared in-memory database (see ``snapshots.py``).
+    """
+    uri = str(db_name).startswith("file:")
+    target = f"{Path(db_name).resolve().as_uri()}?mode=ro" if read_only and not uri else db_name
+    conn = sqlite3.connect(target, timeout=timeout, isolation_level=None, uri=read_only or uri,
+                           cached_statements=cached_statements, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+    if read_only:
+        conn.execute("PRAGMA query_only = 1")
+    for name, value in {**({} if read_only else DEFAULT_PRAGMAS), **(pragmas or {})}.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """Hands out connections to threads, keeping up to ``max_idle`` open between uses."""
+
+    def __init__(self, db_name, max_idle=8, **connect_kwargs):
+        self.db_name = db_name
+        self.max_idle = max_idle
+        self.connect_kwargs = connect_kwargs
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.opened = 0
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.opened += 1
+        # Connections migrate between threads through the idle list, but only
+        # one thread ever holds a given connection at a time.
+        return connect(self.db_name, check_same_thread=False, **self.connect_kwargs)
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Yields the connection this thread is pinned to, or checks one out."""
+        pinned = getattr(self._local, "conn", None)
+        if pinned is not None:
+            yield pinned
+            return
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def pinned(self):
+        """Pins one connection to this thread for the duration of the block."""
+        if getattr(self._local, "conn", None) is not None:
+            yield self._local.conn
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Database:
+    """Query facade over a ``ConnectionPool``.
+
+    ``on_error`` is called with the ``sqlite3.Error`` when a standalone
+    statement fails (the app passes ``st.error``); without it the error is
+    raised. Inside ``transaction()`` errors always propagate so the block
+    rolls back. ``metrics`` (a ``metrics.Metrics``) receives the timing and
+    row count of every statement.
+    """
+
+    def __init__(self, db_name, on_error=None, metrics=None, **pool_kwargs):
+        self.db_name = db_name
+        self.on_error = on_error
+        self.metrics = metrics
+        self.pool = ConnectionPool(db_name, **pool_kwargs)
+        self._local = threading.local()
+
+    def _in_transaction(self):
+        return getattr(self._local, "depth", 0) > 0
+
+    def _handle(self, error):
+        if self._in_transaction() or self.on_error is None:
+            raise error
+        self.on_error(error)
+
+    def _run(self, query, params, read, many=False):
+        """Runs ``query`` on a pooled connection and returns ``read(cursor)``,
+        recording its time and row count when metrics are on."""
+        with self.pool.connection() as conn:
+            run = conn.executemany if many else conn.execute
+            if self.metrics is None:
+                return read(run(query, params))
+            started = time.perf_counter()
+            try:
+                cursor = run(query, params)
+                result = read(cursor)
+            except sqlite3.Error as e:
+                self.metrics.record_query(query, time.perf_counter() - started, error=e)
+                raise
+            if isinstance(result, list):
+                rows = len(result)
+            elif result is cursor:
+                rows = max(cursor.rowcount, 0)
+            else:
+                rows = int(result is not None)
+            self.metrics.record_query(query, time.perf_counter() - started, rows,
+                                      conn=None if many else conn, params=params)
+            return result
+
+    def execute_query(self, query, params=()):
+        """Runs one statement. The cursor is returned for ``lastrowid``/``rowcount``;
+        use ``fetch_one``/``fetch_all`` to read rows."""
+        try:
+            return self._run(query, params, lambda cursor: cursor)
+        except sqlite3.Error as e:
+            self._handle(e)
+            return None
+
+    def executemany(self, query, seq_of_params):
+        try:
+            return self._run(query, seq_of_params, lambda cursor: cursor, many=True)
+        except sqlite3.Error as e:
+            self._handle(e)
+            return None
+
+    def fetch_one(self, query, params=()):
+        try:
+            return self._run(query, params, lambda cursor: cursor.fetchone())
+        except sqlite3.Error as e:
+            self._handle(e)
+            return None
+
+    def fetch_all(self, query, params=()):
+        try:
+            return self._run(query, params, lambda cursor: cursor.fetchall())
+        except sqlite3.Error as e:
+            self._handle(e)
+            return []
+
+    def _begin(self, conn, mode):
+        if self.metrics is None:
+            conn.execute(f"BEGIN {mode}")
+            return
+        started = time.perf_counter()
+        try:
+            conn.execute(f"BEGIN {mode}")
+        except sqlite3.OperationalError as e:
+            if is_lock_error(e):
+                self.metrics.record_lock_error()
+            raise
+        finally:
+            if mode != "DEFERRED":
+                self.metrics.record_lock_wait(time.perf_counter() - started)
+
+    @contextmanager
+    def transaction(self, mode="IMMEDIATE"):
+        """Runs the block in one transaction on one connection; nests as a no-op."""
+        with self.pool.pinned() as conn:
+            if self._in_transaction():
+                self._local.depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._local.depth -= 1
+                return
+            self._begin(conn, mode)
+            self._local.depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+            finally:
+                self._local.depth = 0
+
+    @contextmanager
+    def attached(self, path, schema="archive"):
+        """Pins one connection with the database file at ``path`` attached as
+        ``schema`` for the block; statements run through this facade inside
+        the block can read ``schema.<table>``."""
+        with self.pool.pinned() as conn:
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (str(path),))
+            try:
+                yield conn
+            finally:
+                conn.execute(f"DETACH DATABASE {schema}")
+
+    def close(self):
+        self.pool.close_all()
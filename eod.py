@@ -0,0 +1,288 @@
+"""End-of-day batch: interest accrual and loan installments.
+
+    python eod.py banking_v2.db --date 2025-01-31
+    python eod.py banking_v2.db --date 2025-01-01 --through 2025-01-31
+
+For each business date the job
+
+1. accrues interest (actual/365) on every active account whose type earns
+   interest (``DEPOSIT_RATES``) and, on the last day of the month, credits
+   the accrued interest to the account;
+2. schedules every newly approved loan (``amortization.open_loans``),
+   accrues interest on each loan's outstanding principal at the loan's
+   rate and, once the next scheduled installment is due, debits it
+   from the borrower's account. An installment the account cannot cover is
+   counted as missed once, by the run its due date falls in, and retried on
+   every run after that; overdue installments are collected one per run;
+3. checkpoints every account whose balance changed during the day
+   (``checkpoints.take``), for point-in-time balance queries.
+
+A run accrues one day's interest, or every day since the previous run if
+business dates were skipped. A month end among the skipped dates is
+credited by the run that covers it.
+
+Accounts and loans are streamed in keyset chunks. Each chunk is read,
+computed with NumPy/pandas array arithmetic and written back with
+``executemany`` in one transaction, together with a checkpoint in
+``eod_runs``; an interrupted run resumes after the last committed chunk.
+Accruals are whole cents, with the sub-cent remainder carried to the next
+day, so nothing is lost to rounding.
+
+The day's totals are added to ``income_daily``, which feeds the income
+statement (``reports.income_statement``).
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import checkpoints
+from amortization import open_loans
+from database import connect
+
+# Annual deposit interest rates in percent, like loans.interest_rate.
+DEPOSIT_RATES = {"Savings": 2.0}
+DAYS_PER_YEAR = 365
+
+
+class EodError(Exception):
+    """Raised when a business date cannot be run (out of order, or another date is unfinished)."""
+
+
+def _is_month_end(day):
+    return (day + timedelta(days=1)).month != day.month
+
+
+def _month_end_within(day, days):
+    """The last month end in the ``days`` days up to and including ``day``, or None."""
+    month_end = day if _is_month_end(day) else day.replace(day=1) - timedelta(days=1)
+    return month_end if (day - month_end).days < days else None
+
+
+def _accrue(base, rate, carry, days=1):
+    """``days`` days' interest on ``base`` cents at ``rate`` percent a year, plus
+    the carried remainder. Returns ``(whole_cents, new_carry)``."""
+    exact = np.maximum(base, 0) * rate * days / (100.0 * DAYS_PER_YEAR) + carry
+    cents = np.floor(exact)
+    return cents.astype(np.int64), exact - cents
+
+
+def _add_income(conn, business_date, totals):
+    conn.executemany(
+        """INSERT INTO income_daily (business_date, item, amount) VALUES (?, ?, ?)
+           ON CONFLICT (business_date, item) DO UPDATE SET amount = amount + excluded.amount""",
+        [(business_date, item, int(amount)) for item, amount in totals.items()])
+
+
+def _checkpoint(conn, business_date, phase, cursor):
+    conn.execute("UPDATE eod_runs SET phase = ?, cursor = ? WHERE business_date = ?", (phase, cursor, business_date))
+
+
+def _deposit_chunk(conn, day, days, after, chunk_size):
+    """Accrues (and at month end credits) deposit interest for the next chunk of accounts.
+    Returns ``(last_account_id, rows)``, or ``(None, 0)`` when there are no more accounts."""
+    business_date = day.isoformat()
+    types = list(DEPOSIT_RATES)
+    rows = conn.execute(f"""
+        SELECT a.account_id, a.account_type, a.balance, COALESCE(i.accrued, 0), COALESCE(i.carry, 0)
+        FROM accounts a LEFT JOIN interest_accruals i ON i.account_id = a.account_id
+        WHERE a.account_id > ? AND a.is_active = 1 AND a.account_type IN ({', '.join('?' * len(types))})
+        ORDER BY a.account_id LIMIT ?""", (after, *types, chunk_size)).fetchall()
+    if not rows:
+        return None, 0
+    frame = pd.DataFrame.from_records(rows, columns=["account_id", "account_type", "balance", "accrued", "carry"])
+    rate = frame["account_type"].map(DEPOSIT_RATES).to_numpy(dtype=np.float64)
+    accrual, carry = _accrue(frame["balance"].to_numpy(dtype=np.int64), rate, frame["carry"].to_numpy(), days)
+    accrued = frame["accrued"].to_numpy(dtype=np.int64) + accrual
+    account_ids = frame["account_id"].to_numpy()
+
+    paid = np.zeros_like(accrued)
+    month_end = _month_end_within(day, days)
+    if month_end is not None:
+        paid, accrued = accrued, np.zeros_like(accrued)
+        credit = paid > 0
+        ids, amounts = account_ids[credit].tolist(), paid[credit].tolist()
+        conn.executemany("UPDATE accounts SET balance = balance + ? WHERE account_id = ?", zip(amounts, ids))
+        conn.executemany(
+            "INSERT INTO transactions (to_account_id, transaction_type, amount, description, transaction_date) VALUES (?, 'Interest Credit', ?, ?, ?)",
+            [(account_id, amount, f"Interest for {month_end:%B %Y}", f"{business_date} 23:59:59") for account_id, amount in zip(ids, amounts)])
+
+    conn.executemany(
+        """INSERT INTO interest_accruals (account_id, accrued, carry) VALUES (?, ?, ?)
+           ON CONFLICT (account_id) DO UPDATE SET accrued = excluded.accrued, carry = excluded.carry""",
+        zip(account_ids.tolist(), accrued.tolist(), carry.tolist()))
+    _add_income(conn, business_date, {"deposit_interest_accrued": accrual.sum(), "deposit_interest_paid": paid.sum()})
+    return int(account_ids[-1]), len(rows)
+
+
+def _loan_chunk(conn, day, days, after, chunk_size):
+    """Accrues loan interest and collects installments due for the next chunk of loans.
+    Returns ``(last_loan_id, rows)``, or ``(None, 0)`` when there are no more loans."""
+    business_date = day.isoformat()
+    covered_from = (day - timedelta(days=days)).isoformat()  # the run covers the days after this one
+    rows = conn.execute("""
+        SELECT p.loan_id, p.account_id, p.principal, p.accrued, p.carry, p.paid_installments, p.missed_installments,
+               p.installment, p.next_due, l.interest_rate, a.balance,
+               s.due_date, s.payment, s.interest, s.balance, n.payment, n.due_date
+        FROM loan_positions p
+        JOIN loans l ON l.loan_id = p.loan_id
+        JOIN accounts a ON a.account_id = p.account_id
+        LEFT JOIN loan_schedule s ON s.loan_id = p.loan_id AND s.installment_no = p.paid_installments + 1
+        LEFT JOIN loan_schedule n ON n.loan_id = p.loan_id AND n.installment_no = p.paid_installments + 2
+        WHERE p.loan_id > ? AND p.principal > 0
+        ORDER BY p.loan_id LIMIT ?""", (after, chunk_size)).fetchall()
+    if not rows:
+        return None, 0
+    frame = pd.DataFrame.from_records(rows, columns=[
+        "loan_id", "account_id", "principal", "accrued", "carry", "paid", "missed", "installment", "next_due", "rate",
+        "balance", "due_date", "payment", "interest", "balance_after", "next_payment", "next_next_due"])
+    principal = frame["principal"].to_numpy(dtype=np.int64)
+    accrual, carry = _accrue(principal, frame["rate"].to_numpy(dtype=np.float64), frame["carry"].to_numpy(), days)
+    accrued = frame["accrued"].to_numpy(dtype=np.int64) + accrual
+
+    # The next scheduled installment is collected once due, as scheduled (see amortization.py).
+    due = (frame["due_date"].notna() & (frame["due_date"] <= business_date)).to_numpy()
+    payment = np.where(due, frame["payment"].fillna(0).to_numpy(dtype=np.int64), 0)
+    # Several loans may draw on one account: check funds against the running total per account.
+    drawn = pd.Series(payment).groupby(frame["account_id"]).cumsum().to_numpy()
+    collected = due & (drawn <= frame["balance"].to_numpy(dtype=np.int64))
+    payment = np.where(collected, payment, 0)
+    # Missed once, by the run that covers the due date; later retries are not counted again.
+    missed = due & ~collected & (frame["due_date"] > covered_from).to_numpy()
+    interest_paid = np.where(collected, frame["interest"].fillna(0).to_numpy(dtype=np.int64), 0)
+    remaining = np.where(collected, frame["balance_after"].fillna(0).to_numpy(dtype=np.int64), principal)
+    principal_paid = principal - remaining
+
+    frame["principal"] = remaining
+    frame["accrued"] = accrued - interest_paid  # what accrued daily less what the schedule charged
+    frame["carry"] = carry
+    frame["paid"] += collected
+    frame["missed"] += missed
+    finished = collected & frame["next_payment"].isna().to_numpy()
+    rolled = collected & ~finished
+    frame.loc[rolled, "installment"] = frame.loc[rolled, "next_payment"]
+    frame.loc[rolled, "next_due"] = frame.loc[rolled, "next_next_due"]
+    frame["installment"] = frame["installment"].astype(np.int64)
+
+    conn.executemany(
+        """UPDATE loan_positions SET principal = ?, accrued = ?, carry = ?, paid_installments = ?,
+           missed_installments = ?, installment = ?, next_due = ? WHERE loan_id = ?""",
+        frame[["principal", "accrued", "carry", "paid", "missed", "installment", "next_due", "loan_id"]].itertuples(index=False, name=None))
+    if collected.any():
+        ids = frame["account_id"].to_numpy()[collected].tolist()
+        amounts = payment[collected].tolist()
+        loan_ids = frame["loan_id"].to_numpy()[collected].tolist()
+        conn.executemany("UPDATE accounts SET balance = balance - ? WHERE account_id = ?", zip(amounts, ids))
+        conn.executemany(
+            "INSERT INTO transactions (from_account_id, transaction_type, amount, description, transaction_date) VALUES (?, 'Loan Repayment', ?, ?, ?)",
+            [(account_id, amount, f"Loan ID {loan_id} installment", f"{business_date} 23:59:59")
+             for account_id, amount, loan_id in zip(ids, amounts, loan_ids)])
+    _add_income(conn, business_date, {
+        "loan_interest_accrued": accrual.sum(),
+        "loan_interest_collected": interest_paid.sum(),
+        "loan_principal_collected": principal_paid.sum(),
+        "installments_collected": collected.sum(),
+        "installments_missed": missed.sum(),
+    })
+    return int(frame["loan_id"].iloc[-1]), len(rows)
+
+
+def _balance_step(conn, day, days, after, chunk_size):
+    """Checkpoints the closing balances of ``day``. Returns ``(None, accounts_written)``."""
+    try:
+        written = checkpoints.take(conn, day)
+    except checkpoints.ArchivedError:
+        written = None  # later months are archived; as_of replays from the previous checkpoint
+    return None, written or 0
+
+
+def _start(conn, business_date):
+    """Registers (or finds) the run for ``business_date``. Returns ``(phase,
+    cursor, days)``, ``days`` being the days since the previous run (1 for
+    the first run)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        unfinished = conn.execute("SELECT business_date FROM eod_runs WHERE phase != 'done' AND business_date != ?",
+                                  (business_date,)).fetchone()
+        if unfinished:
+            raise EodError(f"End of day for {unfinished[0]} has not finished; run it again to resume it first.")
+        row = conn.execute("SELECT phase, cursor FROM eod_runs WHERE business_date = ?", (business_date,)).fetchone()
+        if row is None:
+            latest = conn.execute("SELECT MAX(business_date) FROM eod_runs").fetchone()[0]
+            if latest is not None and latest > business_date:
+                raise EodError(f"End of day has already run for {latest}; business dates must be run in order.")
+            conn.execute("INSERT INTO eod_runs (business_date, phase) VALUES (?, 'deposits')", (business_date,))
+            row = ("deposits", 0)
+        previous = conn.execute("SELECT MAX(business_date) FROM eod_runs WHERE business_date < ?", (business_date,)).fetchone()[0]
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    days = (date.fromisoformat(business_date) - date.fromisoformat(previous)).days if previous else 1
+    return (*row, days)
+
+
+def run(db_name, business_date, chunk_size=50000, progress=None):
+    """Runs (or resumes) end of day for ``business_date`` (a ``date``). Returns
+    counts and elapsed time; a date that has already finished is not run again.
+    """
+    progress = progress or (lambda message: None)
+    started = time.perf_counter()
+    day_key = business_date.isoformat()
+    conn = connect(db_name)
+    try:
+        phase, cursor, days = _start(conn, day_key)
+        counts = {"business_date": day_key, "days": days, "already_done": phase == "done",
+                  "resumed": phase in ("loans", "balances") or (phase == "deposits" and cursor > 0),
+                  "accounts": 0, "loans": 0, "loans_opened": 0, "balances": 0}
+        steps = {"deposits": (_deposit_chunk, "accounts", "loans"), "loans": (_loan_chunk, "loans", "balances"),
+                 "balances": (_balance_step, "balances", "done")}
+        while phase != "done":
+            step, counter, next_phase = steps[phase]
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if phase == "loans" and cursor == 0:
+                    counts["loans_opened"] += open_loans(conn)
+                last, rows = step(conn, business_date, days, cursor, chunk_size)
+                if last is None:
+                    phase, cursor = next_phase, 0
+                else:
+                    cursor = last
+                counts[counter] += rows
+                _checkpoint(conn, day_key, phase, cursor)
+                if phase == "done":
+                    conn.execute("UPDATE eod_runs SET finished_at = CURRENT_TIMESTAMP WHERE business_date = ?", (day_key,))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            if last is not None:
+                progress(f"{day_key}: {counts['accounts']:,} accounts, {counts['loans']:,} loans")
+        counts["income"] = dict(conn.execute("SELECT item, amount FROM income_daily WHERE business_date = ?", (day_key,)).fetchall())
+    finally:
+        conn.close()
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the end-of-day interest and loan installment batch.")
+    parser.add_argument("db", help="SQLite file to process")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today(), help="business date (default: today)")
+    parser.add_argument("--through", type=date.fromisoformat, help="run every business date from --date up to this one")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    day = args.date
+    while True:
+        counts = run(args.db, day, chunk_size=args.chunk_size, progress=print)
+        print(f"Done in {counts['seconds']}s: {counts}")
+        if args.through is None or day >= args.through:
+            break
+        day += timedelta(days=1)
+
+
+if __name__ == "__main__":
+    main()
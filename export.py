@@ -0,0 +1,244 @@
+"""Streaming exports: customer statements and full-ledger extracts.
+
+    python export.py banking_v2.db ledger --from 2024-01-01 --to 2024-12-31 --out ledger-2024.csv.gz
+    python export.py banking_v2.db statement --customer 42 --from 2024-01-01 --out statement-42.csv
+    python export.py banking_v2.db ledger --format parquet --out ledger.parquet
+
+Rows are read from one cursor with ``fetchmany()`` and flow through
+generators straight into the writer: CSV line by line (gzip-compressed when
+the file name ends in ``.gz``), Parquet one row group per chunk. Memory stays
+flat however many rows are exported. The hot rows are read in one read
+transaction, which sees a consistent snapshot (WAL) while postings continue.
+
+When the period reaches back before the archive horizon (see archive.py),
+each archived month in it is attached in turn, oldest first, and its rows
+are exported ahead of the hot ones. Rows back-dated into an archived month
+after it was archived (an end-of-day run for an old business date) come
+last until the next archive run moves them. Months outside the period are
+never opened.
+
+Amounts are exact decimal dollars (converted from integer cents). Statement
+rows carry the account's running balance, starting from the balance at the
+beginning of the period. Parquet needs ``pyarrow``; CSV has no extra
+dependencies.
+"""
+import argparse
+import csv
+import gzip
+import io
+import time
+from datetime import date
+from decimal import Decimal
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; without it only CSV is available.
+    pa = None
+
+from database import connect
+from history import date_filter, partition_file, partition_filter
+from money import format_decimal
+
+FORMATS = ("csv", "parquet")
+CHUNK_SIZE = 10000
+
+LEDGER_COLUMNS = ["transaction_id", "transaction_date", "transaction_type", "from_account", "to_account", "amount", "description"]
+STATEMENT_COLUMNS = ["transaction_date", "transaction_id", "account", "transaction_type", "description", "amount", "balance"]
+_MONEY_COLUMNS = {"amount", "balance"}
+_INT_COLUMNS = {"transaction_id"}
+
+
+def _fetch_chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _archived(conn, date_from=None, date_to=None):
+    """Attaches each archived month overlapping the range as ``archive``,
+    oldest first, yielding while it is attached. Must run outside a transaction."""
+    live_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    for _, path, _, _ in reversed(conn.execute(*partition_filter(date_from, date_to)).fetchall()):
+        conn.execute("ATTACH DATABASE ? AS archive", (partition_file(live_file, path),))
+        try:
+            yield
+        finally:
+            conn.execute("DETACH DATABASE archive")
+
+
+def _sources(conn, date_from=None, date_to=None):
+    """Yields the schema prefix of each place holding rows in the range, in
+    date order: every archived month in turn, then the hot tables (read in
+    one transaction)."""
+    for _ in _archived(conn, date_from, date_to):
+        yield "archive."
+    conn.execute("BEGIN")
+    try:
+        yield ""
+    finally:
+        conn.execute("COMMIT")
+
+
+def ledger_chunks(conn, date_from=None, date_to=None, chunk_size=CHUNK_SIZE):
+    """Yields lists of ledger rows (``LEDGER_COLUMNS``, amounts in cents) in date order."""
+    clauses, params = date_filter(date_from, date_to, column="t.transaction_date")
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    for schema in _sources(conn, date_from, date_to):
+        cursor = conn.execute(f"""
+            SELECT t.transaction_id, t.transaction_date, t.transaction_type, fa.account_number, ta.account_number,
+                   t.amount, t.description
+            FROM {schema}transactions t
+            LEFT JOIN main.accounts fa ON fa.account_id = t.from_account_id
+            LEFT JOIN main.accounts ta ON ta.account_id = t.to_account_id
+            {where}
+            ORDER BY t.transaction_date, t.transaction_id""", params)
+        yield from _fetch_chunks(cursor, chunk_size)
+
+
+def statement_chunks(conn, customer_id, date_from=None, date_to=None, chunk_size=CHUNK_SIZE):
+    """Yields lists of statement rows (``STATEMENT_COLUMNS``, amounts in cents)
+    for every account of a customer, oldest first, with running balances."""
+    accounts = conn.execute("SELECT account_id, account_number FROM accounts WHERE customer_id = ? ORDER BY account_id",
+                            (customer_id,)).fetchall()
+    if not accounts:
+        return
+    since, since_params = date_filter(date_from, None)
+    since_sql = "".join(f" AND {c}" for c in since)
+
+    def net_since(schema, account_id):
+        credits = conn.execute(f"SELECT COALESCE(SUM(amount), 0) FROM {schema}transactions WHERE to_account_id = ?{since_sql}",
+                               (account_id, *since_params)).fetchone()[0]
+        debits = conn.execute(f"SELECT COALESCE(SUM(amount), 0) FROM {schema}transactions WHERE from_account_id = ?{since_sql}",
+                              (account_id, *since_params)).fetchone()[0]
+        return credits - debits
+
+    # Opening balance: today's balance less everything posted since the period
+    # began. The balance is read in the same snapshot as the hot postings it is netted against.
+    balances = {number: 0 for _, number in accounts}
+    for schema in _sources(conn, date_from, None):
+        for account_id, number in accounts:
+            if not schema:
+                balances[number] += conn.execute("SELECT balance FROM accounts WHERE account_id = ?", (account_id,)).fetchone()[0]
+            balances[number] -= net_since(schema, account_id)
+
+    clauses, params = date_filter(date_from, date_to)
+    filters = "".join(f" AND {c}" for c in clauses)
+    for schema in _sources(conn, date_from, date_to):
+        branches, branch_params = [], []
+        for account_id, number in accounts:
+            for side, sign in (("from", "-"), ("to", "")):
+                branches.append(f"""
+            SELECT transaction_date, transaction_id, ? AS account, transaction_type, description, {sign}amount AS amount
+            FROM {schema}transactions WHERE {side}_account_id = ?{filters}""")
+                branch_params.extend([number, account_id, *params])
+        cursor = conn.execute("\n            UNION ALL".join(branches) + "\n            ORDER BY transaction_date, transaction_id, amount",
+                              branch_params)
+        for rows in _fetch_chunks(cursor, chunk_size):
+            out = []
+            for row in rows:
+                balances[row[2]] += row[5]
+                out.append((*row, balances[row[2]]))
+            yield out
+
+
+def write_csv(binary, columns, chunks, compress=False):
+    """Writes chunks as CSV to a binary file object. Returns the row count."""
+    raw = gzip.GzipFile(fileobj=binary, mode="wb") if compress else binary
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    money = [i for i, column in enumerate(columns) if column in _MONEY_COLUMNS]
+    count = 0
+    for rows in chunks:
+        for row in rows:
+            row = list(row)
+            for i in money:
+                row[i] = format_decimal(row[i])
+            writer.writerow(row)
+        count += len(rows)
+    text.flush()
+    text.detach()
+    if compress:
+        raw.close()  # writes the gzip trailer; leaves ``binary`` open
+    return count
+
+
+def _arrow_schema(columns):
+    return pa.schema([(column, pa.decimal128(18, 2) if column in _MONEY_COLUMNS else
+                       pa.int64() if column in _INT_COLUMNS else pa.string()) for column in columns])
+
+
+def write_parquet(binary, columns, chunks):
+    """Writes chunks as Parquet to a binary file object, one row group per chunk. Returns the row count."""
+    if pa is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow).")
+    schema = _arrow_schema(columns)
+    cents = pa.scalar(Decimal("0.01"), pa.decimal128(3, 2))
+    count = 0
+    with pq.ParquetWriter(binary, schema) as writer:
+        for rows in chunks:
+            arrays = []
+            for i, field in enumerate(schema):
+                values = [row[i] for row in rows]
+                if field.name in _MONEY_COLUMNS:
+                    arrays.append(pc.multiply(pa.array(values, pa.int64()).cast(pa.decimal128(19, 0)), cents).cast(field.type))
+                else:
+                    arrays.append(pa.array(values, field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+
+def export(db_name, kind, out, fmt="csv", compress=False, customer_id=None, date_from=None, date_to=None,
+           chunk_size=CHUNK_SIZE):
+    """Exports a ``"ledger"`` or a customer ``"statement"`` to ``out`` (a path
+    or a binary file object). Returns the number of rows written."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {FORMATS}.")
+    conn = connect(db_name, read_only=True)
+    try:
+        if kind == "ledger":
+            columns, chunks = LEDGER_COLUMNS, ledger_chunks(conn, date_from, date_to, chunk_size)
+        elif kind == "statement":
+            columns, chunks = STATEMENT_COLUMNS, statement_chunks(conn, customer_id, date_from, date_to, chunk_size)
+        else:
+            raise ValueError(f"Unknown export {kind!r}; expected 'ledger' or 'statement'.")
+        binary = open(out, "wb") if isinstance(out, str) else out
+        try:
+            if fmt == "parquet":
+                return write_parquet(binary, columns, chunks)
+            return write_csv(binary, columns, chunks, compress=compress)
+        finally:
+            if binary is not out:
+                binary.close()
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a customer statement or the full ledger.")
+    parser.add_argument("db", help="SQLite file to read")
+    parser.add_argument("kind", choices=["ledger", "statement"])
+    parser.add_argument("--customer", type=int, help="customer_id (statements)")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="first day (inclusive)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="last day (inclusive)")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file name, else csv")
+    parser.add_argument("--out", required=True, help="output file; a .gz suffix compresses CSV")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    if args.kind == "statement" and args.customer is None:
+        parser.error("statement exports need --customer")
+
+    fmt = args.format or ("parquet" if args.out.endswith(".parquet") else "csv")
+    started = time.perf_counter()
+    count = export(args.db, args.kind, args.out, fmt=fmt, compress=args.out.endswith(".gz"), customer_id=args.customer,
+                   date_from=args.date_from, date_to=args.date_to, chunk_size=args.chunk_size)
+    print(f"Wrote {count:,} rows to {args.out} in {time.perf_counter() - started:.2f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Paginated transaction history.
+
+History is read per account: for each of the customer's accounts there is
+one debit-side branch (``from_account_id = ?``) and one credit-side branch
+(``to_account_id = ?``). Each branch is a range scan over the
+``(account, transaction_date)`` indexes created by the schema setup, and it
+stops after one page of rows. The branches are combined with ``UNION ALL``,
+so the final sort only ever sees ``2 * accounts * page_size`` rows.
+
+Pages are addressed by keyset rather than OFFSET: the cursor is the
+``(transaction_date, transaction_id)`` of the last row shown, so page N costs
+the same as page one. Date, type and amount filters are applied in SQL.
+
+Months moved out by archive.py are listed in ``archive_partitions``. A page
+is read from the hot ``transactions`` table first. An archived month is
+attached and read only when the page is not yet full at that month's end
+and the requested date range reaches into it, so recent history never opens
+an archive file.
+"""
+import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+HistoryRow = namedtuple("HistoryRow", "transaction_id transaction_date description transaction_type amount account")
+HistoryPage = namedtuple("HistoryPage", "rows next_cursor")
+Partition = namedtuple("Partition", "period path starts ends")
+
+TRANSACTION_TYPES = ["Transfer", "Deposit", "Withdrawal", "Loan Disbursement", "Loan Repayment", "Interest Credit"]
+
+HISTORY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_accounts_customer ON accounts (customer_id, account_id, account_type, account_number)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_from ON transactions (from_account_id, transaction_date)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_to ON transactions (to_account_id, transaction_date)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (transaction_date)",
+]
+
+_BRANCH = """
+    SELECT * FROM (
+        SELECT transaction_id, transaction_date, description, transaction_type, {sign}amount AS amount, ? AS account
+        FROM {table}
+        WHERE {side}_account_id = ?{filters}
+        ORDER BY transaction_date DESC, transaction_id DESC
+        LIMIT ?
+    )"""
+
+
+def _as_timestamp(value, end_of_day=False):
+    """Normalizes a date/datetime/str bound to the stored TIMESTAMP text format."""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        if end_of_day:
+            value = value + timedelta(days=1)
+        return value.strftime("%Y-%m-%d 00:00:00")
+    return str(value)
+
+
+def date_filter(date_from=None, date_to=None, column="transaction_date"):
+    """Returns ``(clauses, params)`` bounding ``column`` to the range. Either
+    bound may be None; a plain date ``date_to`` includes the whole day."""
+    clauses, params = [], []
+    if date_from is not None:
+        clauses.append(f"{column} >= ?")
+        params.append(_as_timestamp(date_from))
+    if date_to is not None:
+        clauses.append(f"{column} < ?" if isinstance(date_to, date) and not isinstance(date_to, datetime) else f"{column} <= ?")
+        params.append(_as_timestamp(date_to, end_of_day=True))
+    return clauses, params
+
+
+def partition_filter(date_from=None, date_to=None):
+    """Returns ``(sql, params)`` selecting the archived months that overlap
+    the range (bounds as in ``date_filter``), newest first."""
+    clauses, params = [], []
+    if date_from is not None:
+        clauses.append("ends > ?")
+        params.append(_as_timestamp(date_from))
+    if date_to is not None:
+        clauses.append("starts < ?" if isinstance(date_to, date) and not isinstance(date_to, datetime) else "starts <= ?")
+        params.append(_as_timestamp(date_to, end_of_day=True))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return f"SELECT period, path, starts, ends FROM archive_partitions{where} ORDER BY period DESC", params
+
+
+def partition_file(live_file, path):
+    """The archive file at ``path`` as recorded in ``archive_partitions``.
+    Paths are stored absolute; a relative one (from an older archive run)
+    is taken relative to the directory of ``live_file``, the main database."""
+    return path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(live_file)), path)
+
+
+def archive_partitions(db, date_from=None, date_to=None):
+    """Returns the archived months overlapping the range as ``Partition`` rows, newest first."""
+    rows = db.fetch_all(*partition_filter(date_from, date_to))
+    return [Partition(period, partition_file(db.db_name, path), starts, ends) for period, path, starts, ends in rows]
+
+
+def read_partitions(db, rows, need, key, query, params, date_from=None, date_to=None):
+    """Adds rows from archived months to ``rows`` (sorted newest first by
+    ``key``, a ``(timestamp, id)`` pair) until ``need`` rows are certain to be the newest. ``query`` is
+    formatted with ``{schema}`` ("archive.") and run on each month attached
+    in turn. Returns the merged rows, at most ``need`` of them."""
+    for partition in archive_partitions(db, date_from, date_to):
+        if len(rows) >= need and key(rows[need - 1])[0] >= partition.ends:
+            break  # everything in this month (and older ones) sorts after the page
+        with db.attached(partition.path):
+            rows = rows + db.fetch_all(query.format(schema="archive."), params)
+        rows.sort(key=key, reverse=True)
+        rows = rows[:need]
+    return rows
+
+
+def customer_accounts(db, customer_id):
+    """Returns ``(account_id, label)`` pairs for a customer's accounts."""
+    rows = db.fetch_all(
+        "SELECT account_id, account_type || ' (' || account_number || ')' FROM accounts WHERE customer_id = ? ORDER BY account_id",
+        (customer_id,)
+    )
+    return [(row[0], row[1]) for row in rows]
+
+
+def _filters(cursor, date_from, date_to, transaction_types, min_amount, max_amount):
+    clauses, params = [], []
+    if cursor is not None:
+        clauses.append("(transaction_date < ? OR (transaction_date = ? AND transaction_id < ?))")
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    date_clauses, date_params = date_filter(date_from, date_to)
+    clauses.extend(date_clauses)
+    params.extend(date_params)
+    if transaction_types:
+        clauses.append(f"transaction_type IN ({', '.join('?' * len(transaction_types))})")
+        params.extend(transaction_types)
+    if min_amount is not None:
+        clauses.append("amount >= ?")
+        params.append(min_amount)
+    if max_amount is not None:
+        clauses.append("amount <= ?")
+        params.append(max_amount)
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def fetch_history_page(db, customer_id, page_size=50, cursor=None, date_from=None, date_to=None,
+                       transaction_types=None, min_amount=None, max_amount=None, accounts=None):
+    """Returns one ``HistoryPage`` of a customer's transactions, newest first.
+
+    Amounts are integer cents; debits are returned as negative. ``cursor`` is the ``next_cursor``
+    of the previous page (``None`` for the first page); ``next_cursor`` is
+    ``None`` when there are no more rows. ``min_amount``/``max_amount`` (Money or
+    cents) apply to the unsigned transaction amount. ``accounts`` may be passed in (as
+    returned by ``customer_accounts``) to skip the account lookup.
+    """
+    if accounts is None:
+        accounts = customer_accounts(db, customer_id)
+    if not accounts:
+        return HistoryPage([], None)
+
+    filters, filter_params = _filters(cursor, date_from, date_to, transaction_types, min_amount, max_amount)
+    branches, params = [], []
+    for account_id, label in accounts:
+        for side, sign in (("from", "-"), ("to", "")):
+            branches.append(_BRANCH.format(sign=sign, side=side, filters=filters, table="{schema}transactions"))
+            params.extend([label, account_id, *filter_params, page_size + 2])
+    query = "\n    UNION ALL".join(branches) + "\nORDER BY transaction_date DESC, transaction_id DESC LIMIT ?"
+    params.append(page_size + 2)
+
+    fetched = db.fetch_all(query.format(schema=""), params)
+    fetched = read_partitions(db, fetched, page_size + 2, lambda row: (row[1], row[0]), query, params,
+                              date_from, cursor[0] if cursor is not None else date_to)
+    fetched = [HistoryRow(*row) for row in fetched]
+    rows = fetched[:page_size]
+    # A transfer between two of the customer's own accounts yields a debit and
+    # a credit row with the same transaction_id; never split them across pages.
+    if len(fetched) > page_size and rows and fetched[page_size].transaction_id == rows[-1].transaction_id:
+        rows = fetched[:page_size + 1]
+    if len(fetched) <= len(rows):
+        return HistoryPage(rows, None)
+    last = rows[-1]
+    return HistoryPage(rows, (last.transaction_date, last.transaction_id))
@@ -0,0 +1,265 @@
+"""Bulk posting of transaction batch files (payroll, settlements).
+
+    python ingest.py banking_v2.db payroll.csv --rejects payroll-rejects.csv
+    python ingest.py banking_v2.db settlement.jsonl --atomic batch
+
+A batch is CSV (with a header row) or JSON Lines with the fields ``type``,
+``from_account``, ``to_account``, ``amount`` (dollars, at most two decimal
+places) and ``description``. Accounts are given by account number. ``type``
+may be left empty: a line with both accounts is a Transfer, one with only
+``to_account`` a Deposit and one with only ``from_account`` a Withdrawal.
+
+The file is parsed as a stream, ``chunk_size`` lines at a time. Account
+numbers are resolved through a map loaded once at the start. Each chunk
+then takes the write lock, loads the balances of the accounts it touches
+and checks every debit against a running balance kept in memory, in file
+order, so a line may spend money credited by an earlier line. Accepted
+lines are written with two ``executemany`` calls (the transaction rows and
+one balance update per account). Rejected lines, with the reason, go to the
+rejects file.
+
+``atomic="chunk"`` commits chunk by chunk: the lines accepted so far stay
+posted if a later chunk fails, and other postings can run between chunks.
+``atomic="batch"`` holds one write transaction for the whole file and posts
+nothing unless every line is accepted.
+"""
+import argparse
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from audit import INSERT_AUDIT
+from database import connect
+from money import CENTS, format_money
+
+FIELDS = ("type", "from_account", "to_account", "amount", "description")
+REJECT_FIELDS = ("line", "reason") + FIELDS
+FORMATS = ("csv", "jsonl")
+ATOMICITY = ("chunk", "batch")
+CHUNK_SIZE = 5000
+
+_TYPES = {(True, True): "Transfer", (False, True): "Deposit", (True, False): "Withdrawal"}
+_DESCRIPTIONS = {"Deposit": "Cash/Check Deposit", "Withdrawal": "Cash Withdrawal", "Transfer": ""}
+
+_INSERT = "INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description) VALUES (?, ?, ?, ?, ?)"
+
+
+class IngestError(Exception):
+    """Raised when a batch file cannot be read at all (bad header, unknown format)."""
+
+
+class _Reject(Exception):
+    pass
+
+
+def format_for(name):
+    """Guesses the batch format from a file name."""
+    return "jsonl" if name.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_records(text, fmt="csv"):
+    """Yields ``(line_number, record)`` from a text stream; malformed JSON
+    lines are yielded as ``(line_number, None)`` so they can be rejected."""
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        if reader.fieldnames is None or not {"amount", "from_account", "to_account"} & set(reader.fieldnames):
+            raise IngestError(f"CSV header must name the columns {', '.join(FIELDS)}.")
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "jsonl":
+        for number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield number, record if isinstance(record, dict) else None
+    else:
+        raise IngestError(f"Unknown batch format {fmt!r}; expected one of {FORMATS}.")
+
+
+def _text(value):
+    return "" if value is None else str(value).strip()
+
+
+def _cents(value):
+    try:
+        amount = Decimal(_text(value))
+    except InvalidOperation:
+        raise _Reject("Invalid amount.") from None
+    if not amount.is_finite() or amount <= 0:
+        raise _Reject("Amount must be positive.")
+    cents = amount * CENTS
+    if cents != cents.to_integral_value():
+        raise _Reject("Amount has more than two decimal places.")
+    return int(cents)
+
+
+def _parse(record, accounts):
+    """Resolves one record to ``(type, from_id, to_id, cents, description)``."""
+    if record is None:
+        raise _Reject("Malformed line.")
+    numbers = _text(record.get("from_account")), _text(record.get("to_account"))
+    kind = _TYPES.get((bool(numbers[0]), bool(numbers[1])))
+    if kind is None:
+        raise _Reject("No account given.")
+    given = _text(record.get("type")).title()
+    if given and given not in _DESCRIPTIONS:
+        raise _Reject(f"Unknown type {given}.")
+    if given and given != kind:
+        raise _Reject(f"The accounts given make this a {kind}, not a {given}.")
+    ids = []
+    for number in numbers:
+        if number and number not in accounts:
+            raise _Reject(f"Unknown account {number}.")
+        ids.append(accounts.get(number))
+    if ids[0] is not None and ids[0] == ids[1]:
+        raise _Reject("Cannot transfer to the same account.")
+    cents = _cents(record.get("amount"))
+    description = _text(record.get("description")) or _DESCRIPTIONS[kind]
+    return kind, ids[0], ids[1], cents, description
+
+
+def _load_balances(conn, balances, account_ids):
+    missing = [i for i in account_ids if i not in balances]
+    if missing:
+        balances.update(conn.execute("SELECT account_id, balance FROM accounts WHERE account_id IN (SELECT value FROM json_each(?))",
+                                     (json.dumps(missing),)))
+
+
+def _post_chunk(conn, lines, balances, rejects):
+    """Checks funds line by line against ``balances`` and writes the accepted
+    postings. Returns ``(posted, amount)``; must run inside a write transaction."""
+    _load_balances(conn, balances, {account_id for _, posting in lines if not isinstance(posting, _Reject)
+                                    for account_id in posting[1:3] if account_id is not None})
+    rows, deltas, amount = [], {}, 0
+    for (number, record), posting in lines:
+        if isinstance(posting, _Reject):
+            rejects.append((number, str(posting), record))
+            continue
+        _, from_id, to_id, cents, _ = posting
+        if from_id is not None:
+            if balances[from_id] < cents:
+                rejects.append((number, "Insufficient funds.", record))
+                continue
+            balances[from_id] -= cents
+            deltas[from_id] = deltas.get(from_id, 0) - cents
+        if to_id is not None:
+            balances[to_id] += cents
+            deltas[to_id] = deltas.get(to_id, 0) + cents
+        rows.append((from_id, to_id, posting[0], cents, posting[4]))
+        amount += cents
+    conn.executemany(_INSERT, rows)
+    conn.executemany("UPDATE accounts SET balance = balance + ? WHERE account_id = ?",
+                     [(delta, account_id) for account_id, delta in deltas.items() if delta])
+    return len(rows), amount
+
+
+def _chunks(records, accounts, chunk_size):
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        lines = []
+        for number, record in chunk:
+            try:
+                posting = _parse(record, accounts)
+            except _Reject as e:
+                posting = e
+            lines.append(((number, record), posting))
+        yield lines
+
+
+def _write_rejects(writer, rejects):
+    for number, reason, record in rejects:
+        record = record or {}
+        writer.writerow([number, reason] + [_text(record.get(field)) for field in FIELDS])
+
+
+def ingest(db_name, text, fmt="csv", atomic="chunk", chunk_size=CHUNK_SIZE, rejects=None, user_id="system",
+           source="batch", progress=None):
+    """Posts a batch from the text stream ``text``. Rejected lines are written
+    as CSV to the text stream ``rejects`` if given. Returns counts: ``lines``,
+    ``posted``, ``rejected``, ``amount`` (cents posted), ``committed`` and
+    ``seconds``. With ``atomic="batch"`` nothing is posted if any line is
+    rejected (``committed`` is then False)."""
+    if atomic not in ATOMICITY:
+        raise ValueError(f"Unknown atomicity {atomic!r}; expected one of {ATOMICITY}.")
+    progress = progress or (lambda message: None)
+    started = time.perf_counter()
+    records = read_records(text, fmt)
+    writer = csv.writer(rejects) if rejects is not None else None
+    if writer:
+        writer.writerow(REJECT_FIELDS)
+    counts = {"lines": 0, "posted": 0, "rejected": 0, "amount": 0, "committed": True}
+
+    conn = connect(db_name)
+    try:
+        accounts = dict(conn.execute("SELECT account_number, account_id FROM accounts"))
+        balances = {}
+        if atomic == "batch":
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            for lines in _chunks(records, accounts, chunk_size):
+                if atomic == "chunk":
+                    balances = {}  # other postings may have run since the last chunk
+                    conn.execute("BEGIN IMMEDIATE")
+                chunk_rejects = []
+                posted, amount = _post_chunk(conn, lines, balances, chunk_rejects)
+                if atomic == "chunk":
+                    if posted:
+                        conn.execute(INSERT_AUDIT, (str(user_id), "Bulk Ingest",
+                                                    f"{source}: lines {lines[0][0][0]}-{lines[-1][0][0]}, {posted} posted, {format_money(amount)}"))
+                    conn.execute("COMMIT")
+                counts["lines"] += len(lines)
+                counts["posted"] += posted
+                counts["amount"] += amount
+                counts["rejected"] += len(chunk_rejects)
+                if writer:
+                    _write_rejects(writer, chunk_rejects)
+                progress(f"{counts['lines']:,} lines read, {counts['posted']:,} accepted, {counts['rejected']:,} rejected")
+            if atomic == "batch":
+                if counts["rejected"]:
+                    conn.execute("ROLLBACK")
+                    counts.update(committed=False, posted=0, amount=0)
+                else:
+                    if counts["posted"]:
+                        conn.execute(INSERT_AUDIT, (str(user_id), "Bulk Ingest",
+                                                    f"{source}: {counts['posted']} posted, {format_money(counts['amount'])}"))
+                    conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Post a CSV or JSONL batch of transfers, deposits and withdrawals.")
+    parser.add_argument("db", help="SQLite file to post to")
+    parser.add_argument("batch", help="batch file (.csv or .jsonl)")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file name")
+    parser.add_argument("--atomic", choices=ATOMICITY, default="chunk",
+                        help="commit per chunk (default) or all-or-nothing for the whole batch")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--rejects", help="CSV file for rejected lines (default: <batch>.rejects.csv)")
+    parser.add_argument("--user", default="system", help="user id recorded in the audit log")
+    args = parser.parse_args(argv)
+
+    rejects_path = args.rejects or f"{args.batch}.rejects.csv"
+    with open(args.batch, encoding="utf-8-sig", newline="") as text, open(rejects_path, "w", newline="") as rejects:
+        counts = ingest(args.db, text, fmt=args.format or format_for(args.batch), atomic=args.atomic,
+                        chunk_size=args.chunk_size, rejects=rejects, user_id=args.user, source=args.batch, progress=print)
+    outcome = "posted" if counts["committed"] else "NOT posted (batch has rejects)"
+    print(f"Done in {counts['seconds']}s: {counts['lines']:,} lines, {counts['posted']:,} {outcome} "
+          f"({format_money(counts['amount'])}), {counts['rejected']:,} rejected -> {rejects_path}")
+
+
+if __name__ == "__main__":
+    main()
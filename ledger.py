@@ -0,0 +1,456 @@
+"""Headless ledger engine.
+
+All money movements (transfers, deposits and withdrawals) go through a single
+writer thread that owns its own SQLite connection. Postings are queued and
+applied in group-committed batches: one ``BEGIN IMMEDIATE ... COMMIT`` (and so
+one fsync) covers every posting collected within a short window, instead of
+one commit per statement.
+
+Before a posting reaches the writer it is prepared on a small pool of
+worker threads. The worker takes the locks of the posting's accounts (in
+``account_id`` order, so two postings can never wait on each other). It
+checks the debit against the account's available balance: the committed
+balance, read once and then kept in memory, less the debits of postings
+prepared but not yet committed. The amount is then taken off the available
+balance. Postings over disjoint accounts prepare in parallel, and an
+overdraft is rejected before it reaches the writer. With a velocity screen
+(see velocity.py), the debit is also checked against per-account rate and
+amount limits at this point.
+
+The writer stays the authority. It debits with a conditional
+``UPDATE ... WHERE balance >= ?``, so no posting can overdraw an account,
+even one whose balance was changed outside the engine (end of day, bulk
+ingest). A prepared batch is applied with one ``executemany`` per
+statement. If any debit in it fails, the batch is redone posting by
+posting, each inside its own savepoint. A rejected posting (unknown
+account, insufficient funds) is then rolled back on its own without
+affecting the rest of the batch, and its accounts' figures are read again.
+
+Each posting may carry an audit entry. With a strict ``AuditWriter`` (or
+none at all) the entry is inserted together with the posting, so the audit
+row commits if and only if the posting does. With a relaxed
+writer it is handed to the writer's queue once the batch has committed.
+"""
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from audit import INSERT_AUDIT, AuditEntry
+from database import connect
+from metrics import is_lock_error
+from money import Money
+
+Receipt = namedtuple("Receipt", "transaction_id transaction_type from_account_id to_account_id amount")
+
+_STOP = object()
+
+# The debit is conditional, so no posting can overdraw an account.
+_DEBIT = "UPDATE accounts SET balance = balance - ? WHERE account_id = ? AND balance >= ?"
+_CREDIT = "UPDATE accounts SET balance = balance + ? WHERE account_id = ?"
+_INSERT = "INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description) VALUES (?, ?, ?, ?, ?)"
+
+# Balances read by a preparing worker, for a posting with one or two accounts.
+_BALANCES = {
+    1: "SELECT account_id, balance FROM accounts WHERE account_id = ?",
+    2: "SELECT account_id, balance FROM accounts WHERE account_id IN (?, ?)",
+}
+
+
+class PostingError(Exception):
+    """Raised (through the posting's future) when a posting is rejected."""
+
+
+class AccountLocks:
+    """Per-account locks, striped over a fixed number of mutexes.
+
+    ``hold`` takes the stripes of several accounts in ascending order, so any
+    two holders of overlapping sets acquire them in the same order and
+    cannot deadlock.
+    """
+
+    def __init__(self, stripes=1024):
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+
+    def _ordered(self, account_ids):
+        return [self._stripes[i] for i in sorted({account_id % len(self._stripes) for account_id in account_ids})]
+
+    def acquire(self, account_ids):
+        locks = self._ordered(account_ids)
+        for lock in locks:
+            lock.acquire()
+        return locks
+
+    @staticmethod
+    def release(locks):
+        for lock in reversed(locks):
+            lock.release()
+
+    @contextmanager
+    def hold(self, account_ids):
+        locks = self.acquire(account_ids)
+        try:
+            yield
+        finally:
+            self.release(locks)
+
+    def hold_all(self):
+        """Holds every stripe, i.e. the locks of all accounts."""
+        return self.hold(range(len(self._stripes)))
+
+
+class _Posting:
+    __slots__ = ("kind", "from_account_id", "to_account_id", "amount", "description", "audit", "future")
+
+    def __init__(self, kind, from_account_id, to_account_id, amount, description, audit):
+        self.kind = kind
+        self.from_account_id = from_account_id
+        self.to_account_id = to_account_id
+        self.amount = amount
+        self.description = description
+        self.audit = audit
+        self.future = Future()
+
+
+class LedgerEngine:
+    """Queues postings and commits them in batches from a background thread.
+
+    ``max_batch`` caps the number of postings per commit; ``max_delay`` is how
+    long (in seconds) the writer waits for more postings after the first one
+    arrives before it commits what it has. ``audit`` is the ``AuditWriter``
+    that receives the audit entries attached to postings. ``metrics`` (a
+    ``metrics.Metrics``) records how long each batch waits for the write lock.
+    ``prepare_workers`` is the number of threads preparing postings, and
+    ``max_cached_accounts`` bounds the available balances they keep in memory.
+    ``screen`` (a ``velocity.VelocityScreen``) vets every debit after the
+    funds check; a debit it declines is rejected with a ``PostingError``.
+    """
+
+    def __init__(self, db_name, max_batch=500, max_delay=0.002, timeout=30.0, audit=None, metrics=None, prepare_workers=4,
+                 max_cached_accounts=100000, screen=None):
+        self.db_name = db_name
+        self.audit = audit
+        self.metrics = metrics
+        self.screen = screen
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.batches_committed = 0
+        self.postings_committed = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._locks = AccountLocks()
+        self.max_cached_accounts = max_cached_accounts
+        self._balances = {}  # account_id -> committed balance, as last read or settled
+        self._reserved = {}  # account_id -> debits prepared but not yet settled
+        self._readers = threading.local()
+        self._preparers = ThreadPoolExecutor(max_workers=prepare_workers, thread_name_prefix="ledger-prepare")
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- Public API ---
+    def post_transfer(self, from_account_id, to_account_id, amount, description="", audit=None):
+        """Moves ``amount`` between two accounts. Returns a Future of a Receipt.
+
+        Amounts are ``Money``; plain numbers are taken as dollar amounts.
+
+        ``audit`` is an optional ``(user_id, action, details)`` entry recorded
+        only if the posting succeeds.
+        """
+        if from_account_id == to_account_id:
+            return self._rejected("Cannot transfer to the same account.")
+        return self._submit("Transfer", from_account_id, to_account_id, amount, description, audit)
+
+    def post_deposit(self, to_account_id, amount, description="Cash/Check Deposit", audit=None):
+        """Credits ``amount`` to an account. Returns a Future of a Receipt."""
+        return self._submit("Deposit", None, to_account_id, amount, description, audit)
+
+    def post_withdrawal(self, from_account_id, amount, description="Cash Withdrawal", audit=None):
+        """Debits ``amount`` from an account. Returns a Future of a Receipt."""
+        return self._submit("Withdrawal", from_account_id, None, amount, description, audit)
+
+    def close(self):
+        """Commits everything already queued and stops the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._preparers.shutdown(wait=True)
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    # --- Internals ---
+    def _rejected(self, message):
+        future = Future()
+        future.set_exception(PostingError(message))
+        return future
+
+    def _submit(self, kind, from_account_id, to_account_id, amount, description, audit):
+        amount = Money.of(amount) if amount is not None else None
+        if amount is None or amount.cents <= 0:
+            return self._rejected("Amount must be positive.")
+        if audit is not None:
+            user_id, action, details = audit
+            audit = AuditEntry(str(user_id), action, details)
+        posting = _Posting(kind, from_account_id, to_account_id, amount, description, audit)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Ledger engine is closed.")
+            self._preparers.submit(self._prepare, posting)
+        return posting.future
+
+    def _reader(self):
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = connect(self.db_name, timeout=self.timeout, check_same_thread=False)
+        return conn
+
+    def _prepare(self, posting):
+        """Runs on a preparing worker: checks the posting against the available
+        balances under its account locks, reserves the debit and queues the
+        posting for the writer."""
+        accounts = [a for a in (posting.from_account_id, posting.to_account_id) if a is not None]
+        error = screened = None
+        try:
+            with self._locks.hold(accounts):
+                balances = self._balances
+                if any(a not in balances for a in accounts):
+                    self._load(accounts)
+                if posting.to_account_id is not None and posting.to_account_id not in balances:
+                    raise PostingError("Recipient account does not exist.")
+                if posting.from_account_id is not None:
+                    if posting.from_account_id not in balances:
+                        raise PostingError("Source account does not exist.")
+                    if self._available(posting.from_account_id) < posting.amount.cents:
+                        # The figure may predate a credit made outside the engine.
+                        self._load(accounts)
+                        if self._available(posting.from_account_id) < posting.amount.cents:
+                            raise PostingError("Insufficient funds.")
+                    if self.screen is not None:
+                        screened = self.screen.evaluate(posting.from_account_id, posting.amount.cents)
+                        if screened[0] is not None:
+                            raise PostingError(f"Declined by fraud screening: {screened[0].name.lower()}.")
+                    self._reserved[posting.from_account_id] = (
+                        self._reserved.get(posting.from_account_id, 0) + posting.amount.cents)
+        except Exception as e:
+            error = e
+        if screened is not None and screened[1]:
+            # Recorded after the account locks are released: a strict audit
+            # writer commits every hit.
+            try:
+                self.screen.record(posting.from_account_id, posting.amount.cents, *screened,
+                                   user_id=posting.audit.user_id if posting.audit else "system")
+            except Exception as e:
+                if error is None:
+                    error = e
+                    with self._locks.hold(accounts):
+                        self._settle([(posting, None, e)])
+        if error is not None:
+            posting.future.set_exception(error)
+            return
+        self._queue.put(posting)
+
+    def _available(self, account_id):
+        """The committed balance less the debits still on their way to the writer."""
+        return self._balances[account_id] - self._reserved.get(account_id, 0)
+
+    def _load(self, accounts):
+        """Reads committed balances into ``_balances``; the caller holds the
+        account locks. Reservations are kept apart, so a reload keeps them."""
+        self._balances.update(self._reader().execute(_BALANCES[len(accounts)], accounts).fetchall())
+
+    def _settle(self, outcomes):
+        """Brings the cached figures up to date with a finished batch; the
+        caller holds the locks of every account in it. Each posting's
+        reservation is released. A committed posting moves the balances; a
+        failed one means the figures were wrong, so they are dropped and read
+        again on next use."""
+        balances, reserved = self._balances, self._reserved
+        for posting, _, error in outcomes:
+            cents = posting.amount.cents
+            if posting.from_account_id is not None:
+                left = reserved.get(posting.from_account_id, 0) - cents
+                if left > 0:
+                    reserved[posting.from_account_id] = left
+                else:
+                    reserved.pop(posting.from_account_id, None)
+            if error is None:
+                if posting.from_account_id in balances:
+                    balances[posting.from_account_id] -= cents
+                if posting.to_account_id in balances:
+                    balances[posting.to_account_id] += cents
+            else:
+                balances.pop(posting.from_account_id, None)
+                balances.pop(posting.to_account_id, None)
+
+    def _settle_and_release(self, outcomes, touched, locks):
+        """Settles a batch and releases its account locks. Returns the
+        exception raised while settling, if any; the batch's figures are then
+        dropped, and the writer's conditional debit keeps the balances safe
+        until they are read again."""
+        try:
+            self._settle(outcomes)
+        except Exception as e:
+            for account_id in touched:
+                self._balances.pop(account_id, None)
+                self._reserved.pop(account_id, None)
+            return e
+        finally:
+            self._locks.release(locks)
+        return None
+
+    def _evict(self):
+        """Empties the balance cache once it outgrows ``max_cached_accounts``.
+        Runs on the writer holding every account lock, so no preparing worker
+        is between reading a figure and using it."""
+        if len(self._balances) > self.max_cached_accounts:
+            with self._locks.hold_all():
+                self._balances.clear()
+
+    def _connect(self):
+        # Autocommit connection: transactions are managed explicitly below.
+        return connect(self.db_name, timeout=self.timeout)
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _next_batch(self):
+        """Blocks for one posting, then gathers more until the window closes."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit_batch(self, conn, batch):
+        # The available balances are settled in the same critical section as
+        # the COMMIT, so a preparing worker never sees a balance that is
+        # half-way between the two.
+        touched = [a for posting in batch for a in (posting.from_account_id, posting.to_account_id) if a is not None]
+        locks = []
+        outcomes = []
+        try:
+            self._begin(conn)
+            outcomes = self._apply_batch(conn, batch)
+            if outcomes is None:
+                outcomes = []
+                for posting in batch:
+                    conn.execute("SAVEPOINT posting")
+                    try:
+                        receipt = self._apply(conn, posting)
+                    except (PostingError, sqlite3.IntegrityError) as e:
+                        conn.execute("ROLLBACK TO posting")
+                        conn.execute("RELEASE posting")
+                        outcomes.append((posting, None, e))
+                    else:
+                        conn.execute("RELEASE posting")
+                        outcomes.append((posting, receipt, None))
+            locks = self._locks.acquire(touched)
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if not locks:
+                locks = self._locks.acquire(touched)
+            self._settle_and_release([(posting, None, e) for posting in batch], touched, locks)
+            for posting in batch:
+                posting.future.set_exception(e)
+            return
+        error = self._settle_and_release(outcomes, touched, locks)
+        self._evict()
+        if error is not None:
+            for posting in batch:
+                posting.future.set_exception(error)
+            return
+
+        self.batches_committed += 1
+        for posting, receipt, error in outcomes:
+            if error is None:
+                self.postings_committed += 1
+                posting.future.set_result(receipt)
+            else:
+                posting.future.set_exception(error)
+        if not self._audit_in_transaction():
+            for posting, _, error in outcomes:
+                if error is None and posting.audit is not None:
+                    self.audit.log(*posting.audit)
+
+    def _begin(self, conn):
+        if self.metrics is None:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if is_lock_error(e):
+                self.metrics.record_lock_error()
+            raise
+        finally:
+            self.metrics.record_lock_wait(time.perf_counter() - started)
+
+    def _audit_in_transaction(self):
+        return self.audit is None or self.audit.strict
+
+    def _apply_batch(self, conn, batch):
+        """Applies a whole batch with one ``executemany`` per statement. The
+        postings were validated and reserved when prepared, so normally every
+        debit succeeds. If any does not (a balance changed outside the
+        engine), the batch is undone and None is returned so the caller can
+        apply the postings one at a time."""
+        debits = [(p.amount, p.from_account_id, p.amount) for p in batch if p.from_account_id is not None]
+        credits = [(p.amount, p.to_account_id) for p in batch if p.to_account_id is not None]
+        conn.execute("SAVEPOINT batch")
+        if (conn.executemany(_DEBIT, debits).rowcount != len(debits)
+                or conn.executemany(_CREDIT, credits).rowcount != len(credits)):
+            conn.execute("ROLLBACK TO batch")
+            conn.execute("RELEASE batch")
+            return None
+        conn.executemany(_INSERT, [(p.from_account_id, p.to_account_id, p.kind, p.amount, p.description) for p in batch])
+        # Ids are consecutive: this connection is the only writer until COMMIT.
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        if self._audit_in_transaction():
+            conn.executemany(INSERT_AUDIT, [p.audit for p in batch if p.audit is not None])
+        conn.execute("RELEASE batch")
+        first_id = last_id - len(batch) + 1
+        return [(p, Receipt(first_id + i, p.kind, p.from_account_id, p.to_account_id, p.amount), None)
+                for i, p in enumerate(batch)]
+
+    def _apply(self, conn, posting):
+        if posting.from_account_id is not None:
+            cur = conn.execute(_DEBIT, (posting.amount, posting.from_account_id, posting.amount))
+            if cur.rowcount == 0:
+                exists = conn.execute("SELECT 1 FROM accounts WHERE account_id = ?", (posting.from_account_id,)).fetchone()
+                raise PostingError("Insufficient funds." if exists else "Source account does not exist.")
+        if posting.to_account_id is not None:
+            cur = conn.execute(_CREDIT, (posting.amount, posting.to_account_id))
+            if cur.rowcount == 0:
+                raise PostingError("Recipient account does not exist.")
+        cur = conn.execute(_INSERT, (posting.from_account_id, posting.to_account_id, posting.kind, posting.amount, posting.description))
+        if posting.audit is not None and self._audit_in_transaction():
+            conn.execute(INSERT_AUDIT, posting.audit)
+        return Receipt(cur.lastrowid, posting.kind, posting.from_account_id, posting.to_account_id, posting.amount)
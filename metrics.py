@@ -0,0 +1,226 @@
+"""In-process performance metrics.
+
+``Metrics`` aggregates timings in memory into fixed-bucket histograms:
+
+* statements run through ``Database``, keyed by normalized SQL (literals
+  replaced by ``?``, ``IN`` lists collapsed), with row counts and errors;
+* page renders, keyed by page name (``app.main`` times each rerun);
+* lock waits: the time ``BEGIN IMMEDIATE`` spends waiting for the write
+  lock, plus a count of "database is locked" errors.
+
+Statements slower than ``slow_threshold`` seconds also go to a bounded
+slow-query log together with their ``EXPLAIN QUERY PLAN``. ``snapshot()``
+returns everything as plain data (for JSON); ``prometheus()`` renders the
+histograms in the Prometheus text exposition format.
+
+Recording is a cached normalization, a dict lookup and a few additions
+under a lock, so the instrumentation is cheap enough to leave on.
+"""
+import bisect
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Reduces a statement to its shape, so statements differing only in
+    literal values or ``IN`` list length are counted together. The app runs
+    the same few hundred statement strings over and over, so results are cached."""
+    sql = _STRINGS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    sql = _IN_LISTS.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def is_lock_error(error):
+    return "locked" in str(error) or "busy" in str(error)
+
+
+class Histogram:
+    """Counts observations into ``BUCKETS`` and tracks their count, sum and maximum."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Estimates the ``q`` quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "buckets": dict(zip([*BUCKETS, "+Inf"], self.counts)),
+        }
+
+
+class _QueryStats:
+    __slots__ = ("histogram", "rows", "errors")
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+
+class Metrics:
+    """Thread-safe registry of query, page and lock-wait measurements."""
+
+    def __init__(self, slow_threshold=0.1, slow_log_size=200, max_statements=500):
+        self.slow_threshold = slow_threshold
+        self.max_statements = max_statements
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._queries = {}
+        self._pages = {}
+        self._lock_waits = Histogram()
+        self._lock_errors = 0
+        self._slow = deque(maxlen=slow_log_size)
+
+    # --- Recording ---
+    def record_query(self, sql, seconds, rows=0, error=None, conn=None, params=()):
+        """Records one statement. When it was slow and ``conn`` is given, its
+        query plan is captured on that connection for the slow-query log."""
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._queries.get(key)
+            if stats is None:
+                if len(self._queries) >= self.max_statements:
+                    key = "(other statements)"
+                    stats = self._queries.get(key)
+                if stats is None:
+                    stats = self._queries[key] = _QueryStats()
+            stats.histogram.observe(seconds)
+            stats.rows += rows or 0
+            if error is not None:
+                stats.errors += 1
+                if is_lock_error(error):
+                    self._lock_errors += 1
+        if seconds >= self.slow_threshold:
+            plan = self._explain(conn, sql, params) if conn is not None else []
+            with self._lock:
+                self._slow.append({"at": time.strftime("%Y-%m-%d %H:%M:%S"), "ms": round(seconds * 1000, 3),
+                                   "rows": rows, "sql": key, "plan": plan})
+
+    @staticmethod
+    def _explain(conn, sql, params):
+        try:
+            return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        except Exception as e:  # the plan is best effort; never fail the caller over it
+            return [f"(no plan: {e})"]
+
+    def record_page(self, page, seconds):
+        with self._lock:
+            histogram = self._pages.get(page)
+            if histogram is None:
+                histogram = self._pages[page] = Histogram()
+            histogram.observe(seconds)
+
+    def record_lock_wait(self, seconds):
+        with self._lock:
+            self._lock_waits.observe(seconds)
+
+    def record_lock_error(self):
+        with self._lock:
+            self._lock_errors += 1
+
+    @contextmanager
+    def page_timer(self, page):
+        """Times the block as one render of ``page``, however it exits (``st.rerun`` raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_page(page, time.perf_counter() - started)
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._pages.clear()
+            self._lock_waits = Histogram()
+            self._lock_errors = 0
+            self._slow.clear()
+            self.started_at = time.time()
+
+    # --- Reporting ---
+    def snapshot(self):
+        """Returns every measurement as plain data, busiest statements first."""
+        with self._lock:
+            queries = [{"sql": sql, "rows": stats.rows, "errors": stats.errors, **stats.histogram.summary()}
+                       for sql, stats in self._queries.items()]
+            pages = [{"page": page, **histogram.summary()} for page, histogram in self._pages.items()]
+            return {
+                "since": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+                "slow_threshold_ms": round(self.slow_threshold * 1000, 3),
+                "queries": sorted(queries, key=lambda q: -q["total_ms"]),
+                "pages": sorted(pages, key=lambda p: -p["total_ms"]),
+                "lock_waits": {**self._lock_waits.summary(), "lock_errors": self._lock_errors},
+                "slow_queries": list(reversed(self._slow)),
+            }
+
+    def prometheus(self):
+        """Renders the histograms in the Prometheus text exposition format."""
+        lines = []
+
+        def histogram(name, help_text, series):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} histogram"])
+            for labels, h in series:
+                cumulative = 0
+                for bound, count in zip([*BUCKETS, "+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {h.total:.6f}")
+                lines.append(f"{name}_count{suffix} {h.count}")
+
+        def label(value):
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+        with self._lock:
+            histogram("bank_query_duration_seconds", "Statement execution time by normalized SQL.",
+                      [(f'sql="{label(sql)}"', stats.histogram) for sql, stats in self._queries.items()])
+            lines.extend(["# HELP bank_query_rows_total Rows returned or changed by normalized SQL.", "# TYPE bank_query_rows_total counter"])
+            lines.extend(f'bank_query_rows_total{{sql="{label(sql)}"}} {stats.rows}' for sql, stats in self._queries.items())
+            lines.extend(["# HELP bank_query_errors_total Failed statements by normalized SQL.", "# TYPE bank_query_errors_total counter"])
+            lines.extend(f'bank_query_errors_total{{sql="{label(sql)}"}} {stats.errors}' for sql, stats in self._queries.items())
+            histogram("bank_page_render_seconds", "Streamlit page render time.",
+                      [(f'page="{label(page)}"', h) for page, h in self._pages.items()])
+            histogram("bank_lock_wait_seconds", "Time spent waiting for the write lock.", [("", self._lock_waits)])
+            lines.extend(["# HELP bank_lock_errors_total Statements that failed with database is locked.",
+                          "# TYPE bank_lock_errors_total counter", f"bank_lock_errors_total {self._lock_errors}"])
+        return "\n".join(lines) + "\n"
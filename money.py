@@ -0,0 +1,118 @@
+"""Fixed-point money.
+
+Balances and amounts are stored as 64-bit integers in minor units (cents):
+``accounts.balance``, ``transactions.amount``, ``loans.loan_amount`` and
+the money rows of ``bank_summary``. Arithmetic on them is exact, so
+conservation checks compare with ``==`` and aggregates can run as plain
+``int64`` sums in SQL or NumPy.
+
+``Money`` wraps a cent count for use in Python code. It binds directly as
+a SQLite parameter (as its cent count). Conversion to and from dollar
+amounts happens only at the edges: ``Money.of()`` for user input and
+``format_money()`` for display.
+"""
+import sqlite3
+from decimal import ROUND_HALF_UP, Decimal
+from functools import total_ordering
+
+CENTS = 100
+
+
+@total_ordering
+class Money:
+    """An exact amount of money, held as an integer number of cents."""
+
+    __slots__ = ("cents",)
+
+    def __init__(self, cents=0):
+        if isinstance(cents, Money):
+            cents = cents.cents
+        if not isinstance(cents, int):
+            raise TypeError(f"Money() takes integer cents, got {type(cents).__name__}; use Money.of() for amounts.")
+        self.cents = cents
+
+    @classmethod
+    def of(cls, amount):
+        """Converts a dollar amount (str, int, float or Decimal) to Money, rounding half-up to the cent."""
+        if isinstance(amount, Money):
+            return amount
+        value = Decimal(str(amount)) if isinstance(amount, float) else Decimal(amount)
+        return cls(int((value * CENTS).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+    def to_decimal(self):
+        return Decimal(self.cents) / CENTS
+
+    def __add__(self, other):
+        return Money(self.cents + Money(other).cents)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.cents - Money(other).cents)
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+    def __mul__(self, factor):
+        if not isinstance(factor, int):
+            raise TypeError("Money can only be multiplied by an integer.")
+        return Money(self.cents * factor)
+
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.cents == other.cents
+        if isinstance(other, int) and other == 0:
+            return self.cents == 0
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, Money):
+            return self.cents < other.cents
+        if isinstance(other, int) and other == 0:
+            return self.cents < 0
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.cents)
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __repr__(self):
+        return f"Money({self.cents})"
+
+    def __str__(self):
+        return format_money(self.cents)
+
+
+def to_cents(amount):
+    """Returns the cent count of a Money or dollar amount."""
+    return Money.of(amount).cents
+
+
+def format_money(cents):
+    """Formats a cent count (or Money) for display, e.g. ``-$1,234.50``."""
+    if isinstance(cents, Money):
+        cents = cents.cents
+    cents = int(cents or 0)
+    sign = "-" if cents < 0 else ""
+    dollars, remainder = divmod(abs(cents), CENTS)
+    return f"{sign}${dollars:,}.{remainder:02d}"
+
+
+def format_decimal(cents):
+    """Formats a cent count as a plain decimal string for files, e.g. ``-1234.50``."""
+    sign = "-" if cents < 0 else ""
+    dollars, remainder = divmod(abs(int(cents)), CENTS)
+    return f"{sign}{dollars}.{remainder:02d}"
+
+
+def to_dollars(cents):
+    """Converts cents (a number, NumPy array or pandas Series) to dollars, for charts and tables only."""
+    return (0 if cents is None else cents) / CENTS
+
+
+sqlite3.register_adapter(Money, lambda money: money.cents)
@@ -0,0 +1,170 @@
+"""Ledger reconciliation: stored balances against the transactions.
+
+Every account's ``balance`` must equal the net of the transactions that
+touch it: the credits (``to_account_id``), which include its "Opening
+Balance" deposit, less the debits (``from_account_id``). Bank-wide, money is
+only created or destroyed by external deposits and withdrawals, so the sum
+of all balances must equal external inflows less outflows; a transfer whose
+other side is missing shows up there.
+
+    python reconcile.py banking_v2.db
+    python reconcile.py banking_v2.db --workers 8 --out mismatches.csv
+
+``account_id`` is split into ranges that are reconciled in parallel worker
+processes, each with its own read-only connection and read snapshot. Per
+range, credits and debits are aggregated with two range scans over the
+``idx_transactions_to`` / ``idx_transactions_from`` indexes, joined to the
+accounts, and only mismatching accounts are sent back. Per-account results
+are exact even while postings continue; the bank-wide totals combine
+snapshots taken at slightly different times, so run the check at a quiet
+time (e.g. after the end-of-day batch) when the conservation line matters.
+
+Transactions moved out by archive.py are represented by their per-account
+totals in ``account_carry``, which are added to the hot figures, so the
+archive files are never read. Accounts opened before every opening had a
+transaction row (the first seeder, and approvals' $10 deposit) have their
+opening balance there too (``schema.carry_legacy_openings``).
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from database import connect
+
+Mismatch = namedtuple("Mismatch", "account_id account_number stored opening credits debits expected difference")
+
+TOTALS = ("accounts", "balances", "credits", "debits", "external_in", "external_out")
+
+_RANGE = """
+    SELECT a.account_id, a.account_number, a.balance,
+           COALESCE(c.opening, 0) + COALESCE(f.opening, 0), COALESCE(c.total, 0) + COALESCE(f.credits, 0),
+           COALESCE(c.external, 0) + COALESCE(f.external_in, 0),
+           COALESCE(d.total, 0) + COALESCE(f.debits, 0), COALESCE(d.external, 0) + COALESCE(f.external_out, 0)
+    FROM accounts a
+    LEFT JOIN (
+        SELECT to_account_id AS account_id, SUM(amount) AS total,
+               SUM(CASE WHEN from_account_id IS NULL THEN amount ELSE 0 END) AS external,
+               SUM(CASE WHEN from_account_id IS NULL AND description = 'Opening Balance' THEN amount ELSE 0 END) AS opening
+        FROM transactions WHERE to_account_id BETWEEN ? AND ? GROUP BY to_account_id
+    ) c ON c.account_id = a.account_id
+    LEFT JOIN (
+        SELECT from_account_id AS account_id, SUM(amount) AS total,
+               SUM(CASE WHEN to_account_id IS NULL THEN amount ELSE 0 END) AS external
+        FROM transactions WHERE from_account_id BETWEEN ? AND ? GROUP BY from_account_id
+    ) d ON d.account_id = a.account_id
+    LEFT JOIN account_carry f ON f.account_id = a.account_id
+    WHERE a.account_id BETWEEN ? AND ?"""
+
+
+def shard_ranges(first, last, shards):
+    """Splits ``first..last`` into at most ``shards`` contiguous inclusive ranges."""
+    size = max(1, -(-(last - first + 1) // shards))
+    return [(lo, min(lo + size - 1, last)) for lo in range(first, last + 1, size)]
+
+
+def reconcile_range(db_name, first, last):
+    """Reconciles the accounts with ids in ``first..last`` from one read
+    snapshot. Returns ``(mismatches, totals)``; ``totals`` is keyed by ``TOTALS``."""
+    conn = connect(db_name, read_only=True)
+    try:
+        conn.execute("BEGIN")
+        mismatches = []
+        totals = dict.fromkeys(TOTALS, 0)
+        for account_id, number, stored, opening, credits, external_in, debits, external_out in conn.execute(
+                _RANGE, (first, last) * 3):
+            totals["accounts"] += 1
+            totals["balances"] += stored
+            totals["credits"] += credits
+            totals["debits"] += debits
+            totals["external_in"] += external_in
+            totals["external_out"] += external_out
+            expected = credits - debits
+            if stored != expected:
+                mismatches.append(Mismatch(account_id, number, stored, opening, credits, debits, expected, stored - expected))
+        conn.execute("COMMIT")
+        return mismatches, totals
+    finally:
+        conn.close()
+
+
+def _reconcile_shard(args):
+    return reconcile_range(*args)
+
+
+def reconcile(db_name, workers=None, shards=None, progress=None):
+    """Reconciles every account, ``workers`` processes at a time (default: one
+    per CPU). Returns ``(mismatches, totals)`` with ``totals`` summed over all
+    ranges plus ``seconds``."""
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    conn = connect(db_name, read_only=True)
+    first, last = conn.execute("SELECT MIN(account_id), MAX(account_id) FROM accounts").fetchone()
+    conn.close()
+    mismatches, totals = [], dict.fromkeys(TOTALS, 0)
+    if first is not None:
+        # Several ranges per worker, so one dense range does not hold up the rest.
+        tasks = [(db_name, lo, hi) for lo, hi in shard_ranges(first, last, shards or workers * 4)]
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            results = pool.map(_reconcile_shard, tasks) if pool else map(_reconcile_shard, tasks)
+            for done, (shard_mismatches, shard_totals) in enumerate(results, 1):
+                mismatches.extend(shard_mismatches)
+                for key in TOTALS:
+                    totals[key] += shard_totals[key]
+                if progress:
+                    progress(f"{done}/{len(tasks)} account ranges reconciled")
+        finally:
+            if pool:
+                pool.shutdown()
+    totals["seconds"] = round(time.perf_counter() - started, 2)
+    return mismatches, totals
+
+
+def conservation_gap(totals):
+    """Sum of balances less net external flows; zero when no money was created or destroyed."""
+    return totals["balances"] - (totals["external_in"] - totals["external_out"])
+
+
+def write_report(path, mismatches):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(Mismatch._fields)
+        writer.writerows(mismatches)
+
+
+def main(argv=None):
+    from money import format_money
+
+    parser = argparse.ArgumentParser(description="Reconcile account balances against the transaction ledger.")
+    parser.add_argument("db", help="SQLite file to check")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--shards", type=int, default=None, help="account_id ranges (default: four per worker)")
+    parser.add_argument("--out", help="write every mismatching account to this CSV file")
+    parser.add_argument("--show", type=int, default=20, help="mismatches to print (default 20)")
+    args = parser.parse_args(argv)
+
+    mismatches, totals = reconcile(args.db, workers=args.workers, shards=args.shards)
+    mismatches.sort(key=lambda m: (-abs(m.difference), m.account_id))
+    for m in mismatches[:args.show]:
+        print(f"MISMATCH {m.account_number} (id {m.account_id}): stored={format_money(m.stored)} "
+              f"expected={format_money(m.expected)} diff={format_money(m.difference)}")
+    if len(mismatches) > args.show:
+        print(f"... and {len(mismatches) - args.show:,} more")
+    if args.out:
+        write_report(args.out, mismatches)
+        print(f"Mismatch report written to {args.out}.")
+
+    gap = conservation_gap(totals)
+    print(f"Reconciled {totals['accounts']:,} accounts in {totals['seconds']}s: {len(mismatches):,} mismatched.")
+    print(f"Balances {format_money(totals['balances'])} = external in {format_money(totals['external_in'])} "
+          f"- external out {format_money(totals['external_out'])} {'OK' if gap == 0 else f'GAP {format_money(gap)}'}")
+    if mismatches or gap:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
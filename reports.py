@@ -0,0 +1,138 @@
+"""Bank-wide figures behind the staff dashboard and financial reports.
+
+The dashboard and balance sheet read the incrementally maintained
+``bank_summary`` rollup (see ``summary.py``) rather than scanning the base
+tables. A balance sheet as of a past date sums the balance checkpoints
+(see ``checkpoints.py``); the income statement reads the daily totals written by the
+end-of-day batch (``eod.py``), the cash-flow figures read the daily
+rollup (``cashflow.py``) and the loan figures read the amortization
+schedules (``amortization.py``) through their due-date index. Money figures are
+integer cents; format them with ``money.format_money``.
+"""
+from datetime import timedelta
+
+from checkpoints import as_of as balances_as_of
+from summary import read_summary, total
+
+
+def dashboard_metrics(db):
+    """Returns the headline counts and totals shown on the staff dashboard."""
+    summary = read_summary(db)
+    return {
+        "active_customers": int(total(summary, "customers", "Active")),
+        "pending_customers": int(total(summary, "customers", "Pending")),
+        "total_deposits": total(summary, "deposits"),
+        "pending_loans": int(total(summary, "loans", "Pending")),
+    }
+
+
+def balance_sheet(db, as_of=None):
+    """Returns the inputs of the (simplified) balance sheet, at the end of
+    the ``as_of`` date if one is given. Loans receivable as of a date are
+    the loans approved by then less the principal collected by then."""
+    if as_of is not None:
+        types = dict(db.fetch_all("SELECT account_id, account_type FROM accounts"))
+        deposits = {}
+        for account_id, balance in balances_as_of(db, as_of).items():
+            deposits[types[account_id]] = deposits.get(types[account_id], 0) + balance
+        approved = db.fetch_one("""
+            SELECT COALESCE(SUM(loan_amount), 0) FROM loans
+            WHERE status = 'Approved' AND COALESCE(approval_date, application_date) < ?""",
+                                (f"{as_of + timedelta(days=1)} 00:00:00",))[0]
+        repaid = db.fetch_one("""SELECT COALESCE(SUM(amount), 0) FROM income_daily
+            WHERE item = 'loan_principal_collected' AND business_date <= ?""", (as_of.isoformat(),))[0]
+        return {"total_cash": sum(deposits.values()), "deposits_by_type": dict(sorted(deposits.items())),
+                "outstanding_loans": approved - repaid}
+    summary = read_summary(db)
+    return {
+        "total_cash": total(summary, "deposits"),
+        "deposits_by_type": {dimension: value for (metric, dimension), value in summary.items() if metric == "deposits"},
+        "outstanding_loans": total(summary, "loan_principal", "Approved") - total(summary, "loan_repaid"),
+    }
+
+
+def income_statement(db, date_from=None, date_to=None):
+    """Returns interest income and expense for the business dates in the range.
+
+    Income and expense are on an accrual basis (interest earned or owed each
+    day); the cash-basis figures (interest actually collected or credited)
+    are included alongside.
+    """
+    rows = db.fetch_all(
+        "SELECT item, SUM(amount), COUNT(DISTINCT business_date) FROM income_daily "
+        "WHERE business_date BETWEEN ? AND ? GROUP BY item",
+        (str(date_from or "0000-01-01"), str(date_to or "9999-12-31")))
+    items = {item: amount for item, amount, _ in rows}
+    income = items.get("loan_interest_accrued", 0)
+    expense = items.get("deposit_interest_accrued", 0)
+    return {
+        "loan_interest_income": income,
+        "deposit_interest_expense": expense,
+        "net_interest_income": income - expense,
+        "loan_interest_collected": items.get("loan_interest_collected", 0),
+        "deposit_interest_paid": items.get("deposit_interest_paid", 0),
+        "loan_principal_collected": items.get("loan_principal_collected", 0),
+        "installments_collected": items.get("installments_collected", 0),
+        "installments_missed": items.get("installments_missed", 0),
+        "business_days": max((days for _, _, days in rows), default=0),
+    }
+
+
+def loan_dues(db, date_from, date_to):
+    """Returns the scheduled installments still unpaid that fall due in the
+    range: totals of payment, principal and interest, and the number due."""
+    row = db.fetch_one("""
+        SELECT COUNT(*), COALESCE(SUM(s.payment), 0), COALESCE(SUM(s.principal), 0), COALESCE(SUM(s.interest), 0)
+        FROM loan_schedule s JOIN loan_positions p ON p.loan_id = s.loan_id
+        WHERE s.due_date BETWEEN ? AND ? AND s.installment_no > p.paid_installments""", (str(date_from), str(date_to)))
+    return {"installments": row[0], "payment": row[1], "principal": row[2], "interest": row[3]}
+
+
+def upcoming_dues(db, date_from, date_to, limit=500):
+    """Returns unpaid installments due in the range, earliest first, as
+    ``(due_date, loan_id, customer, installment_no, payment, overdue_count)``."""
+    return db.fetch_all("""
+        SELECT s.due_date, s.loan_id, c.first_name || ' ' || c.last_name, s.installment_no, s.payment,
+               s.installment_no - p.paid_installments - 1
+        FROM loan_schedule s
+        JOIN loan_positions p ON p.loan_id = s.loan_id
+        JOIN loans l ON l.loan_id = s.loan_id
+        JOIN customers c ON c.customer_id = l.customer_id
+        WHERE s.due_date BETWEEN ? AND ? AND s.installment_no > p.paid_installments
+        ORDER BY s.due_date, s.loan_id LIMIT ?""", (str(date_from), str(date_to), limit))
+
+
+def cash_flow(db, date_from=None, date_to=None):
+    """Returns ``{transaction_type: {count, amount, inflow, outflow}}`` for the
+    days in the range, from the daily rollup. Bring the rollup up to date
+    first with ``cashflow.refresh``."""
+    rows = db.fetch_all("""
+        SELECT transaction_type, SUM(count), SUM(amount), SUM(inflow), SUM(outflow) FROM cashflow_daily
+        WHERE day BETWEEN ? AND ? GROUP BY transaction_type ORDER BY transaction_type""",
+        (str(date_from or "0000-01-01"), str(date_to or "9999-12-31")))
+    return {kind: {"count": count, "amount": amount, "inflow": inflow, "outflow": outflow}
+            for kind, count, amount, inflow, outflow in rows}
+
+
+def balance_trend(db, date_to=None):
+    """Returns month-end deposit and loan balances up to ``date_to`` as
+    ``(month, deposits, loans_disbursed, principal_repaid)`` rows, oldest
+    first. Deposits are the running net of inflows and outflows; loans
+    receivable is ``loans_disbursed - principal_repaid``."""
+    date_to = str(date_to or "9999-12-31")
+    flows = db.fetch_all("""
+        SELECT substr(day, 1, 7) AS month,
+               SUM(SUM(inflow - outflow)) OVER (ORDER BY substr(day, 1, 7)),
+               SUM(SUM(CASE WHEN transaction_type = 'Loan Disbursement' THEN amount ELSE 0 END)) OVER (ORDER BY substr(day, 1, 7))
+        FROM cashflow_daily WHERE day <= ? GROUP BY month ORDER BY month""", (date_to,))
+    repaid = db.fetch_all("""
+        SELECT substr(business_date, 1, 7) AS month, SUM(SUM(amount)) OVER (ORDER BY substr(business_date, 1, 7))
+        FROM income_daily WHERE item = 'loan_principal_collected' AND business_date <= ? GROUP BY month ORDER BY month""",
+        (date_to,))
+    trend, i, repaid_to_date = [], 0, 0
+    for month, deposits, disbursed in flows:
+        while i < len(repaid) and repaid[i][0] <= month:
+            repaid_to_date = repaid[i][1]
+            i += 1
+        trend.append((month, deposits, disbursed, repaid_to_date))
+    return trend
@@ -0,0 +1,299 @@
+"""Table and index definitions shared by the app and the command-line tools."""
+import re
+
+from amortization import SCHEDULE_INDEXES
+from approvals import APPROVAL_INDEXES
+from audit_search import AUDIT_INDEXES, create_audit_search
+from checkpoints import create_checkpoints
+from history import HISTORY_INDEXES
+from summary import create_summary
+
+# Money columns (balance, amount, loan_amount) hold integer cents; see money.py.
+TABLES = {
+    # Customer Table: Added 'status' for approval workflow
+    "customers": """
+    CREATE TABLE IF NOT EXISTS customers (
+        customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'Pending', -- Pending, Active, Rejected
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );""",
+    "accounts": """
+    CREATE TABLE IF NOT EXISTS accounts (
+        account_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        account_number TEXT UNIQUE NOT NULL,
+        account_type TEXT NOT NULL,
+        balance INTEGER NOT NULL DEFAULT 0,
+        is_active BOOLEAN DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
+    );""",
+    "transactions": """
+    CREATE TABLE IF NOT EXISTS transactions (
+        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_account_id INTEGER,
+        to_account_id INTEGER,
+        transaction_type TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        description TEXT,
+        transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (from_account_id) REFERENCES accounts(account_id),
+        FOREIGN KEY (to_account_id) REFERENCES accounts(account_id)
+    );""",
+    "loans": """
+    CREATE TABLE IF NOT EXISTS loans (
+        loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        loan_amount INTEGER NOT NULL,
+        interest_rate REAL NOT NULL,
+        term_months INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'Pending',
+        application_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        approval_date TIMESTAMP,
+        FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
+    );""",
+    "bank_staff": """
+    CREATE TABLE IF NOT EXISTS bank_staff (
+        staff_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL
+    );""",
+    "audit_log": """
+    CREATE TABLE IF NOT EXISTS audit_log (
+        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        action TEXT NOT NULL,
+        details TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );""",
+    # End-of-day batch state (see eod.py). Accrued interest is whole cents;
+    # `carry` holds the sub-cent remainder brought forward to the next day.
+    "interest_accruals": """
+    CREATE TABLE IF NOT EXISTS interest_accruals (
+        account_id INTEGER PRIMARY KEY,
+        accrued INTEGER NOT NULL DEFAULT 0,
+        carry REAL NOT NULL DEFAULT 0,
+        FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+    );""",
+    "loan_positions": """
+    CREATE TABLE IF NOT EXISTS loan_positions (
+        loan_id INTEGER PRIMARY KEY,
+        account_id INTEGER NOT NULL, -- borrower account debited for installments
+        principal INTEGER NOT NULL, -- outstanding
+        installment INTEGER NOT NULL, -- next scheduled payment
+        accrued INTEGER NOT NULL DEFAULT 0,
+        carry REAL NOT NULL DEFAULT 0,
+        paid_installments INTEGER NOT NULL DEFAULT 0,
+        missed_installments INTEGER NOT NULL DEFAULT 0, -- failed collection attempts (retried daily)
+        next_due TEXT NOT NULL,
+        FOREIGN KEY (loan_id) REFERENCES loans(loan_id),
+        FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+    );""",
+    # Amortization schedules (see amortization.py), one row per installment.
+    "loan_schedule": """
+    CREATE TABLE IF NOT EXISTS loan_schedule (
+        loan_id INTEGER NOT NULL,
+        installment_no INTEGER NOT NULL,
+        due_date TEXT NOT NULL,
+        payment INTEGER NOT NULL,
+        principal INTEGER NOT NULL,
+        interest INTEGER NOT NULL,
+        balance INTEGER NOT NULL, -- outstanding after this installment
+        PRIMARY KEY (loan_id, installment_no)
+    ) WITHOUT ROWID;""",
+    "eod_runs": """
+    CREATE TABLE IF NOT EXISTS eod_runs (
+        business_date TEXT PRIMARY KEY,
+        phase TEXT NOT NULL, -- deposits, loans, balances, done
+        cursor INTEGER NOT NULL DEFAULT 0, -- last account_id / loan_id committed in this phase
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    );""",
+    "income_daily": """
+    CREATE TABLE IF NOT EXISTS income_daily (
+        business_date TEXT NOT NULL,
+        item TEXT NOT NULL,
+        amount INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (business_date, item)
+    ) WITHOUT ROWID;""",
+    # Daily cash-flow rollup (see cashflow.py), built from transactions above the watermark.
+    "cashflow_daily": """
+    CREATE TABLE IF NOT EXISTS cashflow_daily (
+        day TEXT NOT NULL,
+        transaction_type TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        amount INTEGER NOT NULL DEFAULT 0,
+        inflow INTEGER NOT NULL DEFAULT 0, -- credited from outside the bank (no from_account_id)
+        outflow INTEGER NOT NULL DEFAULT 0, -- paid out of the bank (no to_account_id)
+        PRIMARY KEY (day, transaction_type)
+    ) WITHOUT ROWID;""",
+    "rollup_watermarks": """
+    CREATE TABLE IF NOT EXISTS rollup_watermarks (
+        rollup TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0 -- highest transaction_id already rolled up
+    );""",
+    # Archived months (see archive.py): one file per month of transactions and audit entries.
+    "archive_partitions": """
+    CREATE TABLE IF NOT EXISTS archive_partitions (
+        period TEXT PRIMARY KEY, -- YYYY-MM
+        path TEXT NOT NULL,
+        starts TEXT NOT NULL, -- first timestamp in the month
+        ends TEXT NOT NULL, -- first timestamp of the next month (exclusive)
+        transactions INTEGER NOT NULL DEFAULT 0,
+        audit_entries INTEGER NOT NULL DEFAULT 0,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );""",
+    # Per-account totals of the archived transactions, carried forward so reconciliation still balances.
+    "account_carry": """
+    CREATE TABLE IF NOT EXISTS account_carry (
+        account_id INTEGER PRIMARY KEY,
+        credits INTEGER NOT NULL DEFAULT 0,
+        debits INTEGER NOT NULL DEFAULT 0,
+        external_in INTEGER NOT NULL DEFAULT 0, -- credits with no from_account_id
+        external_out INTEGER NOT NULL DEFAULT 0, -- debits with no to_account_id
+        opening INTEGER NOT NULL DEFAULT 0, -- "Opening Balance" deposits
+        FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+    );""",
+}
+
+# Indexes backing the paginated transaction history, loan schedule lookups, approval queues and audit search
+INDEXES = list(HISTORY_INDEXES) + list(SCHEDULE_INDEXES) + list(APPROVAL_INDEXES) + list(AUDIT_INDEXES)
+
+
+# Columns converted from REAL dollars to INTEGER cents by migrate_money_to_cents().
+MONEY_COLUMNS = {"accounts": ["balance"], "transactions": ["amount"], "loans": ["loan_amount"]}
+
+
+def create_tables(conn):
+    for statement in TABLES.values():
+        conn.execute(statement)
+
+
+def _columns(conn, table):
+    return {row[1]: row[2].upper() for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def migrate_money_to_cents(conn):
+    """Rebuilds tables whose money columns are still REAL dollars as INTEGER cents.
+
+    SQLite cannot change a column's type in place (a REAL column would store
+    integers as floats again), so each table is recreated from its current
+    definition, copied across with the amounts rounded to the cent, and
+    swapped in. The caller runs this inside a transaction; indexes and the
+    summary rollup must be recreated afterwards. Returns the migrated tables.
+    """
+    migrated = []
+    for table, money_columns in MONEY_COLUMNS.items():
+        columns = _columns(conn, table)
+        if not columns or all(columns.get(c) == "INTEGER" for c in money_columns):
+            continue
+        names = list(columns)
+        select = ", ".join(f"CAST(ROUND({c} * 100) AS INTEGER)" if c in money_columns else c for c in names)
+        conn.execute(TABLES[table].replace(f"CREATE TABLE IF NOT EXISTS {table} (", f"CREATE TABLE {table}_cents ("))
+        conn.execute(f"INSERT INTO {table}_cents ({', '.join(names)}) SELECT {select} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_cents RENAME TO {table}")
+        migrated.append(table)
+    if migrated:
+        # Money sums in the rollup were floats; rebuild it in integer cents.
+        conn.execute("DROP TABLE IF EXISTS bank_summary")
+    return migrated
+
+
+def carry_legacy_openings(conn):
+    """Records the opening balances of accounts made before every account
+    had an "Opening Balance" transaction. The first seeder wrote balances
+    directly and approvals credited $10 without a row. Each account's
+    balance less the net of its transactions (archived ones included) is
+    added to ``account_carry.opening``, so reconcile.py balances.
+
+    Runs once, when upgrading from an earlier version. Later differences
+    are drift for reconcile.py to report. Returns the accounts carried.
+    """
+    if schema_version(conn) >= LEGACY_OPENINGS_VERSION:
+        return 0
+    return conn.execute("""
+        INSERT INTO account_carry (account_id, credits, external_in, opening)
+        SELECT account_id, gap, gap, gap FROM (
+            SELECT a.account_id, a.balance
+                - COALESCE((SELECT SUM(amount) FROM transactions WHERE to_account_id = a.account_id), 0)
+                + COALESCE((SELECT SUM(amount) FROM transactions WHERE from_account_id = a.account_id), 0)
+                - COALESCE(c.credits, 0) + COALESCE(c.debits, 0) AS gap
+            FROM accounts a LEFT JOIN account_carry c ON c.account_id = a.account_id
+        ) WHERE gap != 0
+        ON CONFLICT (account_id) DO UPDATE SET credits = credits + excluded.credits,
+            external_in = external_in + excluded.external_in, opening = opening + excluded.opening""").rowcount
+
+
+def create_indexes(conn):
+    for statement in INDEXES:
+        conn.execute(statement)
+
+
+def drop_indexes(conn):
+    """Drops the secondary indexes, e.g. ahead of a bulk load."""
+    for statement in INDEXES:
+        name = re.search(r"EXISTS (\w+)", statement).group(1)
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+# Schema changes in the order they were made. A database records the last
+# one it has had in ``PRAGMA user_version``, so each runs once per database.
+# Append a new step for every change and never edit a shipped one. The first
+# steps are idempotent, so files made before versioning adopt them safely.
+MIGRATIONS = [
+    (1, "base tables", create_tables),
+    (2, "money columns to integer cents", migrate_money_to_cents),
+    (3, "indexes", create_indexes),
+    (4, "bank summary rollup", create_summary),
+    (5, "audit full-text search", create_audit_search),
+    (6, "balance checkpoints", create_checkpoints),
+    (7, "legacy opening balances", carry_legacy_openings),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+LEGACY_OPENINGS_VERSION = 7
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Brings an autocommit connection's database up to ``SCHEMA_VERSION``.
+
+    An up-to-date file costs one header read. Otherwise the pending steps
+    run in one ``BEGIN IMMEDIATE`` transaction, so two processes starting at
+    once apply them only once. Returns the versions applied.
+    """
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current = schema_version(conn)
+        applied = []
+        for version, _, step in MIGRATIONS:
+            if version > current:
+                step(conn)
+                applied.append(version)
+        if applied:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return applied
+
+
+def create_schema(conn):
+    """Creates every table, index, rollup and search index that does not
+    exist yet, migrating money columns to integer cents first if needed,
+    and marks the file as being at ``SCHEMA_VERSION``. Runs inside the
+    caller's transaction; ``migrate`` is the once-only equivalent."""
+    for _, _, step in MIGRATIONS:
+        step(conn)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
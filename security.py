@@ -0,0 +1,10 @@
+"""Password hashing helpers shared by the app and the command-line tools."""
+import hashlib
+
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def verify_password(stored_hash, provided_password):
+    return stored_hash == hash_password(provided_password)
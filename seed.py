@@ -0,0 +1,317 @@
+"""Synthetic data generator for scale testing.
+
+Generates customers, accounts, loans and a transaction stream into a SQLite
+file, e.g.::
+
+    python seed.py scale.db --customers 200000 --transactions 5000000 --seed 7
+
+Rows are built in parallel worker processes, one chunk at a time, and loaded
+with ``executemany`` inside one large transaction per chunk while the
+database runs with relaxed PRAGMAs (no WAL, ``synchronous=OFF``) and without
+secondary indexes, which are rebuilt once at the end. Every chunk draws from
+its own RNG derived from the seed and the chunk number, and chunks are
+loaded in order, so the output is identical for a given seed no matter how
+many workers are used.
+
+The ``bank_summary`` triggers are dropped for the load as well and the
+rollup is rebuilt from the loaded rows.
+
+Every account gets an "Opening Balance" deposit, and final balances are set
+from the net of the generated transactions, so the ledger always reconciles.
+"""
+import argparse
+import os
+import random
+import time
+from bisect import bisect
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from database import connect
+from schema import create_indexes, create_schema, create_tables, drop_indexes, migrate_money_to_cents
+from security import hash_password
+from summary import drop_triggers, rebuild
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DEFAULT_MIX = {"Transfer": 0.6, "Deposit": 0.25, "Withdrawal": 0.15}
+
+SeedConfig = namedtuple(
+    "SeedConfig",
+    "seed customers transactions active_ratio loan_ratio start end mix amount_mu amount_sigma opening_min opening_max chunk_size",
+    defaults=(0, 20, 0, 0.5, 0.2, None, None, DEFAULT_MIX, 4.0, 1.2, 100, 50000, 50000),
+)
+SeedConfig.__doc__ = """Generator settings. Amount parameters are in dollars; rows are written in cents.
+
+``amount_mu``/``amount_sigma`` parametrize the log-normal transaction amount
+distribution; ``opening_min``/``opening_max`` bound the opening deposits."""
+
+# Relaxed settings for the duration of a bulk load; restored afterwards.
+BULK_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": -262144,
+}
+
+_accounts = None  # (account_id, account_number) pairs, set per worker process
+
+
+def _date_range(config):
+    end = config.end or datetime(2025, 1, 1)
+    start = config.start or end - timedelta(days=365)
+    return start, end
+
+
+def _name_pool(seed, size=1000):
+    from faker import Faker
+    fake = Faker()
+    fake.seed_instance(seed)
+    return [fake.first_name() for _ in range(size)], [fake.last_name() for _ in range(size)]
+
+
+def _customer_chunk(config, names, first_index, count, base_customer_id, base_account_id):
+    """Builds customers, accounts, opening deposits and loans for one chunk."""
+    rng = random.Random(f"{config.seed}:customers:{first_index}")
+    first_names, last_names = names
+    start, end = _date_range(config)
+    span = (end - start).total_seconds()
+    customers, accounts, loans, transactions = [], [], [], []
+
+    for index in range(first_index, first_index + count):
+        customer_id = base_customer_id + index
+        first_name, last_name = rng.choice(first_names), rng.choice(last_names)
+        status = 'Active' if rng.random() < config.active_ratio else 'Pending'
+        created = start - timedelta(seconds=rng.uniform(0, 365 * 86400))
+        created_at = created.strftime(TIMESTAMP_FORMAT)
+        customers.append((customer_id, first_name, last_name, f"{first_name.lower()}.{last_name.lower()}{index}@email.com",
+                          hash_password(f"custpass{index}"), status, created_at))
+        if status != 'Active':
+            continue
+
+        account_ids = []
+        for offset, (prefix, account_type) in enumerate((("SAV", "Savings"), ("CHK", "Checking"))):
+            account_id = base_account_id + 2 * index + offset
+            account_ids.append(account_id)
+            accounts.append((account_id, customer_id, f"{prefix}{str(customer_id).zfill(8)}", account_type, created_at))
+            opening = rng.randint(config.opening_min * 100, config.opening_max * 100)
+            transactions.append((None, account_id, 'Deposit', opening, 'Opening Balance', created_at))
+
+        if rng.random() < config.loan_ratio:
+            amount = rng.randrange(1000, 50000, 100) * 100
+            applied = start + timedelta(seconds=rng.uniform(0, span))
+            loan_status = rng.choices(['Approved', 'Pending', 'Rejected'], weights=[0.6, 0.3, 0.1])[0]
+            approved_at = None
+            if loan_status == 'Approved':
+                approved = applied + timedelta(days=rng.uniform(1, 14))
+                approved_at = approved.strftime(TIMESTAMP_FORMAT)
+                transactions.append((None, account_ids[0], 'Loan Disbursement', amount, None, approved_at))
+            loans.append((customer_id, amount, 5.0, rng.choice([12, 24, 36, 48, 60]), loan_status,
+                          applied.strftime(TIMESTAMP_FORMAT), approved_at))
+
+    return customers, accounts, loans, transactions
+
+
+def _set_accounts(accounts):
+    global _accounts
+    _accounts = accounts
+
+
+def _transaction_chunk(config, chunk_index, count, t0, t1):
+    """Builds ``count`` chronologically ordered transactions between t0 and t1
+    seconds after the start of the date range."""
+    rng = random.Random(f"{config.seed}:transactions:{chunk_index}")
+    accounts = _accounts
+    start, _ = _date_range(config)
+    types = list(config.mix)
+    cum_weights, total = [], 0.0
+    for kind in types:
+        total += config.mix[kind]
+        cum_weights.append(total)
+    mu, sigma = config.amount_mu, config.amount_sigma
+    midnight = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    shift = (start - midnight).total_seconds()
+    seconds = sorted(int(rng.uniform(t0, t1) + shift) for _ in range(count))
+    days = {}  # day offset -> "YYYY-MM-DD", formatted once per day instead of once per row
+
+    rows = []
+    for ts in seconds:
+        kind = types[bisect(cum_weights, rng.random() * total)]
+        amount = max(1, int(min(rng.lognormvariate(mu, sigma), 100000.0) * 100))
+        day, second = divmod(ts, 86400)
+        if day not in days:
+            days[day] = (midnight + timedelta(days=day)).strftime("%Y-%m-%d")
+        hour, second = divmod(second, 3600)
+        when = f"{days[day]} {hour:02d}:{second // 60:02d}:{second % 60:02d}"
+        index = int(rng.random() * len(accounts))
+        account_id, _ = accounts[index]
+        if kind == 'Transfer':
+            # Drawn from the other accounts, so every transfer is kept and the count is exact.
+            other = int(rng.random() * (len(accounts) - 1))
+            to_id, to_number = accounts[other + (other >= index)]
+            rows.append((account_id, to_id, kind, amount, f"To {to_number}: ", when))
+        elif kind == 'Withdrawal':
+            rows.append((account_id, None, kind, amount, 'Cash Withdrawal', when))
+        else:
+            rows.append((None, account_id, kind, amount, 'Cash/Check Deposit', when))
+    return rows
+
+
+class _InlineExecutor:
+    """Stands in for a process pool when ``workers == 1``."""
+
+    def __init__(self, initializer=None, initargs=()):
+        if initializer:
+            initializer(*initargs)
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _executor(workers, initializer=None, initargs=()):
+    if workers == 1:
+        return _InlineExecutor(initializer, initargs)
+    return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+
+
+def _settle_balances(conn, first_transaction_id, first_account_id):
+    """Sets balances of generated accounts to the net of their transactions,
+    topping up opening deposits so no account ends overdrawn."""
+    conn.execute("DROP TABLE IF EXISTS temp.seed_net")
+    conn.execute("CREATE TEMP TABLE seed_net (account_id INTEGER PRIMARY KEY, net INTEGER NOT NULL)")
+    conn.execute("""
+        INSERT INTO seed_net
+        SELECT account_id, SUM(delta) FROM (
+            SELECT to_account_id AS account_id, amount AS delta FROM transactions WHERE transaction_id >= ? AND to_account_id IS NOT NULL
+            UNION ALL
+            SELECT from_account_id, -amount FROM transactions WHERE transaction_id >= ? AND from_account_id IS NOT NULL
+        ) WHERE account_id >= ? GROUP BY account_id
+    """, (first_transaction_id, first_transaction_id, first_account_id))
+    conn.execute("""
+        UPDATE transactions SET amount = amount - (SELECT net FROM seed_net WHERE account_id = transactions.to_account_id)
+        WHERE transaction_id >= ? AND description = 'Opening Balance'
+          AND to_account_id IN (SELECT account_id FROM seed_net WHERE net < 0)
+    """, (first_transaction_id,))
+    conn.execute("""
+        UPDATE accounts SET balance = (SELECT MAX(net, 0) FROM seed_net WHERE seed_net.account_id = accounts.account_id)
+        WHERE account_id IN (SELECT account_id FROM seed_net)
+    """)
+    conn.execute("DROP TABLE temp.seed_net")
+
+
+def generate(db_name, config, workers=None, bulk=True, progress=None):
+    """Generates ``config.customers`` customers and ``config.transactions``
+    transactions into ``db_name``. Returns row counts and elapsed time.
+
+    ``bulk`` relaxes PRAGMAs and rebuilds indexes after the load; turn it off
+    when other connections have the database open.
+    """
+    progress = progress or (lambda message: None)
+    workers = workers or 1
+    started = time.perf_counter()
+    conn = connect(db_name, pragmas=BULK_PRAGMAS if bulk else None)
+    conn.execute("BEGIN")
+    if bulk:
+        create_tables(conn)
+        migrate_money_to_cents(conn)
+        drop_indexes(conn)
+        drop_triggers(conn)
+    else:
+        create_schema(conn)
+    conn.execute("COMMIT")
+
+    base_customer_id = conn.execute("SELECT COALESCE(MAX(customer_id), 0) + 1 FROM customers").fetchone()[0]
+    base_account_id = conn.execute("SELECT COALESCE(MAX(account_id), 0) + 1 FROM accounts").fetchone()[0]
+    first_transaction_id = conn.execute("SELECT COALESCE(MAX(transaction_id), 0) + 1 FROM transactions").fetchone()[0]
+    conn.execute("INSERT OR IGNORE INTO bank_staff (username, password_hash, role) VALUES (?, ?, ?)",
+                 ('admin', hash_password("adminpass"), 'Manager'))
+
+    names = _name_pool(config.seed)
+    chunk = config.chunk_size
+    starts = list(range(0, config.customers, chunk))
+    account_refs = []
+    counts = {"customers": 0, "accounts": 0, "loans": 0, "transactions": 0}
+
+    with _executor(workers) as pool:
+        results = pool.map(_customer_chunk, [config] * len(starts), [names] * len(starts), starts,
+                           [min(chunk, config.customers - s) for s in starts],
+                           [base_customer_id] * len(starts), [base_account_id] * len(starts))
+        for customers, accounts, loans, transactions in results:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO customers (customer_id, first_name, last_name, email, password_hash, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)", customers)
+            conn.executemany("INSERT INTO accounts (account_id, customer_id, account_number, account_type, created_at) VALUES (?, ?, ?, ?, ?)", accounts)
+            conn.executemany("INSERT INTO loans (customer_id, loan_amount, interest_rate, term_months, status, application_date, approval_date) VALUES (?, ?, ?, ?, ?, ?, ?)", loans)
+            conn.executemany("INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description, transaction_date) VALUES (?, ?, ?, ?, ?, ?)", transactions)
+            conn.execute("COMMIT")
+            account_refs.extend((row[0], row[2]) for row in accounts)
+            counts["customers"] += len(customers)
+            counts["accounts"] += len(accounts)
+            counts["loans"] += len(loans)
+            counts["transactions"] += len(transactions)
+        progress(f"{counts['customers']:,} customers, {counts['accounts']:,} accounts, {counts['loans']:,} loans")
+
+    if config.transactions and len(account_refs) > 1:
+        start, end = _date_range(config)
+        sizes = [min(chunk, config.transactions - s) for s in range(0, config.transactions, chunk)]
+        step = (end - start).total_seconds() / len(sizes)
+        with _executor(workers, _set_accounts, (account_refs,)) as pool:
+            results = pool.map(_transaction_chunk, [config] * len(sizes), range(len(sizes)), sizes,
+                               [i * step for i in range(len(sizes))],
+                               [(i + 1) * step for i in range(len(sizes))])
+            for rows in results:
+                conn.execute("BEGIN")
+                conn.executemany("INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description, transaction_date) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+                counts["transactions"] += len(rows)
+                progress(f"{counts['transactions']:,} transactions")
+
+    conn.execute("BEGIN")
+    _settle_balances(conn, first_transaction_id, base_account_id)
+    conn.execute("COMMIT")
+    create_indexes(conn)
+    if bulk:
+        conn.execute("BEGIN")
+        create_schema(conn)  # what the bulk load skipped, and PRAGMA user_version, as without bulk
+        rebuild(conn)
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic banking database.")
+    parser.add_argument("db", help="SQLite file to create or extend")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--active-ratio", type=float, default=0.9, help="share of customers that are approved")
+    parser.add_argument("--loan-ratio", type=float, default=0.2, help="share of active customers with a loan")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="first transaction date (default: a year before --end)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="last transaction date (default: 2025-01-01)")
+    parser.add_argument("--mix", default="Transfer=0.6,Deposit=0.25,Withdrawal=0.15",
+                        help="relative weights of transaction types")
+    parser.add_argument("--amount-mu", type=float, default=4.0, help="mean of log(amount)")
+    parser.add_argument("--amount-sigma", type=float, default=1.2, help="standard deviation of log(amount)")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    mix = {kind: float(weight) for kind, weight in (item.split("=") for item in args.mix.split(","))}
+    config = SeedConfig(seed=args.seed, customers=args.customers, transactions=args.transactions,
+                        active_ratio=args.active_ratio, loan_ratio=args.loan_ratio, start=args.start, end=args.end,
+                        mix=mix, amount_mu=args.amount_mu, amount_sigma=args.amount_sigma, chunk_size=args.chunk_size)
+    counts = generate(args.db, config, workers=args.workers or os.cpu_count(), progress=print)
+    print(f"Done in {counts['seconds']}s: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Read-only reporting snapshots.
+
+Staff reports (the dashboard, financial reports, the audit log and ledger
+exports) read a consistent copy of the database instead of the live file
+that postings write to, so a month-end report never competes with a
+customer's transfer.
+
+A copy is taken with SQLite's online backup API, ``step_pages`` pages at a
+time. Each step holds a read snapshot only briefly, and in WAL mode a reader
+never blocks a writer. If the live file changes between steps, SQLite
+restarts the backup. After ``max_restarts`` restarts (under heavy posting
+load) the copy is finished in a single step instead. That step still reads
+from one snapshot and still does not block writers.
+
+Before a copy is published, the cash-flow rollup is caught up inside the
+copy itself. Reports therefore never read a stale rollup, and the catch-up
+never writes to the live file. The copy is then only ever opened read-only.
+It is either a file (written under a temporary name and renamed into place)
+or a shared in-memory database.
+
+``SnapshotManager`` takes a new copy every ``interval`` seconds from a
+background thread and keeps the newest ``keep``.
+
+    python snapshots.py banking_v2.db               # one snapshot into snapshots/
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import cashflow
+from database import Database, connect
+from schema import create_tables
+
+SNAPSHOT_DIR = "snapshots"
+STEP_PAGES = 1024
+MAX_RESTARTS = 3
+
+_memory_ids = itertools.count(1)
+
+
+class _Restarted(Exception):
+    pass
+
+
+class Snapshot:
+    """One published copy. ``name`` (a path or a ``file:`` URI) opens it with
+    ``database.connect(name, read_only=True)``."""
+
+    def __init__(self, name, taken_at, seconds, pages, restarts, holder=None):
+        self.name = name
+        self.taken_at = taken_at
+        self.seconds = seconds
+        self.pages = pages
+        self.restarts = restarts
+        self._holder = holder  # keeps a shared in-memory copy alive
+
+    def discard(self):
+        if self._holder is not None:
+            self._holder.close()
+        elif os.path.exists(self.name):
+            os.remove(self.name)  # open readers keep their handle until they close
+
+
+def _copy(source, target, step_pages, pause, max_restarts):
+    """Backs ``source`` up into ``target``; returns ``(pages, restarts)``."""
+    state = {"remaining": None, "total": 0, "restarts": 0}
+
+    def progress(status, remaining, total):
+        state["total"] = total
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > max_restarts:
+                raise _Restarted()
+        state["remaining"] = remaining
+
+    try:
+        source.backup(target, pages=step_pages, progress=progress, sleep=pause)
+    except _Restarted:
+        source.backup(target, pages=-1)
+    return state["total"], state["restarts"]
+
+
+def take_snapshot(db_name, target=None, memory=False, step_pages=STEP_PAGES, pause=0.0, max_restarts=MAX_RESTARTS):
+    """Copies ``db_name`` into ``target`` (default: a timestamped file under
+    ``SNAPSHOT_DIR``), or into a shared in-memory database if ``memory``.
+    ``pause`` is the sleep between steps, in seconds. Returns a ``Snapshot``."""
+    started = time.perf_counter()
+    taken_at = datetime.now()
+    if memory:
+        name = f"file:bank-snapshot-{os.getpid()}-{next(_memory_ids)}?mode=memory&cache=shared"
+        copy = sqlite3.connect(name, uri=True, isolation_level=None, check_same_thread=False)
+    else:
+        name = target or os.path.join(SNAPSHOT_DIR, f"{Path(db_name).stem}-{taken_at:%Y%m%dT%H%M%S%f}.db")
+        os.makedirs(os.path.dirname(name) or ".", exist_ok=True)
+        copy = sqlite3.connect(f"{name}.tmp", isolation_level=None)
+    source = connect(db_name, read_only=True)
+    try:
+        pages, restarts = _copy(source, copy, step_pages, pause, max_restarts)
+        if not memory:
+            copy.execute("PRAGMA journal_mode = DELETE")  # a single self-contained file
+        copy.execute("BEGIN IMMEDIATE")
+        create_tables(copy)  # a file made before the rollup existed gets it built here
+        while cashflow.catch_up(copy):
+            pass
+        copy.execute("COMMIT")
+    except BaseException:
+        copy.close()
+        if not memory and os.path.exists(f"{name}.tmp"):
+            os.remove(f"{name}.tmp")
+        raise
+    finally:
+        source.close()
+    if not memory:
+        copy.close()
+        os.replace(f"{name}.tmp", name)
+    return Snapshot(name, taken_at, round(time.perf_counter() - started, 2), pages, restarts,
+                    holder=copy if memory else None)
+
+
+class SnapshotManager:
+    """Keeps a recent snapshot of ``db_name`` for reporting.
+
+    ``refresh()`` takes a snapshot now; ``start()`` also takes one every
+    ``interval`` seconds in the background. ``current()`` returns the newest
+    ``Snapshot`` (for its ``taken_at``) and a read-only ``Database`` over it,
+    or ``(None, None)`` until the first one is ready. Older snapshots stay
+    open until ``keep`` newer ones exist, so a report that started on one
+    can finish on it.
+    """
+
+    def __init__(self, db_name, interval=300, keep=2, memory=False, directory=SNAPSHOT_DIR, metrics=None, **snapshot_kwargs):
+        self.db_name = db_name
+        self.interval = interval
+        self.keep = max(1, keep)
+        self.memory = memory
+        self.directory = directory
+        self.metrics = metrics
+        self.snapshot_kwargs = snapshot_kwargs
+        self.last_error = None
+        self._published = []  # (Snapshot, Database), oldest first
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Takes and publishes a new snapshot; returns it."""
+        with self._refreshing:
+            target = None if self.memory else os.path.join(
+                self.directory, f"{Path(self.db_name).stem}-{datetime.now():%Y%m%dT%H%M%S%f}.db")
+            snapshot = take_snapshot(self.db_name, target, memory=self.memory, **self.snapshot_kwargs)
+            database = Database(snapshot.name, read_only=True, metrics=self.metrics)
+            with self._lock:
+                self._published.append((snapshot, database))
+                retired, self._published = self._published[:-self.keep], self._published[-self.keep:]
+            for old, old_database in retired:
+                old_database.close()
+                old.discard()
+            return snapshot
+
+    def current(self):
+        with self._lock:
+            return self._published[-1] if self._published else (None, None)
+
+    def sweep(self):
+        """Removes copies of ``db_name`` left in ``directory`` by earlier processes
+        (including half-written ``.tmp`` files). Anything younger than ``keep + 1``
+        intervals may still be in use by another server and is left alone."""
+        cutoff = time.time() - self.interval * (self.keep + 1)
+        for path in Path(self.directory).glob(f"{Path(self.db_name).stem}-*.db*"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def start(self):
+        """Starts refreshing in the background (the first snapshot is taken right away)."""
+        if self._thread is None:
+            if not self.memory:
+                self.sweep()
+            self._thread = threading.Thread(target=self._run, name="snapshot-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:  # keep serving the previous snapshot; try again next interval
+                self.last_error = e
+            self._stop.wait(self.interval)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            published, self._published = self._published, []
+        for snapshot, database in published:
+            database.close()
+            snapshot.discard()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Take a consistent read-only snapshot of the bank for reporting.")
+    parser.add_argument("db", help="live SQLite file")
+    parser.add_argument("--out", help=f"snapshot file (default: a timestamped file under {SNAPSHOT_DIR}/)")
+    parser.add_argument("--step-pages", type=int, default=STEP_PAGES, help="pages copied per backup step")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between steps")
+    args = parser.parse_args(argv)
+
+    snapshot = take_snapshot(args.db, args.out, step_pages=args.step_pages, pause=args.pause)
+    print(f"Snapshot {snapshot.name} as of {snapshot.taken_at:%Y-%m-%d %H:%M:%S}: "
+          f"{snapshot.pages:,} pages in {snapshot.seconds}s ({snapshot.restarts} restart(s)).")
+
+
+if __name__ == "__main__":
+    main()
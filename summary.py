@@ -0,0 +1,200 @@
+"""Incrementally maintained bank-wide aggregates.
+
+``bank_summary`` holds one row per (metric, dimension):
+
+    customers       / status        number of customers
+    accounts        / account_type  number of accounts
+    deposits        / account_type  sum of balances (cents)
+    loans           / status        number of loans
+    loan_principal  / status        sum of loan_amount (cents)
+    loan_repaid     / 'all'         principal repaid on scheduled loans (cents)
+
+Triggers on ``customers``, ``accounts``, ``loans`` and ``loan_positions``
+keep it current on every write, whichever code path makes it, so the staff
+dashboard and the balance sheet read a handful of rows instead of scanning
+whole tables.
+
+``python summary.py banking_v2.db`` recomputes the figures from scratch and
+reports any drift; ``--repair`` rebuilds the table.
+"""
+import argparse
+import sys
+
+SUMMARY_TABLE = """
+    CREATE TABLE IF NOT EXISTS bank_summary (
+        metric TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (metric, dimension)
+    ) WITHOUT ROWID;"""
+
+_BUMP = """INSERT INTO bank_summary (metric, dimension, value) VALUES ('{metric}', {dimension}, {delta})
+        ON CONFLICT (metric, dimension) DO UPDATE SET value = value + excluded.value;"""
+
+
+def _bump(metric, dimension, delta):
+    return _BUMP.format(metric=metric, dimension=dimension, delta=delta)
+
+
+SUMMARY_TRIGGERS = {
+    "trg_summary_customers_insert": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_customers_insert AFTER INSERT ON customers BEGIN
+        {_bump('customers', 'NEW.status', 1)}
+    END;""",
+    "trg_summary_customers_delete": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_customers_delete AFTER DELETE ON customers BEGIN
+        {_bump('customers', 'OLD.status', -1)}
+    END;""",
+    "trg_summary_customers_status": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_customers_status AFTER UPDATE OF status ON customers
+    WHEN OLD.status IS NOT NEW.status BEGIN
+        {_bump('customers', 'OLD.status', -1)}
+        {_bump('customers', 'NEW.status', 1)}
+    END;""",
+    "trg_summary_accounts_insert": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_accounts_insert AFTER INSERT ON accounts BEGIN
+        {_bump('accounts', 'NEW.account_type', 1)}
+        {_bump('deposits', 'NEW.account_type', 'NEW.balance')}
+    END;""",
+    "trg_summary_accounts_delete": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_accounts_delete AFTER DELETE ON accounts BEGIN
+        {_bump('accounts', 'OLD.account_type', -1)}
+        {_bump('deposits', 'OLD.account_type', '-OLD.balance')}
+    END;""",
+    # Hot path: every posting updates a balance. One upsert with the delta.
+    "trg_summary_accounts_balance": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_accounts_balance AFTER UPDATE OF balance ON accounts
+    WHEN OLD.account_type = NEW.account_type AND OLD.balance IS NOT NEW.balance BEGIN
+        {_bump('deposits', 'NEW.account_type', 'NEW.balance - OLD.balance')}
+    END;""",
+    "trg_summary_accounts_type": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_accounts_type AFTER UPDATE OF account_type ON accounts
+    WHEN OLD.account_type IS NOT NEW.account_type BEGIN
+        {_bump('accounts', 'OLD.account_type', -1)}
+        {_bump('accounts', 'NEW.account_type', 1)}
+        {_bump('deposits', 'OLD.account_type', '-OLD.balance')}
+        {_bump('deposits', 'NEW.account_type', 'NEW.balance')}
+    END;""",
+    "trg_summary_loans_insert": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_loans_insert AFTER INSERT ON loans BEGIN
+        {_bump('loans', 'NEW.status', 1)}
+        {_bump('loan_principal', 'NEW.status', 'NEW.loan_amount')}
+    END;""",
+    "trg_summary_loans_delete": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_loans_delete AFTER DELETE ON loans BEGIN
+        {_bump('loans', 'OLD.status', -1)}
+        {_bump('loan_principal', 'OLD.status', '-OLD.loan_amount')}
+    END;""",
+    "trg_summary_loans_update": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_loans_update AFTER UPDATE OF status, loan_amount ON loans
+    WHEN OLD.status IS NOT NEW.status OR OLD.loan_amount IS NOT NEW.loan_amount BEGIN
+        {_bump('loans', 'OLD.status', -1)}
+        {_bump('loans', 'NEW.status', 1)}
+        {_bump('loan_principal', 'OLD.status', '-OLD.loan_amount')}
+        {_bump('loan_principal', 'NEW.status', 'NEW.loan_amount')}
+    END;""",
+    "trg_summary_positions_insert": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_positions_insert AFTER INSERT ON loan_positions BEGIN
+        {_bump('loan_repaid', "'all'", '(SELECT loan_amount FROM loans WHERE loan_id = NEW.loan_id) - NEW.principal')}
+    END;""",
+    "trg_summary_positions_delete": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_positions_delete AFTER DELETE ON loan_positions BEGIN
+        {_bump('loan_repaid', "'all'", 'OLD.principal - (SELECT loan_amount FROM loans WHERE loan_id = OLD.loan_id)')}
+    END;""",
+    "trg_summary_positions_principal": f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_positions_principal AFTER UPDATE OF principal ON loan_positions
+    WHEN OLD.principal IS NOT NEW.principal BEGIN
+        {_bump('loan_repaid', "'all'", 'OLD.principal - NEW.principal')}
+    END;""",
+}
+
+# The same figures computed from the base tables.
+_FROM_SCRATCH = """
+    SELECT 'customers', status, COUNT(*) FROM customers GROUP BY status
+    UNION ALL SELECT 'accounts', account_type, COUNT(*) FROM accounts GROUP BY account_type
+    UNION ALL SELECT 'deposits', account_type, COALESCE(SUM(balance), 0) FROM accounts GROUP BY account_type
+    UNION ALL SELECT 'loans', status, COUNT(*) FROM loans GROUP BY status
+    UNION ALL SELECT 'loan_principal', status, COALESCE(SUM(loan_amount), 0) FROM loans GROUP BY status
+    UNION ALL SELECT 'loan_repaid', 'all', COALESCE(SUM(l.loan_amount - p.principal), 0)
+        FROM loan_positions p JOIN loans l ON l.loan_id = p.loan_id
+"""
+
+
+def create_summary(conn):
+    """Creates the summary table and its triggers, populating the table if it is new."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bank_summary'").fetchone()
+    conn.execute(SUMMARY_TABLE)
+    create_triggers(conn)
+    if not exists:
+        rebuild(conn)
+
+
+def create_triggers(conn):
+    for statement in SUMMARY_TRIGGERS.values():
+        conn.execute(statement)
+
+
+def drop_triggers(conn):
+    """Drops the maintenance triggers, e.g. ahead of a bulk load; call ``rebuild`` afterwards."""
+    for name in SUMMARY_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild(conn):
+    """Replaces the summary with figures recomputed from the base tables."""
+    conn.execute("DELETE FROM bank_summary")
+    conn.execute(f"INSERT INTO bank_summary (metric, dimension, value) {_FROM_SCRATCH}")
+
+
+def read_summary(db):
+    """Returns ``{(metric, dimension): value}``."""
+    return {(metric, dimension): value for metric, dimension, value in
+            db.fetch_all("SELECT metric, dimension, value FROM bank_summary")}
+
+
+def total(summary, metric, dimension=None):
+    """Sums one metric over all dimensions, or returns a single cell."""
+    if dimension is not None:
+        return summary.get((metric, dimension), 0)
+    return sum(value for (m, _), value in summary.items() if m == metric)
+
+
+def verify(conn, tolerance=0):
+    """Returns ``(metric, dimension, stored, actual)`` for every cell that drifted."""
+    stored = {(m, d): v for m, d, v in conn.execute("SELECT metric, dimension, value FROM bank_summary")}
+    actual = {(m, d): v for m, d, v in conn.execute(_FROM_SCRATCH)}
+    drift = []
+    for key in sorted(set(stored) | set(actual)):
+        s, a = stored.get(key, 0), actual.get(key, 0)
+        if abs(s - a) > tolerance:
+            drift.append((key[0], key[1], s, a))
+    return drift
+
+
+def main(argv=None):
+    from database import connect
+
+    parser = argparse.ArgumentParser(description="Verify the bank_summary rollup against the base tables.")
+    parser.add_argument("db", help="SQLite file to check")
+    parser.add_argument("--repair", action="store_true", help="rebuild the summary if it has drifted")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    conn.execute("BEGIN")
+    create_summary(conn)
+    drift = verify(conn)
+    for metric, dimension, stored, actual in drift:
+        print(f"DRIFT {metric}/{dimension}: stored={stored} actual={actual} diff={stored - actual:+}")
+    if drift and args.repair:
+        rebuild(conn)
+        print("Summary rebuilt.")
+    conn.execute("COMMIT")
+    conn.close()
+    if not drift:
+        print("bank_summary matches the base tables.")
+    elif not args.repair:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Velocity and anomaly screening for debits.
+
+``VelocityScreen`` keeps, for every account that has been debited recently,
+the count, sum and largest amount of its debits over the last minute, hour
+and day. Each window is a ring of fixed-width buckets:
+
+    minute   6 buckets of 10 seconds
+    hour    12 buckets of 5 minutes
+    day     24 buckets of 1 hour
+
+A window's running count and sum are adjusted as buckets enter and leave the
+ring, and its maximum is taken over at most 24 buckets. A check therefore
+costs the same however many transactions an account has. The windows are
+as precise as their buckets: "the last minute" is the current 10-second
+bucket plus the five before it. One account's state is a single
+``array('q')`` of 135 integers (about 1 KB). Accounts idle for a day are
+dropped.
+
+``check()`` evaluates the rules against a debit before it is posted. A
+``block`` hit declines the debit; a ``flag`` hit lets it through. Either
+way the hit is written to ``audit_log`` through the ``AuditWriter``. A debit
+that is not declined is added to the windows at once, so a later failure in
+the ledger still counts against the account. ``warm()`` replays the last
+day of debits from ``transactions`` at startup. A caller that screens while
+holding locks of its own (the ledger engine) calls ``evaluate()`` there and
+``record()`` once it has let go, since a strict audit writer commits each
+hit.
+
+Only debits posted through the screening caller (the ledger engine) are
+counted after warm-up. End-of-day collections and bulk ingests are seen
+only by the next ``warm()``.
+"""
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from database import connect
+from money import format_money
+
+# name, bucket width in seconds, number of buckets
+WINDOWS = (("minute", 10, 6), ("hour", 300, 12), ("day", 3600, 24))
+
+# A rule measures one window: "count" and "sum" include the debit being
+# checked; "spike" compares its amount with ``limit`` times the largest
+# debit already in the window (needs ``SPIKE_HISTORY`` earlier debits).
+Rule = namedtuple("Rule", "name window measure limit action")
+
+MEASURES = ("count", "sum", "spike")
+ACTIONS = ("block", "flag")
+SPIKE_HISTORY = 3
+
+# Money limits are in cents.
+DEFAULT_RULES = (
+    Rule("Rapid debits", "minute", "count", 5, "block"),
+    Rule("Daily outflow limit", "day", "sum", 2_500_000, "block"),
+    Rule("High hourly debit count", "hour", "count", 30, "flag"),
+    Rule("High hourly outflow", "hour", "sum", 1_000_000, "flag"),
+    Rule("Unusually large debit", "day", "spike", 10, "flag"),
+)
+
+HIT_ACTION = "Velocity Rule Hit"
+
+
+def _layout():
+    """Offsets of each window in an account's array, which holds per window
+    [newest bucket, count, sum, counts..., sums..., maxes...]. Slot ``b %
+    buckets`` holds bucket ``b``, for the ``buckets`` buckets up to the newest."""
+    layout, size = {}, 0
+    for name, width, buckets in WINDOWS:
+        layout[name] = (size, width, buckets)
+        size += 3 + 3 * buckets
+    return layout, size
+
+
+_LAYOUT, _STATE_SIZE = _layout()
+_ZEROS = {buckets: array("q", bytes(8 * 3 * buckets)) for _, _, buckets in WINDOWS}
+_DAY = max(width * buckets for _, width, buckets in WINDOWS)
+
+
+def _advance(state, offset, buckets, bucket):
+    """Moves a window forward to ``bucket``, retiring the buckets that fall out of it."""
+    last = state[offset]
+    if bucket <= last:
+        return
+    counts = offset + 3
+    if bucket - last >= buckets:
+        state[offset + 1] = state[offset + 2] = 0
+        state[counts:counts + 3 * buckets] = _ZEROS[buckets]
+    else:
+        sums, maxes = counts + buckets, counts + 2 * buckets
+        for b in range(last + 1, bucket + 1):
+            slot = b % buckets
+            state[offset + 1] -= state[counts + slot]
+            state[offset + 2] -= state[sums + slot]
+            state[counts + slot] = state[sums + slot] = state[maxes + slot] = 0
+    state[offset] = bucket
+
+
+def _add(state, offset, buckets, bucket, cents):
+    """Counts a debit in ``bucket``; the window must already be advanced to it or past it."""
+    if bucket <= state[offset] - buckets:
+        return  # older than the window
+    counts = offset + 3
+    sums, maxes = counts + buckets, counts + 2 * buckets
+    slot = bucket % buckets
+    state[counts + slot] += 1
+    state[sums + slot] += cents
+    if cents > state[maxes + slot]:
+        state[maxes + slot] = cents
+    state[offset + 1] += 1
+    state[offset + 2] += cents
+
+
+def _window_max(state, offset, buckets):
+    maxes = offset + 3 + 2 * buckets
+    return max(state[maxes:maxes + buckets])
+
+
+def _exceeds(rule, state, offset, buckets, cents):
+    """Returns the figure that breaks ``rule`` with this debit included, or None."""
+    if rule.measure == "count":
+        figure = state[offset + 1] + 1
+    elif rule.measure == "sum":
+        figure = state[offset + 2] + cents
+    else:
+        if state[offset + 1] < SPIKE_HISTORY:
+            return None
+        largest = _window_max(state, offset, buckets)
+        return largest if cents > rule.limit * largest else None
+    return figure if figure > rule.limit else None
+
+
+class _Part:
+    __slots__ = ("lock", "accounts", "next_sweep")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accounts = {}  # account_id -> array('q') of _STATE_SIZE
+        self.next_sweep = 0.0
+
+
+class VelocityScreen:
+    """Per-account sliding-window limits on debits.
+
+    State is split over ``parts`` partitions by account id, each with its
+    own lock, so checks on different accounts rarely contend. ``audit`` is
+    the ``AuditWriter`` that records rule hits (hits are only counted
+    without one).
+    """
+
+    def __init__(self, rules=DEFAULT_RULES, audit=None, parts=256):
+        for rule in rules:
+            if rule.window not in _LAYOUT or rule.measure not in MEASURES or rule.action not in ACTIONS:
+                raise ValueError(f"Invalid velocity rule: {rule!r}")
+        self.rules = tuple(rules)
+        self._rules = [(rule, *_LAYOUT[rule.window]) for rule in self.rules]  # (rule, offset, width, buckets)
+        self.audit = audit
+        self._parts = [_Part() for _ in range(parts)]
+        self._hits_lock = threading.Lock()
+        self.hits = {rule.name: 0 for rule in self.rules}
+
+    # --- Public API ---
+    def check(self, account_id, cents, now=None, user_id="system"):
+        """Screens a debit of ``cents`` from ``account_id`` at ``now`` (epoch
+        seconds, default the current time). Returns the first ``block`` rule
+        it hits, or None if the debit may go ahead (it is then counted)."""
+        blocked, hits = self.evaluate(account_id, cents, now)
+        if hits:
+            self.record(account_id, cents, blocked, hits, user_id)
+        return blocked
+
+    def evaluate(self, account_id, cents, now=None):
+        """``check`` without recording the hits. Returns ``(blocked, hits)``,
+        ``hits`` being ``(rule, figure)`` pairs for ``record``."""
+        now = time.time() if now is None else now
+        part = self._parts[account_id % len(self._parts)]
+        with part.lock:
+            state = part.accounts.get(account_id)
+            if state is None:
+                if now >= part.next_sweep:
+                    self._sweep(part, now)
+                state = part.accounts[account_id] = array("q", bytes(8 * _STATE_SIZE))
+            windows = [(offset, buckets, int(now // width)) for offset, width, buckets in _LAYOUT.values()]
+            for offset, buckets, bucket in windows:
+                _advance(state, offset, buckets, bucket)
+            hits = [(rule, figure) for rule, offset, _, buckets in self._rules
+                    if (figure := _exceeds(rule, state, offset, buckets, cents)) is not None]
+            blocked = next((rule for rule, _ in hits if rule.action == "block"), None)
+            if blocked is None:
+                for offset, buckets, bucket in windows:
+                    _add(state, offset, buckets, bucket, cents)
+        return blocked, hits
+
+    def record(self, account_id, cents, blocked, hits, user_id="system"):
+        """Counts the hits returned by ``evaluate`` and writes them to the audit log."""
+        with self._hits_lock:
+            for rule, _ in hits:
+                self.hits[rule.name] += 1
+        if self.audit is None:
+            return
+        for rule, figure in hits:
+            if rule.measure == "count":
+                detail = f"{figure} debits in the last {rule.window} (limit {rule.limit})"
+            elif rule.measure == "sum":
+                detail = f"{format_money(figure)} debited in the last {rule.window} (limit {format_money(rule.limit)})"
+            else:
+                detail = f"more than {rule.limit}x the largest debit in the last {rule.window} ({format_money(figure)})"
+            outcome = "declined" if rule is blocked else ("not posted" if blocked else "allowed")
+            self.audit.log(user_id, HIT_ACTION, f"{rule.name} ({rule.action}) on account {account_id}: "
+                                                f"debit of {format_money(cents)}, {detail}; {outcome}")
+
+    def window(self, account_id, name, now=None):
+        """Returns ``(count, sum, max)`` of an account's debits in window ``name``."""
+        now = time.time() if now is None else now
+        offset, width, buckets = _LAYOUT[name]
+        part = self._parts[account_id % len(self._parts)]
+        with part.lock:
+            state = part.accounts.get(account_id)
+            if state is None:
+                return 0, 0, 0
+            _advance(state, offset, buckets, int(now // width))
+            return state[offset + 1], state[offset + 2], _window_max(state, offset, buckets)
+
+    def warm(self, db_name, now=None):
+        """Loads the last day of debits from ``transactions``. Returns how many were replayed."""
+        now = time.time() if now is None else now
+        conn = connect(db_name, read_only=True)
+        try:
+            rows = conn.execute("""
+                SELECT from_account_id, CAST(strftime('%s', transaction_date) AS INTEGER), amount FROM transactions
+                WHERE transaction_date >= datetime(?, 'unixepoch') AND from_account_id IS NOT NULL
+                ORDER BY transaction_date""", (int(now - _DAY),)).fetchall()
+        finally:
+            conn.close()
+        for account_id, at, cents in rows:
+            self._replay(account_id, at, cents)
+        return len(rows)
+
+    # --- Internals ---
+    def _replay(self, account_id, at, cents):
+        part = self._parts[account_id % len(self._parts)]
+        with part.lock:
+            state = part.accounts.get(account_id)
+            if state is None:
+                state = part.accounts[account_id] = array("q", bytes(8 * _STATE_SIZE))
+            for offset, width, buckets in _LAYOUT.values():
+                bucket = int(at // width)
+                _advance(state, offset, buckets, bucket)
+                _add(state, offset, buckets, bucket, cents)
+
+    @staticmethod
+    def _sweep(part, now):
+        """Drops accounts with no debit in the last day; runs at most hourly per part."""
+        offset, width, _ = _LAYOUT["day"]
+        oldest = int((now - _DAY) // width)
+        for account_id in [a for a, state in part.accounts.items() if state[offset] <= oldest]:
+            del part.accounts[account_id]
+        part.next_sweep = now + 3600